@@ -0,0 +1,268 @@
+"""Client-side microbenchmarks, run against the in-process stand-in server.
+
+Usage::
+
+    python -m benchmarks.run [-k FILTER] [--save results.json]
+                             [--compare baseline.json] [--threshold 0.1]
+
+Each benchmark reports its throughput, latency percentiles and the peak
+memory allocated while it runs. Results saved with ``--save`` can be given
+to ``--compare`` later on: a benchmark whose median latency grew by more than
+the threshold is reported as a regression and the command exits with 1.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import subprocess
+import sys
+import timeit
+import tracemalloc
+
+import requests
+from requests_hawk import HawkAuth
+
+from benchmarks.server import StandInServer
+from syncclient.cache import RecordCache
+from syncclient.client import SyncClient, TokenserverClient
+from syncclient.hawk import HawkSigner
+
+BENCHMARKS = []
+
+
+def benchmark(iterations):
+    """Register a benchmark. The decorated function receives the stand-in
+    server and a client, and returns the callable to measure.
+    """
+    def register(func):
+        BENCHMARKS.append((func.__name__, iterations, func))
+        return func
+    return register
+
+
+def _prepared_request(method, url, body=None):
+    headers = {}
+    if body is not None:
+        headers['Content-Type'] = 'application/json; charset=utf-8'
+    return requests.Request(method, url, data=body, headers=headers).prepare()
+
+
+@benchmark(iterations=500)
+def get_records_small_page(server, client):
+    server.store.populate('small', 10)
+    return lambda: client.get_records('small')
+
+
+@benchmark(iterations=10)
+def get_records_huge_page(server, client):
+    server.store.populate('huge', 10000)
+    return lambda: client.get_records('huge')
+
+
+@benchmark(iterations=500)
+def get_record(server, client):
+    server.store.populate('single', 1)
+    return lambda: client.get_record('single', 'single-00000000')
+
+
+@benchmark(iterations=500)
+def get_record_cached(server, client):
+    server.store.populate('cached', 1)
+    cached_client = SyncClient(session=client.session,
+                               record_cache=RecordCache(),
+                               **server.credentials)
+    return lambda: cached_client.get_record('cached', 'cached-00000000')
+
+
+@benchmark(iterations=500)
+def put_record(server, client):
+    record = {'id': 'record', 'payload': 'x' * 300}
+    return lambda: client.put_record('put', record)
+
+
+@benchmark(iterations=20)
+def post_records(server, client):
+    records = [{'id': 'record-%d' % idx, 'payload': 'x' * 300}
+               for idx in range(1000)]
+    return lambda: client.post_records('post', records)
+
+
+@benchmark(iterations=20)
+def post_records_gzip(server, client):
+    gzip_client = SyncClient(session=client.session, upload_encoding='gzip',
+                             **server.credentials)
+    records = [{'id': 'record-%d' % idx, 'payload': 'x' * 300}
+               for idx in range(1000)]
+    return lambda: gzip_client.post_records('post', records)
+
+
+@benchmark(iterations=5000)
+def hawk_sign_get(server, client):
+    auth = HawkAuth(id='hawk-id', key='hawk-key', algorithm='sha256',
+                    always_hash_content=False)
+    request = _prepared_request('GET', server.url + '1.5/1234/info/quota')
+    return lambda: auth(request)
+
+
+@benchmark(iterations=500)
+def hawk_sign_large_put(server, client):
+    auth = HawkAuth(id='hawk-id', key='hawk-key', algorithm='sha256')
+    request = _prepared_request('PUT', server.url + '1.5/1234/storage/a/b',
+                                json.dumps({'payload': 'x' * 256 * 1024}))
+    return lambda: auth(request)
+
+
+@benchmark(iterations=5000)
+def hawk_signer_get(server, client):
+    signer = HawkSigner(id='hawk-id', key='hawk-key', algorithm='sha256')
+    request = _prepared_request('GET', server.url + '1.5/1234/info/quota')
+    return lambda: signer(request)
+
+
+@benchmark(iterations=500)
+def hawk_signer_large_put(server, client):
+    signer = HawkSigner(id='hawk-id', key='hawk-key', algorithm='sha256')
+    request = _prepared_request('PUT', server.url + '1.5/1234/storage/a/b',
+                                json.dumps({'payload': 'x' * 256 * 1024}))
+    return lambda: signer(request)
+
+
+@benchmark(iterations=20)
+def json_decode_huge_page(server, client):
+    body = json.dumps([{'id': 'record-%d' % idx, 'modified': 1234.56,
+                        'payload': 'x' * 300} for idx in range(10000)])
+    return lambda: json.loads(body)
+
+
+@benchmark(iterations=200)
+def token_exchange(server, client):
+    ts_client = TokenserverClient('assertion', 'client-state', server.url,
+                                  session=client.session)
+    return ts_client.get_hawk_credentials
+
+
+def _import_time(module):
+    """Measure the import of a module in a fresh interpreter, as a short
+    lived command would pay it.
+    """
+    command = [sys.executable, '-c', 'import %s' % module]
+    return lambda: subprocess.check_call(command)
+
+
+@benchmark(iterations=10)
+def import_client(server, client):
+    return _import_time('syncclient.client')
+
+
+@benchmark(iterations=10)
+def import_cli(server, client):
+    return _import_time('syncclient.main')
+
+
+def _percentile(timings, percent):
+    index = min(int(round(percent / 100.0 * (len(timings) - 1))),
+                len(timings) - 1)
+    return timings[index]
+
+
+def measure(func, iterations, warmup=3):
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    for _ in range(iterations):
+        start = timeit.default_timer()
+        func()
+        timings.append(timeit.default_timer() - start)
+    timings.sort()
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    total = sum(timings)
+    return {
+        'iterations': iterations,
+        'ops_per_sec': iterations / total if total else float('inf'),
+        'mean_ms': total / iterations * 1000,
+        'p50_ms': _percentile(timings, 50) * 1000,
+        'p90_ms': _percentile(timings, 90) * 1000,
+        'p99_ms': _percentile(timings, 99) * 1000,
+        'peak_alloc_kb': (peak - before) / 1024.0,
+    }
+
+
+def run(selected=None, scale=1.0):
+    results = {}
+    with StandInServer() as server:
+        client = SyncClient(**server.credentials)
+        for name, iterations, setup in BENCHMARKS:
+            if selected and selected not in name:
+                continue
+            func = setup(server, client)
+            results[name] = measure(func, max(int(iterations * scale), 1))
+    return results
+
+
+def report(results, out=sys.stdout):
+    print('%-24s %12s %10s %10s %10s %12s' % (
+        'benchmark', 'ops/s', 'p50 ms', 'p90 ms', 'p99 ms', 'alloc KB'),
+        file=out)
+    for name, result in sorted(results.items()):
+        print('%-24s %12.1f %10.3f %10.3f %10.3f %12.1f' % (
+            name, result['ops_per_sec'], result['p50_ms'], result['p90_ms'],
+            result['p99_ms'], result['peak_alloc_kb']), file=out)
+
+
+def compare(results, baseline, threshold, out=sys.stdout):
+    """Print the median latency changes and return the regressions."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        before = baseline[name]['p50_ms']
+        change = (result['p50_ms'] - before) / before if before else 0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('%-24s %+8.1f%%%s' % (name, change * 100, flag), file=out)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-k', dest='selected',
+                        help='Only run the benchmarks matching this.')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiply the number of iterations.')
+    parser.add_argument('--save', help='Save the results to this file.')
+    parser.add_argument('--compare',
+                        help='Compare with results saved previously.')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Median latency increase flagged as a '
+                             'regression.')
+    args = parser.parse_args(argv)
+
+    results = run(args.selected, args.scale)
+    report(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
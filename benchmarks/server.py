@@ -0,0 +1,207 @@
+"""In-process stand-in for the Token Server and a Sync 1.5 storage node.
+
+It keeps everything in memory and does not check the Hawk signatures, so
+that benchmarks only measure the client side.
+"""
+import json
+import threading
+import time
+import zlib
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs, urlparse
+
+UID = '1234'
+
+
+class SyncStandIn(object):
+    """The storage of a single user."""
+
+    def __init__(self):
+        self.collections = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+
+    def populate(self, collection, count, payload_size=300):
+        now = time.time()
+        records = self.collections.setdefault(collection, {})
+        for idx in range(count):
+            record_id = '%s-%08d' % (collection, idx)
+            records[record_id] = {'id': record_id,
+                                  'modified': round(
+                                      now - (count - idx) / 1000.0, 2),
+                                  'payload': 'x' * payload_size}
+
+    def _timestamp(self, collection):
+        records = self.collections.get(collection, {})
+        return max([r['modified'] for r in records.values()] or [0])
+
+    def info_collections(self):
+        return dict((name, self._timestamp(name))
+                    for name in self.collections)
+
+    def get_records(self, collection, params):
+        records = sorted(self.collections.get(collection, {}).values(),
+                         key=lambda r: (r['modified'], r['id']))
+        if 'ids' in params:
+            ids = set(params['ids'].split(','))
+            records = [r for r in records if r['id'] in ids]
+        if 'newer' in params:
+            newer = float(params['newer'])
+            records = [r for r in records if r['modified'] > newer]
+        if params.get('sort') == 'newest':
+            records.reverse()
+        offset = int(params.get('offset', 0))
+        next_offset = None
+        if 'limit' in params:
+            limit = int(params['limit'])
+            if offset + limit < len(records):
+                next_offset = offset + limit
+            records = records[offset:offset + limit]
+        if 'full' not in params:
+            records = [r['id'] for r in records]
+        return records, next_offset
+
+    def put(self, collection, record):
+        record['modified'] = round(time.time(), 2)
+        self.collections.setdefault(collection, {})[record['id']] = record
+        return record['modified']
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Small keep-alive responses would otherwise wait for delayed ACKs.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('X-Weave-Timestamp', '%.2f' % time.time())
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length)
+        encoding = self.headers.get('Content-Encoding')
+        if encoding == 'gzip':
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            data = zlib.decompress(data)
+        return json.loads(data.decode('utf-8'))
+
+    def _route(self):
+        url = urlparse(self.path)
+        params = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+        parts = [p for p in url.path.split('/') if p]
+        return parts, params
+
+    def do_GET(self):
+        store = self.server.store
+        parts, params = self._route()
+        if parts == ['1.0', 'sync', '1.5']:
+            host, port = self.server.server_address[:2]
+            return self._reply(200, {
+                'id': 'hawk-id', 'key': 'hawk-key', 'hashalg': 'sha256',
+                'uid': UID, 'duration': 3600,
+                'api_endpoint': 'http://%s:%s/1.5/%s' % (host, port, UID)})
+        with store.lock:
+            if parts[2:] == ['info', 'collections']:
+                return self._reply(200, store.info_collections())
+            if parts[2:] == ['info', 'configuration']:
+                return self._reply(200, {'max_post_records': 100})
+            if len(parts) == 4 and parts[2] == 'storage':
+                records, next_offset = store.get_records(parts[3], params)
+                headers = {'X-Last-Modified': str(store._timestamp(parts[3]))}
+                if next_offset is not None:
+                    headers['X-Weave-Next-Offset'] = str(next_offset)
+                return self._reply(200, records, headers)
+            if len(parts) == 5 and parts[2] == 'storage':
+                record = store.collections.get(parts[3], {}).get(parts[4])
+                if record is None:
+                    return self._reply(404, {})
+                return self._reply(200, record)
+        self._reply(404, {})
+
+    def do_PUT(self):
+        store = self.server.store
+        parts, _ = self._route()
+        record = self._body()
+        record['id'] = parts[4]
+        with store.lock:
+            modified = store.put(parts[3], record)
+        self._reply(200, modified)
+
+    def do_POST(self):
+        store = self.server.store
+        parts, params = self._route()
+        records = self._body()
+        with store.lock:
+            modified = None
+            for record in records:
+                modified = store.put(parts[3], record)
+        body = {'modified': modified, 'success': [r['id'] for r in records],
+                'failed': {}}
+        if params.get('batch') and 'commit' not in params:
+            body['batch'] = 'batch'
+            return self._reply(202, body)
+        self._reply(200, body)
+
+    def do_DELETE(self):
+        store = self.server.store
+        parts, params = self._route()
+        with store.lock:
+            records = store.collections.get(parts[3], {})
+            if len(parts) == 5:
+                records.pop(parts[4], None)
+            elif 'ids' in params:
+                for record_id in params['ids'].split(','):
+                    records.pop(record_id, None)
+            else:
+                store.collections.pop(parts[3], None)
+        self._reply(200, {'modified': round(time.time(), 2)})
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class StandInServer(object):
+    """Run the stand-in in a background thread:
+
+    >>> with StandInServer() as server:
+    ...     server.store.populate('history', 1000)
+    ...     SyncClient(**server.credentials)
+    """
+
+    def __init__(self):
+        self.store = SyncStandIn()
+        self.httpd = _Server(('127.0.0.1', 0), Handler)
+        self.httpd.store = self.store
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%s/' % (host, port)
+
+    @property
+    def credentials(self):
+        return {'id': 'hawk-id', 'key': 'hawk-key', 'hashalg': 'sha256',
+                'uid': UID, 'api_endpoint': self.url + '1.5/' + UID}
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
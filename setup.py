@@ -11,6 +11,7 @@ with codecs.open(os.path.join(here, 'CHANGELOG.rst'), encoding='utf-8') as f:
     CHANGELOG = f.read()
 
 REQUIREMENTS = [
+    'futures; python_version < "3.2"',
     'PyFxA',
     'requests-hawk',
     'requests',
@@ -40,4 +41,7 @@ setup(name='syncclient',
       packages=find_packages(),
       include_package_data=True,
       zip_safe=False,
-      install_requires=REQUIREMENTS)
+      install_requires=REQUIREMENTS,
+      extras_require={
+          'async': ['aiohttp'],
+      })
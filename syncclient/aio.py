@@ -0,0 +1,290 @@
+"""asyncio flavour of the Firefox Sync client.
+
+It requires Python 3 and aiohttp (``pip install syncclient[async]``) and
+mirrors :class:`syncclient.client.TokenserverClient` and
+:class:`syncclient.client.SyncClient`, with coroutines instead of blocking
+calls.
+"""
+import asyncio
+import json
+import ssl
+from urllib.parse import urlencode
+
+try:
+    import aiohttp
+    import yarl
+except ImportError:  # pragma: no cover
+    aiohttp = None
+import mohawk
+
+from syncclient.client import (
+    DEFAULT_CONFIGURATION, DEFAULT_POOL_MAXSIZE, TOKENSERVER_URL,
+    encode_header, _BatchUpload, _records_params
+)
+from syncclient.errors import SyncClientError
+
+DEFAULT_MAX_CONCURRENCY = 100
+
+
+def _ssl_context(verify):
+    """Translate a requests-like `verify` parameter to aiohttp's `ssl`."""
+    if verify is None or verify is True:
+        return None
+    if verify is False:
+        return False
+    return ssl.create_default_context(cafile=verify)
+
+
+def create_session(limit=DEFAULT_MAX_CONCURRENCY,
+                   limit_per_host=DEFAULT_POOL_MAXSIZE):
+    """Build a keep-alive :class:`aiohttp.ClientSession`.
+
+    Must be called from a running event loop. The session can be shared by
+    several clients; closing it is then up to the caller.
+
+    :param limit:
+        the maximum number of simultaneous connections.
+
+    :param limit_per_host:
+        the maximum number of simultaneous connections per host.
+    """
+    if aiohttp is None:  # pragma: no cover
+        raise SyncClientError("aiohttp is required to use the async client")
+    connector = aiohttp.TCPConnector(limit=limit,
+                                     limit_per_host=limit_per_host)
+    return aiohttp.ClientSession(connector=connector)
+
+
+class AsyncTokenserverClient(object):
+    """Client for the Firefox Sync Token Server.
+    """
+    def __init__(self, bid_assertion, client_state,
+                 server_url=TOKENSERVER_URL, verify=None, session=None):
+        self.bid_assertion = bid_assertion
+        self.client_state = client_state
+        self.server_url = server_url
+        self.ssl = _ssl_context(verify)
+        self.session = session
+
+    async def get_hawk_credentials(self, duration=None):
+        """Asks for new temporary token given a BrowserID assertion"""
+        authorization = 'BrowserID %s' % encode_header(self.bid_assertion)
+        headers = {
+            'Authorization': authorization,
+            'X-Client-State': self.client_state
+        }
+        params = {}
+
+        if duration is not None:
+            params['duration'] = int(duration)
+
+        url = self.server_url.rstrip('/') + '/1.0/sync/1.5'
+        session = self.session
+        if session is None:
+            session = create_session()
+        try:
+            async with session.get(url, headers=headers, params=params,
+                                   ssl=self.ssl) as raw_resp:
+                raw_resp.raise_for_status()
+                return await raw_resp.json(content_type=None)
+        finally:
+            if self.session is None:
+                await session.close()
+
+
+class AsyncSyncClient(object):
+    """Client for the Firefox Sync server, running on asyncio.
+
+    It is set up like :class:`syncclient.client.SyncClient`; the token
+    exchange happens on the first request. At most `max_concurrency`
+    requests of the client are in flight at once.
+
+    Use it as an asynchronous context manager, or call :meth:`close`, to
+    release the session it created.
+    """
+
+    def __init__(self, bid_assertion=None, client_state=None,
+                 tokenserver_url=TOKENSERVER_URL, verify=None, session=None,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, **credentials):
+        if aiohttp is None:  # pragma: no cover
+            raise SyncClientError(
+                "aiohttp is required to use the async client")
+
+        if bid_assertion is None or client_state is None:
+            credentials_complete = set(credentials.keys()).issuperset({
+                'uid', 'api_endpoint', 'hashalg', 'id', 'key'})
+
+            if not credentials_complete:
+                raise SyncClientError(
+                    "You should either provide a BID assertion and a client "
+                    "state or complete Sync credentials (uid, api_endpoint, "
+                    "hashalg, id, key)")
+            self._ts_client = None
+            self._set_credentials(credentials)
+        else:
+            self._ts_client = AsyncTokenserverClient(
+                bid_assertion, client_state, tokenserver_url, verify=verify,
+                session=session)
+            self.user_id = None
+            self.api_endpoint = None
+            self.credentials = None
+
+        self.ssl = _ssl_context(verify)
+        self.session = session
+        self._own_session = session is None
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self._auth_lock = None
+        self._configuration = None
+
+    def _set_credentials(self, credentials):
+        self.user_id = credentials['uid']
+        self.api_endpoint = credentials['api_endpoint']
+        self.credentials = {'algorithm': credentials['hashalg'],
+                            'id': credentials['id'],
+                            'key': credentials['key']}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Close the session if it was created by the client."""
+        if self._own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _authenticate(self):
+        if self.credentials is not None:
+            return
+        if self._auth_lock is None:
+            self._auth_lock = asyncio.Lock()
+        async with self._auth_lock:
+            if self.credentials is None:
+                self._ts_client.session = self._get_session()
+                credentials = await self._ts_client.get_hawk_credentials()
+                self._set_credentials(credentials)
+
+    def _get_session(self):
+        if self.session is None:
+            self.session = create_session(
+                limit=self.max_concurrency,
+                limit_per_host=self.max_concurrency)
+        return self.session
+
+    async def _request(self, method, url, params=None, data=None,
+                       headers=None):
+        """Utility to request an endpoint with the correct authentication
+        setup, raises on errors and returns the JSON.
+
+        """
+        await self._authenticate()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        url = self.api_endpoint.rstrip('/') + '/' + url.lstrip('/')
+        if params:
+            # Encode the query ourselves so that the signed URL is the one
+            # that is sent.
+            url += '?' + urlencode(sorted(params.items()))
+        headers = dict(headers or {})
+        sender = mohawk.Sender(
+            self.credentials, url, method.upper(),
+            content=data or '',
+            content_type=headers.get('Content-Type', ''))
+        headers['Authorization'] = sender.request_header
+
+        async with self._semaphore:
+            async with self._get_session().request(
+                    method, yarl.URL(url, encoded=True), data=data,
+                    headers=headers, ssl=self.ssl) as raw_resp:
+                raw_resp.raise_for_status()
+                if raw_resp.status == 304:
+                    raise aiohttp.ClientResponseError(
+                        raw_resp.request_info, raw_resp.history,
+                        status=raw_resp.status, message=raw_resp.reason,
+                        headers=raw_resp.headers)
+                return await raw_resp.json(content_type=None)
+
+    async def info_collections(self, **kwargs):
+        """
+        Returns an object mapping collection names associated with the account
+        to the last-modified time for each collection.
+        """
+        return await self._request('get', '/info/collections', **kwargs)
+
+    async def info_configuration(self, **kwargs):
+        """
+        Returns the upload limits of the server, see
+        :meth:`syncclient.client.SyncClient.info_configuration`.
+        """
+        if self._configuration is None:
+            configuration = dict(DEFAULT_CONFIGURATION)
+            try:
+                configuration.update(await self._request(
+                    'get', '/info/configuration', **kwargs))
+            except aiohttp.ClientResponseError as e:
+                if e.status != 404:
+                    raise
+            self._configuration = configuration
+        return self._configuration
+
+    async def get_records(self, collection, full=True, ids=None, newer=None,
+                          limit=None, offset=None, sort=None, **kwargs):
+        """
+        Returns a list of the BSOs contained in a collection, see
+        :meth:`syncclient.client.SyncClient.get_records`.
+        """
+        params = _records_params(dict(kwargs.pop('params', {})), full, ids,
+                                 newer, limit, offset, sort)
+        return await self._request('get', '/storage/%s' % collection.lower(),
+                                   params=params, **kwargs)
+
+    async def get_record(self, collection, record_id, **kwargs):
+        """Returns the BSO in the collection corresponding to the requested id.
+        """
+        return await self._request('get', '/storage/%s/%s' % (
+            collection.lower(), record_id), **kwargs)
+
+    async def delete_record(self, collection, record_id, **kwargs):
+        """Deletes the BSO at the given location.
+        """
+        return await self._request('delete', '/storage/%s/%s' % (
+            collection.lower(), record_id), **kwargs)
+
+    async def put_record(self, collection, record, **kwargs):
+        """
+        Creates or updates a specific BSO within a collection, see
+        :meth:`syncclient.client.SyncClient.put_record`.
+        """
+        if isinstance(record, str):
+            record = json.loads(record)
+        record = record.copy()
+        record_id = record.pop('id')
+        headers = dict(kwargs.pop('headers', {}))
+        headers['Content-Type'] = 'application/json; charset=utf-8'
+
+        return await self._request('put', '/storage/%s/%s' % (
+            collection.lower(), record_id), data=json.dumps(record),
+            headers=headers, **kwargs)
+
+    async def post_records(self, collection, records, batch=True, **kwargs):
+        """
+        Creates or updates BSOs in bulk, chunked according to the server
+        limits, see :meth:`syncclient.client.SyncClient.post_records`.
+        """
+        config = await self.info_configuration()
+        headers = kwargs.pop('headers', {})
+        params = kwargs.pop('params', {})
+        url = '/storage/%s' % collection.lower()
+
+        upload = _BatchUpload(records, config, params, batch)
+        for chunk, chunk_params in upload:
+            chunk_headers = dict(headers)
+            chunk_headers['Content-Type'] = 'application/json; charset=utf-8'
+            upload.add(await self._request('post', url, data=chunk.body,
+                                           params=chunk_params,
+                                           headers=chunk_headers, **kwargs))
+        return upload.result
@@ -0,0 +1,296 @@
+"""Export the collections of an account to compressed NDJSON files.
+
+Each collection is written to ``<directory>/<collection>.ndjson.gz``, one BSO
+per line, as returned by the server (payloads stay encrypted). Every page of
+records is appended as a separate gzip member, which ``gzip`` readers
+concatenate transparently, and ``<directory>/checkpoint.json`` then records
+where the export is:
+
+- the pagination offset of the next page,
+- the high-water mark, i.e. the most recent ``modified`` exported,
+- the size of the file after the last complete page.
+
+An interrupted export truncates the file to its checkpointed size and
+continues from the saved offset. Once a collection is complete, running the
+export again only appends the records modified since its high-water mark, so
+a record can appear several times in a file: the last line wins.
+
+:func:`restore` uploads such files, compressed or not, back to an account.
+The ids uploaded are appended to a journal, so that a restore that was
+interrupted does not upload them again.
+"""
+import gzip
+import json
+import os
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from syncclient.client import DEFAULT_MAX_WORKERS, DEFAULT_PAGE_SIZE
+
+CHECKPOINT_FILE = 'checkpoint.json'
+RESTORE_JOURNAL = 'restore.journal'
+ARCHIVE_SUFFIXES = ('.ndjson.gz', '.ndjson')
+# The fields of a BSO that can be uploaded.
+RESTORED_FIELDS = ('id', 'sortindex', 'ttl', 'payload')
+# Server timestamps have a 10ms resolution.
+TIMESTAMP_RESOLUTION = 0.01
+
+
+def _read_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _write_checkpoint(path, checkpoint):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(checkpoint, f, indent=2, sort_keys=True)
+        getattr(os, 'replace', os.rename)(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def _new_state():
+    return {'offset': None, 'newer': None, 'high_water_mark': None,
+            'size': 0, 'count': 0, 'done': False}
+
+
+def export(client, directory, collections=None, page_size=DEFAULT_PAGE_SIZE):
+    """Export collections, resuming a previous export to the same
+    directory.
+
+    :param collections:
+        the collections to export. Defaults to every collection listed by
+        :meth:`syncclient.client.SyncClient.info_collections`.
+
+    Returns an object mapping each collection to the number of records
+    written by this run.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    checkpoint_path = os.path.join(directory, CHECKPOINT_FILE)
+    checkpoint = _read_checkpoint(checkpoint_path)
+    timestamps = client.info_collections()
+    if collections is None:
+        collections = sorted(timestamps)
+
+    def save():
+        _write_checkpoint(checkpoint_path, checkpoint)
+
+    exported = {}
+    for collection in collections:
+        state = checkpoint.setdefault(collection, _new_state())
+        if state['done']:
+            if timestamps.get(collection, 0) <= (
+                    state['high_water_mark'] or 0):
+                exported[collection] = 0
+                continue
+            # Incremental export of what changed since the last one.
+            state.update(done=False, offset=None,
+                         newer=state['high_water_mark'])
+        exported[collection] = _export_collection(
+            client, directory, collection, state, page_size, save)
+    return exported
+
+
+def _export_collection(client, directory, collection, state, page_size,
+                       save):
+    path = os.path.join(directory, '%s.ndjson.gz' % collection)
+    if os.path.exists(path) and os.path.getsize(path) < state['size']:
+        # The file does not match the checkpoint anymore: start over.
+        state.update(_new_state())
+    count = 0
+    with open(path, 'ab') as f:
+        # Drop what was written after the last checkpoint.
+        f.truncate(state['size'])
+        f.seek(state['size'])
+        while True:
+            try:
+                records, next_offset = client.get_records_page(
+                    collection, offset=state['offset'], full=True,
+                    newer=state['newer'], limit=page_size, sort='oldest')
+            except requests.exceptions.HTTPError as e:
+                if (state['offset'] is None or e.response is None or
+                        e.response.status_code != 400):
+                    raise
+                # The offset token is not valid anymore. Restart after the
+                # last exported page, exporting again the records that share
+                # its timestamp.
+                state['offset'] = None
+                if state['high_water_mark'] is not None:
+                    state['newer'] = (state['high_water_mark'] -
+                                      TIMESTAMP_RESOLUTION)
+                continue
+
+            if records:
+                member = gzip.GzipFile(fileobj=f, mode='wb')
+                for record in records:
+                    member.write((json.dumps(record) + '\n').encode('utf-8'))
+                member.close()
+                f.flush()
+                os.fsync(f.fileno())
+                state['high_water_mark'] = max(
+                    [state['high_water_mark'] or 0] +
+                    [record['modified'] for record in records])
+                state['count'] += len(records)
+                count += len(records)
+
+            state['size'] = f.tell()
+            state['offset'] = next_offset or None
+            state['done'] = not next_offset
+            save()
+            if state['done']:
+                return count
+
+
+def read_records(path):
+    """Yield the records of a NDJSON file, gzipped if its name ends with
+    ``.gz``.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line.decode('utf-8'))
+
+
+def _archive_files(source):
+    """Yield the (collection, path) of the archives of an export directory,
+    or of a single archive, named after their collection.
+    """
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name)
+                 for name in sorted(os.listdir(source))]
+    else:
+        paths = [source]
+    for path in paths:
+        name = os.path.basename(path)
+        for suffix in ARCHIVE_SUFFIXES:
+            if name.endswith(suffix):
+                yield name[:-len(suffix)], path
+                break
+
+
+def _read_journal(path):
+    done = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut by a crash.
+                    continue
+                done.setdefault(entry['collection'], set()).update(
+                    entry['ids'])
+    except (IOError, OSError):
+        pass
+    return done
+
+
+def _records_to_restore(path, done, result):
+    """Yield the last version of each record of an archive that was not
+    uploaded yet, with only the fields that can be uploaded.
+
+    The file is read twice so that only the ids are held in memory.
+    """
+    last_seen = {}
+    for index, record in enumerate(read_records(path)):
+        last_seen[record['id']] = index
+    for index, record in enumerate(read_records(path)):
+        if last_seen[record['id']] != index:
+            continue
+        if record['id'] in done:
+            result['skipped'] += 1
+            continue
+        yield dict((field, record[field]) for field in RESTORED_FIELDS
+                   if field in record)
+
+
+def restore(client, source, collections=None,
+            max_workers=DEFAULT_MAX_WORKERS, journal_path=None):
+    """Upload the records of an export directory, or of a single
+    ``<collection>.ndjson[.gz]`` file.
+
+    Records are sent by requests of ``max_post_records`` (see
+    :meth:`syncclient.client.SyncClient.info_configuration`), `max_workers`
+    at a time.
+
+    :param collections:
+        the collections to restore. Defaults to every archive found.
+
+    :param journal_path:
+        the file listing the ids already uploaded. Defaults to
+        ``restore.journal`` in the export directory, or to the path
+        of the archive followed by ``.journal``.
+
+    Returns an object mapping each collection to the number of records
+    ``uploaded``, the number ``skipped`` because a previous run uploaded
+    them, and the ids that ``failed`` mapped to the reason.
+    """
+    if journal_path is None:
+        if os.path.isdir(source):
+            journal_path = os.path.join(source, RESTORE_JOURNAL)
+        else:
+            journal_path = source + '.journal'
+    done = _read_journal(journal_path)
+    chunk_size = client.info_configuration()['max_post_records']
+    results = {}
+
+    def upload(collection, chunk):
+        try:
+            resp = client.post_records(collection, chunk, batch=False)
+        except requests.exceptions.RequestException as e:
+            return collection, [], dict((record['id'], str(e))
+                                        for record in chunk)
+        return collection, resp['success'], resp['failed']
+
+    with open(journal_path, 'a') as journal:
+        def handle(futures):
+            for future in futures:
+                collection, success, failed = future.result()
+                if success:
+                    journal.write(json.dumps({'collection': collection,
+                                              'ids': success}) + '\n')
+                    journal.flush()
+                    os.fsync(journal.fileno())
+                results[collection]['uploaded'] += len(success)
+                results[collection]['failed'].update(failed)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = set()
+
+            def submit(collection, chunk):
+                if len(pending) >= 2 * max_workers:
+                    # Keep a bounded number of chunks in memory.
+                    finished = wait(pending,
+                                    return_when=FIRST_COMPLETED).done
+                    pending.difference_update(finished)
+                    handle(finished)
+                pending.add(executor.submit(upload, collection, chunk))
+
+            for collection, path in _archive_files(source):
+                if collections is not None and collection not in collections:
+                    continue
+                result = results.setdefault(
+                    collection, {'uploaded': 0, 'skipped': 0, 'failed': {}})
+                chunk = []
+                for record in _records_to_restore(
+                        path, done.get(collection, ()), result):
+                    chunk.append(record)
+                    if len(chunk) >= chunk_size:
+                        submit(collection, chunk)
+                        chunk = []
+                if chunk:
+                    submit(collection, chunk)
+
+            handle(wait(pending).done)
+    return results
@@ -0,0 +1,125 @@
+"""Honour the backoff requested by the storage nodes.
+
+Sync servers under load ask their clients to slow down with the
+``X-Weave-Backoff`` header, and answer ``503`` (or ``429``) responses with a
+``Retry-After`` header. A :class:`BackoffScheduler` remembers those delays
+per storage node, holds the requests to a node until its delay is over and
+retries idempotent requests with a jittered exponential backoff.
+"""
+import email.utils
+import random
+import threading
+import time
+
+import six
+
+from syncclient.errors import SyncClientError
+
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+# The longest a request waits for a node by default, in seconds.
+DEFAULT_MAX_WAIT = 60
+
+
+class BackoffError(SyncClientError):
+    """A storage node asked to wait longer than allowed.
+
+    Its ``retry_after`` attribute is the number of seconds left before the
+    node accepts requests again.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super(BackoffError, self).__init__(message)
+        self.retry_after = retry_after
+
+
+def _parse_delay(value, now):
+    """Parse a delay in seconds or an HTTP date. Returns None when the
+    value is not understood.
+    """
+    if not isinstance(value, six.string_types):
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        date = email.utils.parsedate_tz(value)
+        if date is None:
+            return None
+        return max(email.utils.mktime_tz(date) - now, 0)
+
+
+class BackoffScheduler(object):
+    """Tracks the backoff of each storage node. It can be shared by every
+    client talking to the same nodes.
+
+    :param max_retries:
+        how many times an idempotent request answered with a 429, 502, 503
+        or 504 is retried.
+
+    :param base_delay:
+        the delay before the first retry, doubled at each attempt and
+        randomised ("full jitter").
+
+    :param max_delay:
+        the upper bound of the retry delays.
+
+    :param max_wait:
+        a request that would have to wait longer than that for a node
+        raises a :class:`BackoffError` instead. Pass None to always wait,
+        however long the node asks for.
+    """
+
+    def __init__(self, max_retries=3, base_delay=0.5, max_delay=30,
+                 max_wait=DEFAULT_MAX_WAIT, sleep=time.sleep,
+                 clock=time.time):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self.sleep = sleep
+        self.clock = clock
+        self._until = {}
+        self._lock = threading.Lock()
+
+    def wait(self, node):
+        """Block until the node accepts requests again."""
+        with self._lock:
+            delay = self._until.get(node, 0) - self.clock()
+        if delay <= 0:
+            return
+        if self.max_wait is not None and delay > self.max_wait:
+            raise BackoffError("%s asked to back off for %d more seconds" % (
+                node, delay), retry_after=delay)
+        self.sleep(delay)
+
+    def update(self, node, response):
+        """Record the backoff requested by a response of the node."""
+        now = self.clock()
+        delays = [_parse_delay(response.headers.get(header), now)
+                  for header in ('X-Weave-Backoff', 'Retry-After')]
+        delays = [delay for delay in delays if delay]
+        if not delays:
+            return
+        with self._lock:
+            self._until[node] = max(self._until.get(node, 0),
+                                    now + max(delays))
+
+    def should_retry(self, method, response, attempt):
+        return (response.status_code in RETRY_STATUSES and
+                method.upper() in IDEMPOTENT_METHODS and
+                attempt < self.max_retries)
+
+    def retry_delay(self, attempt):
+        """The jittered delay before retrying for the `attempt` time."""
+        return random.uniform(0, min(self.max_delay,
+                                     self.base_delay * 2 ** attempt))
+
+    def state(self):
+        """Returns an object mapping the nodes currently backing off to the
+        remaining delay, in seconds.
+        """
+        now = self.clock()
+        with self._lock:
+            return dict((node, until - now)
+                        for node, until in self._until.items()
+                        if until > now)
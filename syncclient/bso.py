@@ -0,0 +1,68 @@
+"""Compact representation of the Basic Storage Objects."""
+import json
+
+_UNSET = object()
+
+
+class BSO(object):
+    """A Basic Storage Object.
+
+    The `payload` string is only decoded, and decrypted when a key bundle
+    is known, on the first access to :attr:`data`. The result is then kept
+    on the object.
+    """
+    __slots__ = ('id', 'modified', 'sortindex', 'ttl', 'payload', '_keys',
+                 '_data')
+
+    def __init__(self, id, modified=None, sortindex=None, ttl=None,
+                 payload=None, keys=None):
+        self.id = id
+        self.modified = modified
+        self.sortindex = sortindex
+        self.ttl = ttl
+        self.payload = payload
+        self._keys = keys
+        self._data = _UNSET
+
+    @classmethod
+    def from_dict(cls, record, keys=None):
+        """Build a BSO from a record returned by the server.
+
+        :param keys:
+            the :class:`syncclient.crypto.KeyBundle` of the collection.
+        """
+        return cls(record['id'], record.get('modified'),
+                   record.get('sortindex'), record.get('ttl'),
+                   record.get('payload'), keys)
+
+    def to_dict(self):
+        """Return the record as the server would, without the unset
+        fields.
+        """
+        record = {'id': self.id}
+        for field in ('modified', 'sortindex', 'ttl', 'payload'):
+            value = getattr(self, field)
+            if value is not None:
+                record[field] = value
+        return record
+
+    @property
+    def data(self):
+        """The decoded payload, decrypted if the BSO has a key bundle."""
+        if self._data is _UNSET:
+            data = None
+            if self.payload is not None:
+                data = json.loads(self.payload)
+                if self._keys is not None and 'ciphertext' in data:
+                    data = self._keys.decrypt(data)
+            self._data = data
+        return self._data
+
+    def __eq__(self, other):
+        return isinstance(other, BSO) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<BSO %r modified=%r>' % (self.id, self.modified)
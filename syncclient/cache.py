@@ -0,0 +1,171 @@
+"""In-memory cache of the records read with
+:meth:`syncclient.client.SyncClient.get_record`.
+
+Records are kept in least recently used order, within a number of entries
+and a number of bytes (the size of their JSON as received). Each entry
+remembers the server time of the response it comes from (its
+``X-Weave-Timestamp``), and is served as long as the timestamp of its
+collection, as listed by ``/info/collections``, is older than that: nothing
+in the collection was written since the record was read.
+
+The collection timestamps are those of the last
+:meth:`syncclient.client.SyncClient.info_collections` call. They are fetched
+again when they are older than ``max_age`` seconds and a cached record is
+asked for, so that most reads are answered without any request and a write
+from another client is noticed after ``max_age`` seconds at most. The writes
+of the client itself invalidate the records they touch right away.
+"""
+import collections
+import threading
+import time
+
+import six
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_MAX_AGE = 5
+
+_Entry = collections.namedtuple('_Entry', ['record', 'size', 'server_time'])
+
+
+def _key(collection, record_id):
+    # Ids end up in URLs: 5 and '5' are the same record.
+    return collection, six.text_type(record_id)
+
+
+class RecordCache(object):
+    """Bounded LRU cache of records, keyed by collection and id.
+
+    A cache holds the records of a single account: give each
+    :class:`syncclient.client.SyncClient` its own.
+
+    :param max_entries:
+        the number of records kept.
+
+    :param max_bytes:
+        the total size of the records kept. Larger records are not cached.
+
+    :param max_age:
+        the number of seconds the collection timestamps are trusted before
+        being fetched again to validate the records.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE,
+                 clock=time.time):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._timestamps = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def update_timestamps(self, timestamps):
+        """Validate the records against the collection timestamps returned
+        by ``/info/collections``.
+        """
+        with self._lock:
+            self._timestamps = dict(timestamps)
+            self._checked_at = self.clock()
+
+    def _stale(self):
+        return (self._timestamps is None or
+                self.clock() - self._checked_at > self.max_age)
+
+    def _is_fresh(self, collection, entry):
+        modified = self._timestamps.get(collection)
+        if modified is None:
+            # The collection was deleted.
+            return False
+        if entry.server_time is None:
+            return modified <= entry.record.get('modified', 0)
+        return modified < entry.server_time
+
+    def get(self, collection, record_id, timestamps=None):
+        """Return a copy of a cached record, or None if it is not cached or
+        may have changed.
+
+        :param timestamps:
+            a callable returning the collection timestamps, called when the
+            known ones are older than ``max_age``.
+        """
+        key = _key(collection, record_id)
+        with self._lock:
+            stale = key in self._entries and self._stale()
+        if stale and timestamps is not None:
+            self.update_timestamps(timestamps())
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self._timestamps is None or
+                                      not self._is_fresh(collection, entry)):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            # Most recently used last.
+            self._entries[key] = self._entries.pop(key)
+            self.hits += 1
+            return dict(entry.record)
+
+    def set(self, collection, record_id, record, size, server_time=None):
+        """Cache a record.
+
+        :param size:
+            the size of the record, in bytes.
+
+        :param server_time:
+            the ``X-Weave-Timestamp`` of the response holding the record.
+        """
+        key = _key(collection, record_id)
+        if server_time is not None:
+            server_time = float(server_time)
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = _Entry(dict(record), size, server_time)
+            self.size += size
+            while (len(self._entries) > self.max_entries or
+                   self.size > self.max_bytes):
+                old_key = next(iter(self._entries))
+                self._remove(old_key)
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def invalidate(self, collection, record_ids=None):
+        """Forget records of a collection, or all of them."""
+        with self._lock:
+            if record_ids is None:
+                record_ids = [record_id for (name, record_id)
+                              in self._entries if name == collection]
+            for record_id in record_ids:
+                self._remove(_key(collection, record_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """Returns an object with the number of ``hits``, ``misses`` and
+        ``evictions``, and the number of ``entries`` and ``bytes`` cached.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self.size}
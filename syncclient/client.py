@@ -1,21 +1,62 @@
 from hashlib import sha256
-from binascii import hexlify
+from binascii import hexlify, unhexlify
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import codecs
+import itertools
 import json
+import logging
 import six
 import sys
+import threading
+import time
+import timeit
+import zlib
 
 import requests
-from requests_hawk import HawkAuth
-from fxa.core import Client as FxAClient
+from requests.adapters import HTTPAdapter
+from six.moves.urllib.parse import urlparse
 
-# This is a proof of concept, in python, to get some data of some collections.
-# The data stays encrypted and because we don't have the keys to decrypt it
-# it just stays like that for now. The goal is simply to prove that it's
-# possible to get the data out of the API"""
+from syncclient.backoff import BackoffScheduler
+from syncclient.bso import BSO
+from syncclient.errors import SyncClientError
+from syncclient.hawk import HawkSigner
+from syncclient.metrics import RequestEvent, emit
+
+# Records are returned encrypted. Use fxa_login() to get keyB, then
+# SyncClient.fetch_collection_keys() and SyncClient.decrypt_records() to
+# decrypt them (see syncclient.crypto).
 
 TOKENSERVER_URL = "https://token.services.mozilla.com/"
 FXA_SERVER_URL = "https://api.accounts.firefox.com"
 
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_MAX_WORKERS = 4
+# The number of ids the server accepts in a single request.
+MAX_IDS_PER_REQUEST = 100
+DEFAULT_REFRESH_MARGIN = 60
+# A 401 is retried with the same token when the clock skew learnt from it
+# moved by more than that many seconds.
+SKEW_RETRY_THRESHOLD = 10
+STREAM_CHUNK_SIZE = 64 * 1024
+ACCEPT_ENCODING = 'gzip, deflate'
+UPLOAD_ENCODINGS = ('gzip', 'deflate')
+# Smaller bodies are not worth compressing.
+COMPRESS_MIN_SIZE = 1024
+
+logger = logging.getLogger(__name__)
+
+# Limits assumed when the server does not publish /info/configuration.
+DEFAULT_CONFIGURATION = {
+    'max_post_records': 100,
+    'max_post_bytes': 1024 * 1024,
+    'max_total_records': 10000,
+    'max_total_bytes': 100 * 1024 * 1024,
+    'max_request_bytes': 1024 * 1024 + 4096,
+}
+
 
 def encode_header(value):
     if isinstance(value, str):
@@ -28,37 +69,373 @@ def encode_header(value):
         return value.encode('utf-8')
 
 
-def get_browserid_assertion(login, password, fxa_server_url=FXA_SERVER_URL,
-                            tokenserver_url=TOKENSERVER_URL):
-    """Trade a user and password for a BrowserID assertion and the client
-    state.
-    """
+def _fxa_session(login, password, fxa_server_url, tokenserver_url,
+                 session_cache):
+    """Return a verified FxA session, a BrowserID assertion and keyB."""
+    # PyFxA loads the whole cryptography stack: only import it when needed.
+    from fxa.core import Client as FxAClient, Session as FxASession
+    from fxa.errors import ClientError as FxAClientError
+
     client = FxAClient(server_url=fxa_server_url)
+
+    if session_cache is not None:
+        cached = session_cache.get(login)
+        if cached is not None:
+            session = FxASession(client, login, None, cached['uid'],
+                                 cached['token'], verified=True)
+            try:
+                bid_assertion = session.get_identity_assertion(
+                    tokenserver_url)
+            except FxAClientError:
+                # The session expired or was revoked: log in again.
+                session_cache.delete(login)
+            else:
+                return session, bid_assertion, unhexlify(cached['keyB'])
+
     session = client.login(login, password, keys=True)
     bid_assertion = session.get_identity_assertion(tokenserver_url)
     _, keyB = session.fetch_keys()
     if isinstance(keyB, six.text_type):  # pragma: no cover
         keyB = keyB.encode('utf-8')
-    return bid_assertion, hexlify(sha256(keyB).digest()[0:16])
 
+    if session_cache is not None:
+        session_cache.set(login, {
+            'uid': session.uid,
+            'token': session.token,
+            'keyB': hexlify(keyB).decode('ascii'),
+        })
+    return session, bid_assertion, keyB
+
+
+def fxa_login(login, password, fxa_server_url=FXA_SERVER_URL,
+              tokenserver_url=TOKENSERVER_URL, session_cache=None):
+    """Trade a user and password for a BrowserID assertion and keyB, the
+    key the Sync keys derive from.
+
+    The FxA session kept in `session_cache` is reused when it is still
+    valid, see :func:`get_browserid_assertion`.
+
+    The assertion is only valid for a minute: use
+    :func:`fxa_assertion_provider` for clients that outlive their first
+    token.
+    """
+    _, bid_assertion, keyB = _fxa_session(login, password, fxa_server_url,
+                                          tokenserver_url, session_cache)
+    return bid_assertion, keyB
+
+
+def fxa_assertion_provider(login, password, fxa_server_url=FXA_SERVER_URL,
+                           tokenserver_url=TOKENSERVER_URL,
+                           session_cache=None):
+    """Log in like :func:`fxa_login` and return a callable minting a new
+    BrowserID assertion with the FxA session each time it is called, and
+    keyB.
+
+    Give the callable to :class:`SyncClient` as its ``bid_assertion`` so
+    that every token exchange, refreshes included, gets a valid assertion.
+    The login is done again if the FxA session expires.
+    """
+    from fxa.errors import ClientError as FxAClientError
+
+    state = list(_fxa_session(login, password, fxa_server_url,
+                              tokenserver_url, session_cache))
+    lock = threading.Lock()
+
+    def get_assertion():
+        with lock:
+            # The assertion of the login is used for the first exchange.
+            bid_assertion, state[1] = state[1], None
+            if bid_assertion is not None:
+                return bid_assertion
+            try:
+                return state[0].get_identity_assertion(tokenserver_url)
+            except FxAClientError:
+                if session_cache is not None:
+                    session_cache.delete(login)
+                state[0], bid_assertion, _ = _fxa_session(
+                    login, password, fxa_server_url, tokenserver_url,
+                    session_cache)
+                return bid_assertion
+
+    return get_assertion, state[2]
+
+
+def get_browserid_assertion(login, password, fxa_server_url=FXA_SERVER_URL,
+                            tokenserver_url=TOKENSERVER_URL,
+                            session_cache=None):
+    """Trade a user and password for a BrowserID assertion and the client
+    state.
+
+    :param session_cache:
+        a :class:`syncclient.credentials.FxASessionCache`. The FxA session
+        and keyB it holds are reused to mint the assertion, and a full login
+        is only done when the session is missing or no longer valid.
+    """
+    bid_assertion, keyB = fxa_login(login, password, fxa_server_url,
+                                    tokenserver_url, session_cache)
+    return bid_assertion, get_client_state(keyB)
+
+
+def get_client_state(keyB):
+    """Return the X-Client-State matching keyB."""
+    return hexlify(sha256(keyB).digest()[0:16])
+
+
+def create_session(pool_connections=DEFAULT_POOL_CONNECTIONS,
+                   pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_block=False,
+                   max_retries=0):
+    """Build a keep-alive :class:`requests.Session` with a sized connection
+    pool.
+
+    The returned session can be given to several clients talking to the
+    same storage node so that they share their open connections.
+
+    :param pool_connections:
+        the number of per-host connection pools to cache.
+
+    :param pool_maxsize:
+        the maximum number of connections kept open per host.
+
+    :param pool_block:
+        whether to block when the pool has no free connection rather than
+        opening an extra, non-reused one.
+
+    :param max_retries:
+        the number of connection-level retries done by urllib3.
+
+    Compressed responses are always accepted, and are decompressed as they
+    are read.
+    """
+    session = requests.Session()
+    session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize,
+                          pool_block=pool_block,
+                          max_retries=max_retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+_Chunk = namedtuple('_Chunk', ['ids', 'body', 'payload_bytes'])
+
+
+def _chunk_records(records, max_records, max_bytes, max_request_bytes):
+    """Split an iterable of BSOs in JSON request bodies holding at most
+    `max_records` records, `max_bytes` of payloads and `max_request_bytes`
+    in total.
+    """
+    encoded, ids = [], []
+    payload_bytes, request_bytes = 0, 2  # The enclosing brackets.
+
+    for record in records:
+        if isinstance(record, six.string_types):
+            record = json.loads(record)
+        data = json.dumps(record)
+        size = len(data.encode('utf-8')) + 1  # The separating comma.
+        payload_size = len(record.get('payload', '').encode('utf-8'))
+
+        if encoded and (len(encoded) >= max_records or
+                        payload_bytes + payload_size > max_bytes or
+                        request_bytes + size > max_request_bytes):
+            yield _Chunk(ids, '[%s]' % ','.join(encoded), payload_bytes)
+            encoded, ids = [], []
+            payload_bytes, request_bytes = 0, 2
+
+        encoded.append(data)
+        ids.append(record['id'])
+        payload_bytes += payload_size
+        request_bytes += size
+
+    if encoded:
+        yield _Chunk(ids, '[%s]' % ','.join(encoded), payload_bytes)
+
+
+def _group_chunks(chunks, max_total_records, max_total_bytes):
+    """Yield ``(chunk, commit)`` tuples, where `commit` tells whether the
+    chunk is the last one of a batch respecting the total limits.
+    """
+    previous = None
+    total_records = total_bytes = 0
+    for chunk in chunks:
+        if previous is not None:
+            commit = (
+                total_records + len(chunk.ids) > max_total_records or
+                total_bytes + chunk.payload_bytes > max_total_bytes)
+            yield previous, commit
+            if commit:
+                total_records = total_bytes = 0
+        total_records += len(chunk.ids)
+        total_bytes += chunk.payload_bytes
+        previous = chunk
+    if previous is not None:
+        yield previous, True
+
+
+def _id_list(ids):
+    """Return an iterable of record ids as a list of strings."""
+    if isinstance(ids, six.string_types):
+        # It would be split in one-letter ids.
+        raise SyncClientError("ids should be a list of ids, not %r" % (ids,))
+    return [str(record_id) for record_id in ids]
+
+
+def _records_params(params, full, ids, newer, limit, offset, sort):
+    """Add the filters of a ``GET /storage/<collection>`` to `params`."""
+    if full:
+        params['full'] = True
+    if ids is not None:
+        params['ids'] = ','.join(map(str, ids))
+    if newer is not None:
+        params['newer'] = newer
+    if limit is not None:
+        params['limit'] = limit
+    if offset is not None:
+        params['offset'] = offset
+    if sort is not None and sort in ('newest', 'index', 'oldest'):
+        params['sort'] = sort
+    return params
+
+
+class _BatchUpload(object):
+    """The requests of a ``post_records`` call, and their merged results.
+
+    Iterating yields a ``(chunk, params)`` tuple per request to send, and
+    the JSON answer of each request must be given to :meth:`add` before the
+    next one is asked for, since it holds the id of the batch.
+    """
+
+    def __init__(self, records, config, params, batch=True):
+        chunks = _chunk_records(records, config['max_post_records'],
+                                config['max_post_bytes'],
+                                config['max_request_bytes'])
+        self._chunks = _group_chunks(chunks, config['max_total_records'],
+                                     config['max_total_bytes'])
+        self._params = params
+        self._batch_id = 'true' if batch else None
+        self._commit = False
+        self.result = {'modified': None, 'success': [], 'failed': {}}
+
+    def __iter__(self):
+        for chunk, commit in self._chunks:
+            params = dict(self._params)
+            if self._batch_id is not None:
+                params['batch'] = self._batch_id
+                if commit:
+                    params['commit'] = 'true'
+            self._commit = commit
+            yield chunk, params
+
+    def add(self, resp):
+        """Merge the answer to the last request in :attr:`result`."""
+        self.result['success'].extend(resp.get('success', []))
+        self.result['failed'].update(resp.get('failed', {}))
+        if resp.get('modified') is not None:
+            self.result['modified'] = resp['modified']
+
+        if self._batch_id is not None:
+            if self._commit:
+                self._batch_id = 'true'
+            elif 'batch' in resp:
+                self._batch_id = resp['batch']
+            else:
+                # The server does not know about batches.
+                self._batch_id = None
+
+
+def _iter_json_array(chunks):
+    """Incrementally decode a JSON array received as byte chunks and yield
+    its items.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buf, pos, started = u'', 0, False
+
+    for chunk in itertools.chain(chunks, [None]):
+        eof = chunk is None
+        buf = buf[pos:] + utf8.decode(chunk or b'', final=eof)
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in u' \t\r\n,':
+                pos += 1
+            if pos == len(buf):
+                break
+            if not started:
+                if buf[pos] != u'[':
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == u']':
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                break
+            if not eof and (end == len(buf) or
+                            buf[end] not in u' \t\r\n,]'):
+                # A number may continue in the next chunk, with more digits,
+                # a fraction or an exponent: wait for what follows it.
+                break
+            yield item
+            pos = end
+
+    raise ValueError("Truncated JSON array")
+
+
+def _received_size(resp):
+    """The number of bytes of a read response body, as they came over the
+    wire: compressed bodies are larger once decoded.
+    """
+    content = resp.content
+    try:
+        size = resp.raw.tell()
+    except (AttributeError, IOError, ValueError):
+        size = None
+    if isinstance(size, six.integer_types):
+        return size
+    return len(content)
 
-class SyncClientError(Exception):
-    """An error occured in SyncClient."""
+
+def compress_body(body, encoding, level=6):
+    """Encode a request body with gzip or deflate."""
+    if isinstance(body, six.text_type):
+        body = body.encode('utf-8')
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        compressor = zlib.compressobj(level)
+    else:
+        raise ValueError("Unsupported encoding: %s" % encoding)
+    return compressor.compress(body) + compressor.flush()
 
 
 class TokenserverClient(object):
     """Client for the Firefox Sync Token Server.
+
+    `bid_assertion` is a BrowserID assertion, or a callable returning a new
+    one, such as the one of :func:`fxa_assertion_provider`, called on each
+    exchange.
     """
     def __init__(self, bid_assertion, client_state,
-                 server_url=TOKENSERVER_URL, verify=None):
+                 server_url=TOKENSERVER_URL, verify=None, session=None):
         self.bid_assertion = bid_assertion
         self.client_state = client_state
         self.server_url = server_url
         self.verify = verify
+        if session is None:
+            session = create_session()
+        self.session = session
 
     def get_hawk_credentials(self, duration=None):
         """Asks for new temporary token given a BrowserID assertion"""
-        authorization = 'BrowserID %s' % encode_header(self.bid_assertion)
+        bid_assertion = self.bid_assertion
+        if callable(bid_assertion):
+            bid_assertion = bid_assertion()
+        authorization = 'BrowserID %s' % encode_header(bid_assertion)
         headers = {
             'Authorization': authorization,
             'X-Client-State': self.client_state
@@ -69,23 +446,93 @@ class TokenserverClient(object):
             params['duration'] = int(duration)
 
         url = self.server_url.rstrip('/') + '/1.0/sync/1.5'
-        raw_resp = requests.get(url, headers=headers, params=params,
-                                verify=self.verify)
+        raw_resp = self.session.get(url, headers=headers, params=params,
+                                    verify=self.verify)
         raw_resp.raise_for_status()
         return raw_resp.json()
 
 
 class SyncClient(object):
     """Client for the Firefox Sync server.
+
+    Requests go through a keep-alive session. Pass ``session`` (for instance
+    built with :func:`create_session`) to share a connection pool between
+    several clients hitting the same storage node, or tune the pool of the
+    client's own session with ``pool_maxsize`` and ``pool_block``.
+
+    When set up with a BID assertion, the Hawk credentials can be shared
+    through a ``credential_cache`` (see :mod:`syncclient.credentials`). They
+    are refreshed in the background ``refresh_margin`` seconds before they
+    expire, and a request rejected with a 401 is retried once with a new
+    token. Assertions expire quickly, so refreshing needs a callable giving
+    a new assertion each time as ``bid_assertion``, see
+    :func:`fxa_assertion_provider`.
+
+    Requests honour the X-Weave-Backoff and Retry-After headers of each
+    storage node and idempotent requests are retried while the node is
+    unavailable, see :class:`syncclient.backoff.BackoffScheduler`. Pass the
+    same ``scheduler`` to clients talking to the same nodes so that they
+    back off together.
+
+    Each callable of ``hooks`` is called with a
+    :class:`syncclient.metrics.RequestEvent` describing every request sent
+    to the storage node (status, sizes, signing, wait, download and decoding
+    times, retries), e.g. a :class:`syncclient.metrics.MetricsCollector`.
+    Nothing is measured when there are no hooks.
+
+    With ``upload_encoding`` set to ``'gzip'`` or ``'deflate'``, the bodies
+    of :meth:`put_record` and :meth:`post_records` larger than
+    :data:`COMPRESS_MIN_SIZE` are compressed. If the server answers with a
+    415, the body is sent again uncompressed and compression is turned off
+    for the client.
+
+    With ``conditional_requests``, the client remembers the X-Last-Modified
+    header of the responses. Repeated GETs then send X-If-Modified-Since and
+    a 304 is answered with the previously received JSON, while writes to
+    the storage send X-If-Unmodified-Since so that they fail with a 412 if
+    somebody else modified the data in between. Note that every GET
+    response is kept in memory in that mode.
+
+    Give a :class:`syncclient.cache.RecordCache` as ``record_cache`` to
+    answer repeated :meth:`get_record` calls from memory, as long as the
+    collection timestamps of :meth:`info_collections` show that the record
+    did not change.
     """
 
     def __init__(self, bid_assertion=None, client_state=None,
-                 tokenserver_url=TOKENSERVER_URL, verify=None, **credentials):
+                 tokenserver_url=TOKENSERVER_URL, verify=None, session=None,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_block=False,
+                 conditional_requests=False, credential_cache=None,
+                 refresh_margin=DEFAULT_REFRESH_MARGIN,
+                 background_refresh=True, scheduler=None, hooks=None,
+                 upload_encoding=None, record_cache=None, **credentials):
+        if session is None:
+            session = create_session(pool_maxsize=pool_maxsize,
+                                     pool_block=pool_block)
+        self.session = session
+        if scheduler is None:
+            scheduler = BackoffScheduler()
+        self.scheduler = scheduler
+        self.hooks = list(hooks or [])
+        if upload_encoding not in (None,) + UPLOAD_ENCODINGS:
+            raise SyncClientError("upload_encoding should be one of %s" %
+                                  ', '.join(UPLOAD_ENCODINGS))
+        self.upload_encoding = upload_encoding
+        self.credential_cache = credential_cache
+        self.refresh_margin = refresh_margin
+        self.background_refresh = background_refresh
+        self._refresh_lock = threading.Lock()
+        self._refresh_timer = None
+        self._ts_client = None
 
         if bid_assertion is not None and client_state is not None:
-            ts_client = TokenserverClient(bid_assertion, client_state,
-                                          tokenserver_url)
-            credentials = ts_client.get_hawk_credentials()
+            self._ts_client = TokenserverClient(bid_assertion, client_state,
+                                                tokenserver_url,
+                                                session=self.session)
+            self._cache_key = '%s#%s' % (tokenserver_url, client_state)
+            credentials = self._get_cached_credentials()
+            if credentials is None:
+                credentials = self._exchange_token()
 
         else:
             # Make sure if the user wants to use credentials that they
@@ -99,31 +546,341 @@ class SyncClient(object):
                     "state or complete Sync credentials (uid, api_endpoint, "
                     "hashalg, id, key)")
 
+        self._set_credentials(credentials)
+        self.verify = verify
+        self._local = threading.local()
+        self._configuration = None
+        self.collection_keys = None
+        self.conditional_requests = conditional_requests
+        self.record_cache = record_cache
+        # Last X-Last-Modified known for each storage path, and the
+        # (X-Last-Modified, JSON) of each GET request.
+        self._last_modified = {}
+        self._validators = {}
+
+    def _get_cached_credentials(self):
+        if self.credential_cache is None:
+            return None
+        credentials = self.credential_cache.get(self._cache_key)
+        if credentials is None or (
+                credentials.get('expires', 0) - self.refresh_margin <=
+                time.time()):
+            return None
+        return credentials
+
+    def _exchange_token(self):
+        credentials = self._ts_client.get_hawk_credentials()
+        if 'duration' in credentials:
+            credentials = dict(credentials)
+            credentials['expires'] = time.time() + credentials['duration']
+        if self.credential_cache is not None:
+            self.credential_cache.set(self._cache_key, credentials)
+        return credentials
+
+    def _set_credentials(self, credentials):
         self.user_id = credentials['uid']
         self.api_endpoint = credentials['api_endpoint']
-        self.auth = HawkAuth(algorithm=credentials['hashalg'],
-                             id=credentials['id'],
-                             key=credentials['key'])
-        self.verify = verify
+        # Keep the clock skew learnt with the previous token.
+        skew = getattr(getattr(self, 'auth', None), 'skew', 0)
+        self.auth = HawkSigner(algorithm=credentials['hashalg'],
+                               id=credentials['id'],
+                               key=credentials['key'], skew=skew)
+        self.credentials_expire = None
+        if 'expires' in credentials:
+            self.credentials_expire = credentials['expires']
+        self._schedule_refresh()
+
+    def _schedule_refresh(self):
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+            self._refresh_timer = None
+        if (not self.background_refresh or self._ts_client is None or
+                self.credentials_expire is None):
+            return
+        # Never refresh more often than every half token lifetime, even with
+        # a margin larger than the token duration.
+        remaining = self.credentials_expire - time.time()
+        delay = max(remaining - self.refresh_margin, remaining / 2, 0)
+        self._refresh_timer = threading.Timer(delay,
+                                              self._background_refresh)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh_credentials()
+        except Exception:
+            logger.warning("Unable to refresh the Sync credentials",
+                           exc_info=True)
+
+    def refresh_credentials(self, stale_auth=None):
+        """Trade the BrowserID assertion for new Hawk credentials.
+
+        A fresher token found in the credential cache, e.g. put there by
+        another process, is used instead of doing a new exchange.
+
+        :param stale_auth:
+            the authentication that was rejected by the server. The cache is
+            then bypassed, and nothing is done if the credentials were
+            refreshed meanwhile.
+        """
+        if self._ts_client is None:
+            raise SyncClientError(
+                "Credentials can only be refreshed when the client is "
+                "set up with a BID assertion and a client state")
+        with self._refresh_lock:
+            if stale_auth is not None and stale_auth is not self.auth:
+                return
+            credentials = None
+            if stale_auth is None:
+                credentials = self._get_cached_credentials()
+                if (credentials is not None and
+                        credentials.get('expires') ==
+                        self.credentials_expire):
+                    credentials = None
+            if credentials is None:
+                credentials = self._exchange_token()
+            self._set_credentials(credentials)
+
+    def close(self):
+        """Stop refreshing the credentials in the background."""
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+            self._refresh_timer = None
+
+    @property
+    def raw_resp(self):
+        """The last response received by the calling thread."""
+        return getattr(self._local, 'raw_resp', None)
+
+    @raw_resp.setter
+    def raw_resp(self, value):
+        self._local.raw_resp = value
+
+    def _add_validators(self, method, path, kwargs):
+        """Add the conditional headers matching what we know about `path`
+        and return the cache key of GET requests.
+        """
+        headers = dict(kwargs.get('headers') or {})
+        cache_key = None
+        if method.lower() == 'get':
+            params = kwargs.get('params') or {}
+            cache_key = (path, tuple(sorted(params.items())))
+            cached = self._validators.get(cache_key)
+            if cached is not None:
+                headers.setdefault('X-If-Modified-Since', cached[0])
+        elif path.startswith('/storage/'):
+            last_modified = self._last_modified.get(
+                path, self._last_modified.get(path.rsplit('/', 1)[0]))
+            if last_modified is not None:
+                headers.setdefault('X-If-Unmodified-Since', last_modified)
+        if headers:
+            kwargs['headers'] = headers
+        return cache_key
+
+    def _store_validators(self, method, path, cache_key, body, params=None):
+        last_modified = self.raw_resp.headers.get('X-Last-Modified')
+        if last_modified is None:
+            return
+        ids = (params or {}).get('ids')
+        if method.lower() == 'delete' and ids:
+            # Some records of the collection are gone, the collection
+            # itself is still there with a new timestamp.
+            for record_id in ids.split(','):
+                self._last_modified.pop('%s/%s' % (path, record_id), None)
+            self._last_modified[path] = last_modified
+        elif cache_key is not None:
+            # A page of records is only complete with the offset of the
+            # next one, which a 304 does not repeat.
+            self._validators[cache_key] = (
+                last_modified, body,
+                self.raw_resp.headers.get('X-Weave-Next-Offset'))
+            self._last_modified[path] = last_modified
+        elif method.lower() == 'delete':
+            prefix = path.rstrip('/') + '/'
+            for known in list(self._last_modified):
+                if known == path or known.startswith(prefix):
+                    self._last_modified.pop(known, None)
+        else:
+            self._last_modified[path] = last_modified
+        if cache_key is None and path.count('/') > 2:
+            # Our own write moved the collection timestamp.
+            self._last_modified[path.rsplit('/', 1)[0]] = last_modified
+
+    def _send(self, method, path, event=None, **kwargs):
+        """Send an authenticated request to the storage node and raise on
+        errors.
+
+        The request waits for the backoff of the node to be over, is retried
+        once with new credentials on a 401 and, if idempotent, is retried
+        with a jittered exponential backoff while the node is unavailable.
+        A 401 telling that our clock is off is first retried once with the
+        same credentials, signed with the corrected time.
+
+        :param event:
+            the :class:`syncclient.metrics.RequestEvent` to fill in. Without
+            it, an event is created and sent to the hooks when there are
+            any.
+        """
+        kwargs.setdefault('verify', self.verify)
+        owned = event is None and bool(self.hooks)
+        if owned:
+            event = RequestEvent(method, path)
+        start = timeit.default_timer()
+        refreshed = resigned = False
+        attempt = 0
+        try:
+            while True:
+                url = self.api_endpoint.rstrip('/') + path
+                node = urlparse(url).netloc
+                self.scheduler.wait(node)
+                auth = self.auth
+                skew = getattr(auth, 'skew', None)
+                if event is None:
+                    self.raw_resp = self.session.request(
+                        method, url, auth=auth, **kwargs)
+                else:
+                    event.node = node
+                    self.raw_resp = self._measured_request(
+                        event, method, url, auth, kwargs)
+                self.scheduler.update(node, self.raw_resp)
+
+                if (self.raw_resp.status_code == 401 and not resigned and
+                        isinstance(auth, HawkSigner) and
+                        abs(auth.skew - skew) > SKEW_RETRY_THRESHOLD):
+                    # HawkSigner learnt the server time from the response:
+                    # the token is fine, our timestamp was not.
+                    self.raw_resp.close()
+                    resigned = True
+                elif (self.raw_resp.status_code == 401 and not refreshed and
+                        self._ts_client is not None):
+                    # The token expired or was revoked: get a new one and
+                    # retry once.
+                    self.raw_resp.close()
+                    self.refresh_credentials(stale_auth=auth)
+                    refreshed = True
+                elif self.scheduler.should_retry(method, self.raw_resp,
+                                                 attempt):
+                    self.raw_resp.close()
+                    self.scheduler.sleep(self.scheduler.retry_delay(attempt))
+                    attempt += 1
+                else:
+                    break
+                if event is not None:
+                    event.retries += 1
+            self.raw_resp.raise_for_status()
+        except Exception as e:
+            if event is not None:
+                event.error = type(e).__name__
+            raise
+        finally:
+            if owned:
+                event.duration = timeit.default_timer() - start
+                emit(self.hooks, event)
+        return self.raw_resp
+
+    def _measured_request(self, event, method, url, auth, kwargs):
+        sign_time = [0.0]
+
+        def sign(request):
+            start = timeit.default_timer()
+            try:
+                return auth(request)
+            finally:
+                sign_time[0] = timeit.default_timer() - start
+
+        start = timeit.default_timer()
+        resp = self.session.request(method, url, auth=sign, **kwargs)
+        total = timeit.default_timer() - start
+        # requests measures the time until the headers are parsed.
+        wait_time = resp.elapsed.total_seconds()
+        event.status = resp.status_code
+        event.sign_time += sign_time[0]
+        event.wait_time += wait_time
+        event.bytes_sent += len(resp.request.body or b'')
+        if not kwargs.get('stream'):
+            event.bytes_received += _received_size(resp)
+            event.download_time += max(total - wait_time - sign_time[0], 0)
+        return resp
+
+    def throttle_state(self):
+        """
+        Returns an object mapping the storage nodes that asked to back off
+        to the number of seconds left before they accept requests again.
+        """
+        return self.scheduler.state()
+
+    def _not_modified_error(self):
+        http_error_msg = '%s Client Error: %s for url: %s' % (
+            self.raw_resp.status_code,
+            self.raw_resp.reason,
+            self.raw_resp.url)
+        return requests.exceptions.HTTPError(http_error_msg,
+                                             response=self.raw_resp)
 
     def _request(self, method, url, **kwargs):
         """Utility to request an endpoint with the correct authentication
         setup, raises on errors and returns the JSON.
 
         """
-        url = self.api_endpoint.rstrip('/') + '/' + url.lstrip('/')
-        kwargs.setdefault('verify', self.verify)
-        self.raw_resp = requests.request(method, url, auth=self.auth, **kwargs)
-        self.raw_resp.raise_for_status()
-
-        if self.raw_resp.status_code == 304:
-            http_error_msg = '%s Client Error: %s for url: %s' % (
-                self.raw_resp.status_code,
-                self.raw_resp.reason,
-                self.raw_resp.url)
-            raise requests.exceptions.HTTPError(http_error_msg,
-                                                response=self.raw_resp)
-        return self.raw_resp.json()
+        path = '/' + url.lstrip('/')
+        event = None
+        if self.hooks:
+            event = RequestEvent(method, path)
+            start = timeit.default_timer()
+        try:
+            cache_key = None
+            if self.conditional_requests:
+                cache_key = self._add_validators(method, path, kwargs)
+            self._send(method, path, event=event, **kwargs)
+
+            if self.raw_resp.status_code == 304:
+                cached = self._validators.get(cache_key)
+                if cached is not None:
+                    if event is not None:
+                        event.cache_hit = True
+                    if cached[2] is not None:
+                        self.raw_resp.headers['X-Weave-Next-Offset'] = (
+                            cached[2])
+                    return cached[1]
+                raise self._not_modified_error()
+            decode_start = timeit.default_timer()
+            body = self.raw_resp.json()
+            if event is not None:
+                event.decode_time = timeit.default_timer() - decode_start
+            if self.conditional_requests:
+                self._store_validators(method, path, cache_key, body,
+                                       kwargs.get('params'))
+            return body
+        except Exception as e:
+            if event is not None and event.error is None:
+                event.error = type(e).__name__
+            raise
+        finally:
+            if event is not None:
+                event.duration = timeit.default_timer() - start
+                emit(self.hooks, event)
+
+    def _upload(self, method, path, body, headers, **kwargs):
+        """Send a JSON body, compressed if the client is set up to."""
+        headers = dict(headers)
+        headers['Content-Type'] = 'application/json; charset=utf-8'
+        encoding = self.upload_encoding
+        if encoding is not None and len(body) >= COMPRESS_MIN_SIZE:
+            compressed_headers = dict(headers)
+            compressed_headers['Content-Encoding'] = encoding
+            try:
+                return self._request(method, path,
+                                     data=compress_body(body, encoding),
+                                     headers=compressed_headers, **kwargs)
+            except requests.exceptions.HTTPError as e:
+                if e.response is None or e.response.status_code != 415:
+                    raise
+                logger.info("The server does not accept %s encoded "
+                            "uploads, sending them uncompressed", encoding)
+                self.upload_encoding = None
+        return self._request(method, path, data=body, headers=headers,
+                             **kwargs)
 
     def info_collections(self, **kwargs):
         """
@@ -134,7 +891,31 @@ class SyncClient(object):
         with an expired token, so that clients can check for server-side
         changes before fetching an updated token from the Token Server.
         """
-        return self._request('get', '/info/collections', **kwargs)
+        timestamps = self._request('get', '/info/collections', **kwargs)
+        if self.record_cache is not None:
+            self.record_cache.update_timestamps(timestamps)
+        return timestamps
+
+    def info_configuration(self, **kwargs):
+        """
+        Returns an object describing the limits the server applies to
+        uploads (max_post_records, max_post_bytes, max_total_records,
+        max_total_bytes, max_request_bytes, ...).
+
+        Servers that do not publish their configuration answer with a 404,
+        in which case :data:`DEFAULT_CONFIGURATION` is returned. The result is
+        fetched once and then kept on the client.
+        """
+        if self._configuration is None:
+            configuration = dict(DEFAULT_CONFIGURATION)
+            try:
+                configuration.update(
+                    self._request('get', '/info/configuration', **kwargs))
+            except requests.exceptions.HTTPError as e:
+                if e.response is None or e.response.status_code != 404:
+                    raise
+            self._configuration = configuration
+        return self._configuration
 
     def info_quota(self, **kwargs):
         """
@@ -165,10 +946,15 @@ class SyncClient(object):
 
     def delete_all_records(self, **kwargs):
         """Deletes all records for the user."""
-        return self._request('delete', '/', **kwargs)
+        try:
+            return self._request('delete', '/', **kwargs)
+        finally:
+            if self.record_cache is not None:
+                self.record_cache.clear()
 
     def get_records(self, collection, full=True, ids=None, newer=None,
-                    limit=None, offset=None, sort=None, **kwargs):
+                    limit=None, offset=None, sort=None, as_bso=False,
+                    **kwargs):
         """
         Returns a list of the BSOs contained in a collection. For example:
 
@@ -204,35 +990,297 @@ class SyncClient(object):
             "newest" - orders by last-modified time, largest first
             "index" - orders by the sortindex, highest weight first
             "oldest" - orders by last-modified time, oldest first
+
+        :param as_bso:
+            if true, full objects are returned as :class:`syncclient.bso.BSO`
+            instances, which decode (and decrypt, once
+            :meth:`fetch_collection_keys` was called) their payload lazily.
         """
-        params = kwargs.pop('params', {})
-        if full:
-            params['full'] = True
-        if ids is not None:
-            params['ids'] = ','.join(map(str, ids))
-        if newer is not None:
-            params['newer'] = newer
-        if limit is not None:
-            params['limit'] = limit
-        if offset is not None:
-            params['offset'] = offset
-        if sort is not None and sort in ('newest', 'index', 'oldest'):
-            params['sort'] = sort
-
-        return self._request('get', '/storage/%s' % collection.lower(),
-                             params=params, **kwargs)
-
-    def get_record(self, collection, record_id, **kwargs):
+        params = _records_params(kwargs.pop('params', {}), full, ids, newer,
+                                 limit, offset, sort)
+        records = self._request('get', '/storage/%s' % collection.lower(),
+                                params=params, **kwargs)
+        if as_bso and full:
+            records = [self._to_bso(collection, r) for r in records]
+        return records
+
+    def stream_records(self, collection, full=True, ids=None, newer=None,
+                       limit=None, offset=None, sort=None, as_bso=False,
+                       **kwargs):
+        """
+        Yields the BSOs of a collection as they are read from the socket, so
+        that only one record at a time is held in memory. Parameters are
+        the ones of :meth:`get_records`.
+
+        Records are requested as newline-delimited JSON; a JSON array answer
+        is parsed incrementally as well. The request is sent when the
+        iteration starts.
+        """
+        params = _records_params(dict(kwargs.pop('params', {})), full, ids,
+                                 newer, limit, offset, sort)
+        headers = dict(kwargs.pop('headers', {}))
+        headers['Accept'] = 'application/newlines'
+        resp = self._send('get', '/storage/%s' % collection.lower(),
+                          params=params, headers=headers, stream=True,
+                          **kwargs)
+        try:
+            if resp.status_code == 304:
+                raise self._not_modified_error()
+            content_type = resp.headers.get('Content-Type', '')
+            if content_type.startswith('application/newlines'):
+                records = (json.loads(line.decode('utf-8'))
+                           for line in resp.iter_lines() if line)
+            else:
+                records = _iter_json_array(
+                    resp.iter_content(STREAM_CHUNK_SIZE))
+            for record in records:
+                if as_bso and full:
+                    record = self._to_bso(collection, record)
+                yield record
+        finally:
+            resp.close()
+
+    def get_records_page(self, collection, offset=None, **kwargs):
+        """
+        Returns a ``(records, next_offset)`` tuple: a page of the BSOs of a
+        collection, and the X-Weave-Next-Offset token to give as `offset`
+        to get the following page, or None for the last one.
+
+        Parameters are the ones of :meth:`get_records`, `limit` setting the
+        size of the pages.
+        """
+        if 'params' in kwargs:
+            kwargs['params'] = dict(kwargs['params'])
+        records = self.get_records(collection, offset=offset, **kwargs)
+        return records, self.raw_resp.headers.get('X-Weave-Next-Offset')
+
+    def iter_records(self, collection, page_size=DEFAULT_PAGE_SIZE,
+                     full=True, newer=None, sort=None, prefetch=True,
+                     **kwargs):
+        """
+        Yields the BSOs of a collection one at a time, following the
+        X-Weave-Next-Offset tokens so that only one page of `page_size`
+        records is held in memory.
+
+        Accepts the same filters as :meth:`get_records`.
+
+        :param prefetch:
+            if true, the next page is requested in a background thread while
+            the caller handles the current one.
+        """
+        def fetch_page(offset):
+            return self.get_records_page(collection, offset=offset,
+                                         full=full, newer=newer,
+                                         limit=page_size, sort=sort,
+                                         **kwargs)
+
+        if not prefetch:
+            offset = None
+            while True:
+                records, offset = fetch_page(offset)
+                for record in records:
+                    yield record
+                if not offset:
+                    return
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(fetch_page, None)
+            while future is not None:
+                records, offset = future.result()
+                future = None
+                if offset:
+                    future = executor.submit(fetch_page, offset)
+                for record in records:
+                    yield record
+
+    def fetch_collections(self, names=None, max_workers=DEFAULT_MAX_WORKERS,
+                          page_size=DEFAULT_PAGE_SIZE, **kwargs):
+        """
+        Fetches several collections concurrently and yields
+        ``(collection, records)`` tuples as soon as each one is complete.
+
+        The fetches run in a pool of `max_workers` threads sharing the
+        client session, whose ``pool_maxsize`` should be at least
+        `max_workers` for every worker to get a kept-alive connection.
+
+        :param names:
+            the collections to fetch. Defaults to every collection listed by
+            :meth:`info_collections`.
+
+        Other parameters are given to :meth:`iter_records` for each
+        collection.
+        """
+        if names is None:
+            names = list(self.info_collections())
+
+        def fetch(name):
+            return name, list(self.iter_records(name, page_size=page_size,
+                                                prefetch=False, **kwargs))
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = [executor.submit(fetch, name) for name in names]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def fetch_records(self, collection, ids, max_workers=DEFAULT_MAX_WORKERS,
+                      **kwargs):
+        """
+        Yields the full BSOs of a collection with the given ids, requested
+        by chunks of :data:`MAX_IDS_PER_REQUEST` in a pool of `max_workers`
+        threads. Ids missing on the server are skipped.
+
+        Other parameters are given to :meth:`get_records`.
+        """
+        ids = _id_list(ids)
+        chunks = [ids[i:i + MAX_IDS_PER_REQUEST]
+                  for i in range(0, len(ids), MAX_IDS_PER_REQUEST)]
+
+        def fetch(chunk):
+            return self.get_records(collection, full=True, ids=chunk,
+                                    **kwargs)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for records in executor.map(fetch, chunks):
+                for record in records:
+                    yield record
+
+    def fetch_collection_keys(self, kB, **kwargs):
+        """
+        Fetches and decrypts the ``crypto/keys`` record with the key bundle
+        derived from keyB (see :func:`fxa_login`), and keeps the collection
+        keys on the client for :meth:`decrypt_records`.
+        """
+        from syncclient.crypto import CollectionKeys, KeyBundle
+        record = self.get_record('crypto', 'keys', **kwargs)
+        self.collection_keys = CollectionKeys.from_record(
+            record, KeyBundle.from_kB(kB))
+        return self.collection_keys
+
+    def decrypt_records(self, collection, records, processes=None):
+        """
+        Yields copies of the given BSOs of a collection with their payload
+        verified and decrypted. :meth:`fetch_collection_keys` must be called
+        first.
+
+        :param processes:
+            the number of processes decrypting the records in parallel, for
+            large collections.
+        """
+        from syncclient.crypto import decrypt_records
+        if self.collection_keys is None:
+            raise SyncClientError(
+                "Collection keys are needed to decrypt records, call "
+                "fetch_collection_keys first")
+        return decrypt_records(records,
+                               self.collection_keys.bundle_for(collection),
+                               processes=processes)
+
+    def get_record(self, collection, record_id, as_bso=False, **kwargs):
         """Returns the BSO in the collection corresponding to the requested id.
+
+        :param as_bso:
+            if true, a :class:`syncclient.bso.BSO` is returned instead of a
+            dict.
         """
-        return self._request('get', '/storage/%s/%s' % (collection.lower(),
-                                                        record_id), **kwargs)
+        name = collection.lower()
+        cache = self.record_cache if not kwargs else None
+        record = None
+        if cache is not None:
+            record = cache.get(name, record_id,
+                               timestamps=self.info_collections)
+        if record is None:
+            record = self._request('get', '/storage/%s/%s' % (
+                name, record_id), **kwargs)
+            if cache is not None:
+                cache.set(name, record_id, record,
+                          size=len(self.raw_resp.content),
+                          server_time=self.raw_resp.headers.get(
+                              'X-Weave-Timestamp'))
+        if as_bso:
+            return self._to_bso(collection, record)
+        return record
+
+    def _to_bso(self, collection, record):
+        keys = None
+        if self.collection_keys is not None:
+            keys = self.collection_keys.bundle_for(collection)
+        return BSO.from_dict(record, keys)
 
     def delete_record(self, collection, record_id, **kwargs):
         """Deletes the BSO at the given location.
         """
-        return self._request('delete', '/storage/%s/%s' % (
-            collection.lower(), record_id), **kwargs)
+        try:
+            return self._request('delete', '/storage/%s/%s' % (
+                collection.lower(), record_id), **kwargs)
+        finally:
+            self._invalidate(collection, [record_id])
+
+    def _invalidate(self, collection, record_ids=None):
+        """Forget the cached records we are writing."""
+        if self.record_cache is not None:
+            self.record_cache.invalidate(collection.lower(), record_ids)
+
+    def delete_records(self, collection, ids, max_workers=DEFAULT_MAX_WORKERS,
+                       **kwargs):
+        """
+        Deletes the BSOs of a collection with the given ids.
+
+        Ids are sent by chunks of :data:`MAX_IDS_PER_REQUEST`, in a pool of
+        `max_workers` threads. With ``conditional_requests``, the chunks are
+        sent one after the other since each deletion changes the collection
+        timestamp checked by the next one.
+
+        Returns an object with the ids ``deleted``, the ids that ``failed``
+        mapped to the error of their request, and the last ``modified``
+        timestamp of the collection.
+        """
+        ids = _id_list(ids)
+        chunks = [ids[i:i + MAX_IDS_PER_REQUEST]
+                  for i in range(0, len(ids), MAX_IDS_PER_REQUEST)]
+        params = kwargs.pop('params', {})
+        url = '/storage/%s' % collection.lower()
+
+        def delete(chunk):
+            chunk_params = dict(params)
+            chunk_params['ids'] = ','.join(chunk)
+            try:
+                return chunk, self._request('delete', url,
+                                            params=chunk_params, **kwargs)
+            except requests.exceptions.RequestException as e:
+                return chunk, e
+
+        result = {'modified': None, 'deleted': [], 'failed': {}}
+        if self.conditional_requests:
+            max_workers = 1
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            for chunk, resp in executor.map(delete, chunks):
+                if isinstance(resp, Exception):
+                    result['failed'].update(
+                        (record_id, str(resp)) for record_id in chunk)
+                    continue
+                result['deleted'].extend(chunk)
+                modified = (resp or {}).get('modified')
+                if modified is not None:
+                    result['modified'] = max(result['modified'] or 0,
+                                             modified)
+        finally:
+            executor.shutdown(wait=True)
+            self._invalidate(collection, ids)
+        return result
+
+    def delete_collection(self, collection, **kwargs):
+        """Deletes every BSO of a collection."""
+        try:
+            return self._request('delete', '/storage/%s' % collection.lower(),
+                                 **kwargs)
+        finally:
+            self._invalidate(collection)
 
     def put_record(self, collection, record, **kwargs):
         """
@@ -265,13 +1313,14 @@ class SyncClient(object):
         if 'headers' in kwargs:
             headers = kwargs.pop('headers')
 
-        headers['Content-Type'] = 'application/json; charset=utf-8'
-
-        return self._request('put', '/storage/%s/%s' % (
-            collection.lower(), record_id), data=json.dumps(record),
-            headers=headers, **kwargs)
+        try:
+            return self._upload('put', '/storage/%s/%s' % (
+                collection.lower(), record_id), json.dumps(record),
+                headers, **kwargs)
+        finally:
+            self._invalidate(collection, [record_id])
 
-    def post_records(self, collection, records, **kwargs):
+    def post_records(self, collection, records, batch=True, **kwargs):
         """
         Takes a list of BSOs in the request body and iterates over them,
         effectively doing a series of individual PUTs with the same timestamp.
@@ -311,5 +1360,28 @@ class SyncClient(object):
         included in the request, and/or may decline to process more than a
         certain number of BSOs in a single request. The default limit on the
         number of BSOs per request is 100.
+
+        The records are therefore split in chunks respecting the limits
+        published in /info/configuration. When `batch` is true the chunks
+        are uploaded with the batch protocol (``batch=true`` then
+        ``commit=true``) so that they are applied atomically; a new batch is
+        started whenever max_total_records or max_total_bytes would be
+        exceeded. Servers without batch support get a series of plain POSTs.
+        The results of every request are merged in the returned object.
         """
-        pass
+        config = self.info_configuration()
+        headers = {}
+        if 'headers' in kwargs:
+            headers = kwargs.pop('headers')
+        params = kwargs.pop('params', {})
+        url = '/storage/%s' % collection.lower()
+
+        upload = _BatchUpload(records, config, params, batch)
+        for chunk, chunk_params in upload:
+            try:
+                resp = self._upload('post', url, chunk.body, headers,
+                                    params=chunk_params, **kwargs)
+            finally:
+                self._invalidate(collection, chunk.ids)
+            upload.add(resp)
+        return upload.result
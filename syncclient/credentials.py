@@ -0,0 +1,157 @@
+"""Caches for the credentials used to reach the Sync server.
+
+A credential cache maps a key to the credentials object returned by
+:meth:`syncclient.client.TokenserverClient.get_hawk_credentials`, extended
+with an ``expires`` timestamp. It only needs ``get(key)`` and
+``set(key, credentials)`` methods.
+
+:class:`FxASessionCache` keeps Firefox Accounts sessions, so that
+:func:`syncclient.client.get_browserid_assertion` does not need to log in
+every time.
+"""
+import base64
+import binascii
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class MemoryCredentialCache(object):
+    """Keeps the credentials in memory, shared by the clients of a
+    process.
+    """
+    def __init__(self):
+        self._credentials = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            credentials = self._credentials.get(key)
+            return dict(credentials) if credentials is not None else None
+
+    def set(self, key, credentials):
+        with self._lock:
+            self._credentials[key] = dict(credentials)
+
+    def delete(self, key):
+        with self._lock:
+            self._credentials.pop(key, None)
+
+
+class FileCredentialCache(object):
+    """Keeps the credentials in a JSON file, readable by the owner only, so
+    that several processes can reuse the same token.
+
+    Accesses are serialised with an advisory lock on ``<path>.lock`` and the
+    file is replaced atomically.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock:
+            with open(self.path + '.lock', 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def get(self, key):
+        with self._locked():
+            return self._read().get(key)
+
+    def _write(self, content):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(content, f)
+            os.chmod(tmp_path, 0o600)
+            getattr(os, 'replace', os.rename)(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def set(self, key, credentials):
+        with self._locked():
+            content = self._read()
+            content[key] = credentials
+            self._write(content)
+
+    def delete(self, key):
+        with self._locked():
+            content = self._read()
+            if content.pop(key, None) is not None:
+                self._write(content)
+
+
+class FxASessionCache(FileCredentialCache):
+    """Keeps Firefox Accounts session tokens and the matching keyB in a
+    file, encrypted with a key derived from `secret`.
+
+    Entries are indexed by a hash of the account email. An entry that
+    cannot be decrypted with `secret`, for instance because the password it
+    is derived from changed, is treated as missing.
+
+    :param iterations:
+        the number of PBKDF2 iterations used to derive the encryption key.
+    """
+    def __init__(self, path, secret, iterations=10000):
+        super(FxASessionCache, self).__init__(path)
+        if not isinstance(secret, bytes):
+            secret = secret.encode('utf-8')
+        self._secret = secret
+        self.iterations = iterations
+
+    def _fernet(self, salt):
+        from cryptography.fernet import Fernet
+        key = hashlib.pbkdf2_hmac('sha256', self._secret, salt,
+                                  self.iterations)
+        return Fernet(base64.urlsafe_b64encode(key))
+
+    @staticmethod
+    def _key(email):
+        return hashlib.sha256(email.lower().encode('utf-8')).hexdigest()
+
+    def get(self, email):
+        from cryptography.fernet import InvalidToken
+        entry = super(FxASessionCache, self).get(self._key(email))
+        if entry is None:
+            return None
+        try:
+            fernet = self._fernet(binascii.unhexlify(entry['salt']))
+            data = fernet.decrypt(entry['data'].encode('ascii'))
+        except (InvalidToken, KeyError, TypeError, ValueError):
+            return None
+        return json.loads(data.decode('utf-8'))
+
+    def set(self, email, session):
+        salt = os.urandom(16)
+        data = self._fernet(salt).encrypt(json.dumps(session).encode('utf-8'))
+        super(FxASessionCache, self).set(self._key(email), {
+            'salt': binascii.hexlify(salt).decode('ascii'),
+            'data': data.decode('ascii')
+        })
+
+    def delete(self, email):
+        super(FxASessionCache, self).delete(self._key(email))
@@ -0,0 +1,188 @@
+"""Decryption of the BSO payloads.
+
+The payload of a Sync record is a JSON object holding a base64 AES-256-CBC
+`ciphertext`, its base64 `IV` and the hex HMAC-SHA256 of the ciphertext.
+Records are encrypted with per-collection keys, themselves stored in the
+``crypto/keys`` record and encrypted with a key bundle derived from the
+Firefox Accounts keyB.
+"""
+import base64
+import collections
+import hashlib
+import hmac
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import six
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from requests_hawk import HKDF
+
+from syncclient.errors import SyncClientError
+
+SYNC_KEY_INFO = 'identity.mozilla.com/picl/v1/oldsync'
+DECRYPT_CHUNK_SIZE = 500
+
+
+class DecryptionError(SyncClientError):
+    """A payload could not be authenticated or decrypted."""
+
+
+def _load_payload(payload):
+    if isinstance(payload, six.string_types):
+        payload = json.loads(payload)
+    return payload
+
+
+class KeyBundle(object):
+    """A pair of AES-256 encryption key and HMAC-SHA256 key."""
+
+    def __init__(self, encryption_key, hmac_key):
+        self.encryption_key = encryption_key
+        self.hmac_key = hmac_key
+
+    @classmethod
+    def from_kB(cls, kB):
+        """Derive the root Sync key bundle from the Firefox Accounts keyB."""
+        material = HKDF(kB, b'', SYNC_KEY_INFO, 64)
+        return cls(material[:32], material[32:])
+
+    @classmethod
+    def from_base64(cls, encryption_key, hmac_key):
+        return cls(base64.b64decode(encryption_key),
+                   base64.b64decode(hmac_key))
+
+    def to_base64(self):
+        return [base64.b64encode(self.encryption_key).decode('ascii'),
+                base64.b64encode(self.hmac_key).decode('ascii')]
+
+    def __eq__(self, other):
+        return (isinstance(other, KeyBundle) and
+                self.encryption_key == other.encryption_key and
+                self.hmac_key == other.hmac_key)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def _hmac(self, ciphertext):
+        return hmac.new(self.hmac_key, ciphertext.encode('ascii'),
+                        hashlib.sha256).hexdigest()
+
+    def decrypt(self, payload):
+        """Verify and decrypt a payload, given as a JSON string or object,
+        and return the decoded cleartext.
+        """
+        payload = _load_payload(payload)
+        try:
+            ciphertext = payload['ciphertext']
+            iv = base64.b64decode(payload['IV'])
+            expected_hmac = payload['hmac']
+        except (KeyError, TypeError, ValueError):
+            raise DecryptionError("Malformed encrypted payload")
+
+        try:
+            valid = hmac.compare_digest(self._hmac(ciphertext).encode('ascii'),
+                                        expected_hmac.encode('ascii'))
+        except (AttributeError, ValueError):
+            valid = False
+        if not valid:
+            raise DecryptionError("HMAC mismatch")
+
+        decryptor = Cipher(algorithms.AES(self.encryption_key),
+                           modes.CBC(iv), backend=default_backend()
+                           ).decryptor()
+        unpadder = padding.PKCS7(128).unpadder()
+        try:
+            data = decryptor.update(base64.b64decode(ciphertext))
+            data += decryptor.finalize()
+            data = unpadder.update(data) + unpadder.finalize()
+            # With the wrong key, the padding can still look valid.
+            return json.loads(data.decode('utf-8'))
+        except ValueError:
+            raise DecryptionError("Invalid ciphertext")
+
+    def encrypt(self, cleartext, iv=None):
+        """Encrypt an object and return the payload object to store."""
+        iv = iv or os.urandom(16)
+        padder = padding.PKCS7(128).padder()
+        data = padder.update(json.dumps(cleartext).encode('utf-8'))
+        data += padder.finalize()
+        encryptor = Cipher(algorithms.AES(self.encryption_key),
+                           modes.CBC(iv), backend=default_backend()
+                           ).encryptor()
+        data = encryptor.update(data) + encryptor.finalize()
+        ciphertext = base64.b64encode(data).decode('ascii')
+        return {'ciphertext': ciphertext,
+                'IV': base64.b64encode(iv).decode('ascii'),
+                'hmac': self._hmac(ciphertext)}
+
+
+class CollectionKeys(object):
+    """The default and per-collection key bundles of ``crypto/keys``."""
+
+    def __init__(self, default, collections=None):
+        self.default = default
+        self.collections = collections or {}
+
+    @classmethod
+    def from_record(cls, record, root_bundle):
+        """Decrypt the ``crypto/keys`` record with the root key bundle."""
+        keys = root_bundle.decrypt(record['payload'])
+        collections = dict(
+            (name, KeyBundle.from_base64(*pair))
+            for name, pair in keys.get('collections', {}).items())
+        return cls(KeyBundle.from_base64(*keys['default']), collections)
+
+    def bundle_for(self, collection):
+        return self.collections.get(collection.lower(), self.default)
+
+
+def _decrypt_record(bundle, record):
+    record = dict(record)
+    record['payload'] = bundle.decrypt(record['payload'])
+    return record
+
+
+def _decrypt_chunk(args):
+    bundle, records = args
+    return [_decrypt_record(bundle, record) for record in records]
+
+
+def decrypt_records(records, bundle, processes=None,
+                    chunk_size=DECRYPT_CHUNK_SIZE):
+    """
+    Decrypt the payload of an iterable of BSOs with a key bundle and yield
+    copies of the records holding the cleartext payloads, in order.
+
+    :param processes:
+        when greater than 1, records are decrypted by chunks of
+        `chunk_size` in a pool of that many processes.
+    """
+    if not processes or processes <= 1:
+        for record in records:
+            yield _decrypt_record(bundle, record)
+        return
+
+    def chunks():
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                yield bundle, chunk
+                chunk = []
+        if chunk:
+            yield bundle, chunk
+
+    pending = collections.deque()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for chunk in chunks():
+            if len(pending) >= 2 * processes:
+                # Only read a bounded number of chunks ahead of the caller.
+                for record in pending.popleft().result():
+                    yield record
+            pending.append(executor.submit(_decrypt_chunk, chunk))
+        while pending:
+            for record in pending.popleft().result():
+                yield record
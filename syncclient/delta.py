@@ -0,0 +1,56 @@
+"""Work out how a local copy of a collection differs from the server.
+
+A snapshot maps the ids of the records known locally to their ``modified``
+time. Comparing it with two id listings of the server, the ids modified
+since the snapshot high-water mark and all the ids, tells which records
+were added, changed or removed without downloading any payload; only the
+added and changed records then need to be fetched.
+"""
+from collections import namedtuple
+
+from syncclient.client import DEFAULT_MAX_WORKERS
+
+Delta = namedtuple('Delta', ['added', 'changed', 'removed',
+                             'high_water_mark'])
+Delta.__doc__ = """The sorted ids added to, changed on and removed from the
+server, and the collection timestamp to use as the next high-water mark."""
+
+
+def plan_delta(client, collection, snapshot, high_water_mark=None):
+    """Compare a snapshot with the server and return a :class:`Delta`.
+
+    :param snapshot:
+        an object mapping the local ids to their modified time.
+
+    :param high_water_mark:
+        the time the snapshot is up to date with. Defaults to the most
+        recent modified time of the snapshot.
+    """
+    if high_water_mark is None and snapshot:
+        high_water_mark = max(snapshot.values())
+
+    # List the recent changes first: a record modified between the two
+    # listings is then newer than the returned high-water mark.
+    recent = None
+    if high_water_mark is not None:
+        recent = set(client.get_records(collection, full=False,
+                                        newer=high_water_mark))
+        last_modified = client.raw_resp.headers.get('X-Last-Modified')
+    server_ids = set(client.get_records(collection, full=False))
+    if recent is None:
+        recent = set()
+        last_modified = client.raw_resp.headers.get('X-Last-Modified')
+    if last_modified is not None:
+        last_modified = float(last_modified)
+
+    local_ids = set(snapshot)
+    return Delta(added=sorted(server_ids - local_ids),
+                 changed=sorted((recent & server_ids) & local_ids),
+                 removed=sorted(local_ids - server_ids),
+                 high_water_mark=last_modified)
+
+
+def fetch_delta(client, collection, delta, max_workers=DEFAULT_MAX_WORKERS):
+    """Yield the full records added or changed in a :class:`Delta`."""
+    return client.fetch_records(collection, delta.added + delta.changed,
+                                max_workers=max_workers)
@@ -0,0 +1,7 @@
+"""The exceptions of syncclient, in a module of their own so that the
+modules used by :mod:`syncclient.client` can raise them.
+"""
+
+
+class SyncClientError(Exception):
+    """An error occured in SyncClient."""
@@ -0,0 +1,132 @@
+"""Hawk request signing for the storage nodes.
+
+:class:`HawkSigner` is a drop-in replacement of
+:class:`requests_hawk.HawkAuth` for clients sending many requests with the
+same credentials: the HMAC key schedule is computed once, the payload hash is
+fed the body as is, without building a normalized copy of it, and the clock
+skew with the server is learnt from the ``X-Weave-Timestamp`` header of the
+responses so that requests are not rejected for a stale timestamp.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+import time
+
+import six
+from requests.auth import AuthBase
+from six.moves.urllib.parse import urlsplit
+
+HASH_CHUNK_SIZE = 64 * 1024
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+
+def _to_bytes(value):
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    return value
+
+
+def _b64(digest):
+    return base64.b64encode(digest).decode('ascii')
+
+
+class HawkSigner(AuthBase):
+    """Sign requests with a Hawk ``Authorization`` header.
+
+    Requests without a body are signed without payload hash. Bodies given as
+    a file object are hashed chunk by chunk and rewound; bodies that can only
+    be iterated once are not hashed.
+
+    :param skew:
+        the initial difference, in seconds, between the server clock and
+        ours. It is then updated from the responses.
+    """
+
+    def __init__(self, id, key, algorithm='sha256', ext=None, skew=0,
+                 clock=time.time):
+        self.id = id
+        self.algorithm = algorithm
+        # Same attribute as requests_hawk.HawkAuth.
+        self.credentials = {'id': id, 'key': key, 'algorithm': algorithm}
+        self.ext = ext
+        self.skew = skew
+        self.clock = clock
+        self._digestmod = getattr(hashlib, algorithm)
+        self._mac = hmac.new(_to_bytes(key), digestmod=self._digestmod)
+
+    def payload_hash(self, body, content_type):
+        """The base64 Hawk hash of a body, or None if it cannot be read
+        twice.
+        """
+        mime_type = content_type.split(';')[0].strip().lower()
+        digest = self._digestmod()
+        digest.update(b'hawk.1.payload\n' + _to_bytes(mime_type) + b'\n')
+        if hasattr(body, 'read'):
+            if not hasattr(body, 'seek'):
+                return None
+            position = body.tell()
+            while True:
+                chunk = body.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(_to_bytes(chunk))
+            body.seek(position)
+        elif isinstance(body, (bytes, six.text_type)):
+            digest.update(_to_bytes(body))
+        else:
+            return None
+        digest.update(b'\n')
+        return _b64(digest.digest())
+
+    def header(self, method, url, body=None, content_type='', timestamp=None,
+               nonce=None):
+        """Build the ``Authorization`` header of a request."""
+        if timestamp is None:
+            timestamp = int(self.clock() + self.skew)
+        if nonce is None:
+            nonce = binascii.hexlify(os.urandom(6)).decode('ascii')
+        parts = urlsplit(url)
+        resource = parts.path or '/'
+        if parts.query:
+            resource += '?' + parts.query
+        port = (str(parts.port) if parts.port is not None
+                else DEFAULT_PORTS.get(parts.scheme, ''))
+        payload_hash = None
+        if body is not None:
+            payload_hash = self.payload_hash(body, content_type or '')
+
+        normalized = u'hawk.1.header\n%s\n%s\n%s\n%s\n%s\n%s\n%s\n%s\n' % (
+            timestamp, nonce, method.upper(), resource,
+            parts.hostname.lower(), port, payload_hash or '',
+            self.ext or '')
+        mac = self._mac.copy()
+        mac.update(normalized.encode('utf-8'))
+
+        header = u'Hawk id="%s", ts="%s", nonce="%s"' % (
+            self.id, timestamp, nonce)
+        if payload_hash is not None:
+            header += u', hash="%s"' % payload_hash
+        if self.ext:
+            header += u', ext="%s"' % self.ext
+        return header + u', mac="%s"' % _b64(mac.digest())
+
+    def update_skew(self, response, *args, **kwargs):
+        """Response hook learning the server clock from
+        ``X-Weave-Timestamp``.
+        """
+        server_time = response.headers.get('X-Weave-Timestamp')
+        if server_time is not None:
+            try:
+                self.skew = float(server_time) - self.clock()
+            except ValueError:
+                pass
+        return response
+
+    def __call__(self, request):
+        request.headers['Authorization'] = self.header(
+            request.method, request.url, request.body,
+            request.headers.get('Content-Type', ''))
+        request.register_hook('response', self.update_skew)
+        return request
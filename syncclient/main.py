@@ -1,28 +1,335 @@
 import argparse
-from client import SyncClient, get_browserid_assertion
+import collections
+import json
+import os
+import shlex
+import sys
+import tempfile
+import types
+from binascii import hexlify, unhexlify
 from pprint import pprint
 
+import six
 
-def main():
+# The methods of SyncClient that make sense as actions, listed here rather
+# than introspected so that parsing the command line does not import the
+# client.
+CLIENT_ACTIONS = (
+    'delete_all_records', 'delete_collection', 'delete_record',
+    'delete_records', 'fetch_collections', 'fetch_records',
+    'get_collection_counts', 'get_collection_usage', 'get_record',
+    'get_records', 'info_collections', 'info_configuration', 'info_quota',
+    'iter_records', 'post_records', 'put_record', 'stream_records',
+    'throttle_state')
+ACTIONS = CLIENT_ACTIONS + ('export', 'import')
+DEFAULT_ACTION = 'info_collections'
+# The fields of a credentials file, keyB being optional.
+CREDENTIALS_FIELDS = ('uid', 'api_endpoint', 'hashalg', 'id', 'key')
+DECRYPTED_ACTIONS = ('get_records', 'get_record')
+
+
+def _ids(value):
+    return [item for item in value.split(',') if item]
+
+
+# How the arguments of the actions taking lists are given on the command
+# line: comma-separated ids or collections, or JSON records.
+ARGUMENT_PARSERS = {
+    'delete_records': (None, _ids),
+    'fetch_collections': (_ids,),
+    'fetch_records': (None, _ids),
+    'post_records': (None, json.loads),
+}
+# A batch line waiting for the previous lines to finish.
+BATCH_BARRIER = 'wait'
+
+
+def load_credentials(path):
+    """Read the Hawk credentials of a file written with
+    ``--save-credentials``, or the JSON returned by the Token Server.
+
+    Returns the credentials and keyB, None if the file does not have it.
+    """
+    with open(path) as f:
+        credentials = json.load(f)
+    missing = [field for field in CREDENTIALS_FIELDS
+               if field not in credentials]
+    if missing:
+        raise ValueError('%s misses %s' % (path, ', '.join(missing)))
+    keyB = credentials.pop('keyB', None)
+    if keyB is not None:
+        keyB = unhexlify(keyB)
+    return credentials, keyB
+
+
+def save_credentials(path, client, keyB=None):
+    """Write the Hawk credentials of a client, and keyB, to a file
+    readable by the owner only.
+    """
+    credentials = dict(client.auth.credentials, uid=client.user_id,
+                       api_endpoint=client.api_endpoint)
+    credentials['hashalg'] = credentials.pop('algorithm')
+    if client.credentials_expire is not None:
+        credentials['expires'] = client.credentials_expire
+    if keyB is not None:
+        credentials['keyB'] = hexlify(keyB).decode('ascii')
+    # Like syncclient.credentials.FileCredentialCache: never readable by
+    # others, even for a moment, and replaced atomically.
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(credentials, f, indent=2, sort_keys=True)
+        os.chmod(tmp_path, 0o600)
+        getattr(os, 'replace', os.rename)(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def parse_arguments(action, arguments):
+    """Convert the string arguments of an action taking lists, see
+    :data:`ARGUMENT_PARSERS`. Arguments given as JSON lists in a batch are
+    kept as they are.
+    """
+    parsers = ARGUMENT_PARSERS.get(action, ())
+    arguments = list(arguments)
+    for position, parser in enumerate(parsers[:len(arguments)]):
+        if parser is not None and isinstance(arguments[position],
+                                             six.string_types):
+            arguments[position] = parser(arguments[position])
+    return arguments
+
+
+def run_action(client, action, arguments, options, keyB=None):
+    """Run an action of the command line with a client and return its
+    result, the records yielded being returned as a list.
+    """
+    from syncclient.errors import SyncClientError
+
+    if action not in ACTIONS:
+        raise SyncClientError('Unknown action: %r' % (action,))
+    if action == 'export':
+        from syncclient.archive import export
+        return export(client, options.output, arguments or None)
+    if action == 'import':
+        from syncclient.archive import restore
+        if not arguments:
+            raise SyncClientError('import needs an export directory or a '
+                                  '<collection>.ndjson[.gz] file')
+        return restore(client, arguments[0], arguments[1:] or None,
+                       max_workers=options.workers)
+    result = getattr(client, action)(*parse_arguments(action, arguments))
+    if isinstance(result, types.GeneratorType):
+        result = list(result)
+    if options.decrypt and action in DECRYPTED_ACTIONS:
+        if keyB is None:
+            raise SyncClientError('--decrypt needs keyB: log in, or add it '
+                                  'to the credentials file')
+        if client.collection_keys is None:
+            client.fetch_collection_keys(keyB)
+        records = result if isinstance(result, list) else [result]
+        result = list(client.decrypt_records(arguments[0], records))
+    return result
+
+
+def parse_batch_line(line):
+    """Split a batch line into the action and its arguments.
+
+    Lines are split like shell words, or parsed as a JSON list when they
+    start with ``[``, so that arguments can be objects, e.g. the record of
+    ``put_record``.
+    """
+    if line.startswith('['):
+        words = json.loads(line)
+        if not isinstance(words, list) or not words:
+            raise ValueError('A JSON line should be a non-empty list')
+    else:
+        words = shlex.split(line)
+    return words[0], words[1:]
+
+
+def run_batch(client, lines, options, keyB=None, out=None, parallel=1):
+    """Run the actions of a batch, one per line, with the same client.
+
+    Blank lines and lines starting with ``#`` are ignored. For each action,
+    a JSON object is written to `out` with the ``line`` number and either
+    its ``result`` or its ``error``, in the order of the lines.
+
+    :param parallel:
+        the number of actions run at once. A ``wait`` line then waits for
+        the actions of the previous lines to finish before running the
+        next ones.
+
+    Returns the number of actions that failed.
+    """
+    if out is None:
+        out = sys.stdout
+    failures = [0]
+
+    def run(number, line):
+        entry = {'line': number}
+        try:
+            action, arguments = parse_batch_line(line)
+            entry['action'] = action
+            entry['result'] = run_action(client, action, arguments, options,
+                                         keyB)
+        except Exception as e:
+            entry['error'] = '%s: %s' % (type(e).__name__, e)
+        return entry
+
+    def write(entry):
+        if 'error' in entry:
+            failures[0] += 1
+        out.write(json.dumps(entry, sort_keys=True, default=str) + '\n')
+        out.flush()
+
+    def actions():
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield number, line
+
+    if parallel <= 1:
+        # Each result is written as soon as it is known, which makes an
+        # interactive session possible on the standard input.
+        for number, line in actions():
+            if line != BATCH_BARRIER:
+                write(run(number, line))
+        return failures[0]
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        for number, line in actions():
+            if line == BATCH_BARRIER:
+                while pending:
+                    write(pending.popleft().result())
+                continue
+            pending.append(executor.submit(run, number, line))
+            while pending and pending[0].done():
+                write(pending.popleft().result())
+        while pending:
+            write(pending.popleft().result())
+    return failures[0]
+
+
+def main(args=None):
     parser = argparse.ArgumentParser(
         description="""CLI to interact with Firefox Sync""",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
     )
-    parser.add_argument(dest='login',
-                        help='Firefox Accounts login.')
-    parser.add_argument(dest='password',
-                        help='Firefox Accounts password.')
-    parser.add_argument(dest='action', help='The action to be executed',
-                        default='info_collections', nargs='?',
-                        choices=[m for m in dir(SyncClient)
-                                 if not m.startswith('_')])
+    parser.add_argument(dest='arguments', nargs='*', metavar='ARG',
+                        help='The Firefox Accounts login and password, '
+                             'unless --credentials is given, followed by '
+                             'the action to be executed (%s by default, '
+                             'one of %s) and its arguments. Lists of ids '
+                             'or collections are comma-separated, the '
+                             'records of post_records a JSON list.' % (
+                                 DEFAULT_ACTION, ', '.join(ACTIONS)))
+
+    parser.add_argument('--credentials', dest='credentials',
+                        help='JSON file with the Hawk credentials of the '
+                             'storage node (uid, api_endpoint, hashalg, id, '
+                             'key and optionally keyB), used instead of '
+                             'logging in to Firefox Accounts.')
+
+    parser.add_argument('--save-credentials', dest='save_credentials',
+                        help='File where the Hawk credentials obtained '
+                             'after the login are written, to be given to '
+                             '--credentials on the next runs. It holds keyB '
+                             'in clear and is only readable by its owner.')
+
+    parser.add_argument('--session-cache', dest='session_cache',
+                        help='File where the Firefox Accounts session is '
+                             'kept, encrypted with the password, to skip the '
+                             'login on the next runs.')
+
+    parser.add_argument('--decrypt', action='store_true',
+                        help='Decrypt the records returned by get_records '
+                             'and get_record.')
+
+    parser.add_argument('--output', dest='output', default='sync-export',
+                        help='Directory where the export action writes the '
+                             'collections given as extra arguments, or all '
+                             'of them, and resumes a previous export.')
+
+    parser.add_argument('--workers', dest='workers', type=int, default=4,
+                        help='Number of concurrent uploads of the import '
+                             'action.')
+
+    parser.add_argument('--batch', dest='batch', metavar='FILE',
+                        help='Run the actions of a file, or of the standard '
+                             'input with -, one per line with its '
+                             'arguments, and write the result of each as a '
+                             'JSON line. Lines can also be JSON lists.')
+
+    parser.add_argument('--parallel', dest='parallel', type=int, default=1,
+                        help='Number of batch actions run at once. A "wait" '
+                             'line waits for the previous ones to finish.')
+
+    args = parser.parse_args(args)
+
+    arguments = list(args.arguments)
+    if args.credentials is None:
+        if len(arguments) < 2:
+            parser.error('the login and the password are required, unless '
+                         '--credentials is given')
+        login, password = arguments[:2]
+        arguments = arguments[2:]
+    if args.batch is not None:
+        if arguments:
+            parser.error('no action can be given with --batch')
+    else:
+        action = arguments.pop(0) if arguments else DEFAULT_ACTION
+        if action not in ACTIONS:
+            parser.error('invalid action: %r (choose from %s)' % (
+                action, ', '.join(ACTIONS)))
+        if action == 'import' and not arguments:
+            parser.error('import needs an export directory or a '
+                         '<collection>.ndjson[.gz] file')
+
+    # Only import what the action needs: the client does not load PyFxA
+    # and its cryptography stack unless we log in.
+    from syncclient.client import SyncClient
+
+    if args.credentials is not None:
+        try:
+            credentials, keyB = load_credentials(args.credentials)
+        except (IOError, OSError, ValueError) as e:
+            parser.error('unable to read the credentials: %s' % e)
+        client = SyncClient(**credentials)
+    else:
+        from syncclient.client import fxa_assertion_provider, get_client_state
+
+        session_cache = None
+        if args.session_cache:
+            from syncclient.credentials import FxASessionCache
+            session_cache = FxASessionCache(args.session_cache, password)
+        # Batches can outlive a token: refreshing it needs a new assertion.
+        bid_assertion, keyB = fxa_assertion_provider(
+            login, password, session_cache=session_cache)
+        client = SyncClient(bid_assertion, get_client_state(keyB))
+        if args.save_credentials:
+            save_credentials(args.save_credentials, client, keyB)
 
-    args, extra = parser.parse_known_args()
+    if args.batch is not None:
+        if args.batch == '-':
+            failures = run_batch(client, sys.stdin, args, keyB,
+                                 parallel=args.parallel)
+        else:
+            with open(args.batch) as lines:
+                failures = run_batch(client, lines, args, keyB,
+                                     parallel=args.parallel)
+        return 1 if failures else 0
 
-    bid_assertion_args = get_browserid_assertion(args.login, args.password)
-    client = SyncClient(*bid_assertion_args)
-    pprint(getattr(client, args.action)(*extra))
+    if args.decrypt and action in DECRYPTED_ACTIONS and keyB is None:
+        parser.error('--decrypt needs keyB: log in, or add it to the '
+                     'credentials file')
+    pprint(run_action(client, action, arguments, args, keyB))
+    return 0
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,231 @@
+"""Instrumentation of the requests sent to the storage nodes.
+
+Every callable given in the ``hooks`` of a
+:class:`syncclient.client.SyncClient` is called with a
+:class:`RequestEvent` once a request is over, successful or not.
+:class:`MetricsCollector` aggregates these events into counters and
+histograms that can be exposed to Prometheus, and :class:`StatsdSink`
+forwards them to a statsd daemon.
+"""
+import logging
+import re
+import socket
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   float('inf'))
+
+TIMINGS = ('sign_time', 'wait_time', 'download_time', 'decode_time',
+           'duration')
+
+
+class RequestEvent(object):
+    """What happened during a request.
+
+    Durations are in seconds. ``wait_time`` goes from the moment the request
+    is sent, including the DNS resolution and connection when no pooled
+    connection is available, until the response headers are received.
+    ``download_time`` is the time spent reading the body afterwards, and
+    ``decode_time`` parsing its JSON. ``bytes_received`` counts the body
+    as received, before it is decompressed.
+
+    ``retries`` counts the extra attempts made after a 401 or while the
+    node was unavailable, and ``cache_hit`` is set when a 304 was answered
+    from the conditional requests cache. ``error`` holds the name of the
+    exception raised, if any.
+
+    Streamed responses are reported as soon as their headers are received,
+    without the download and decoding of their body.
+    """
+    __slots__ = ('method', 'path', 'node', 'collection', 'status',
+                 'bytes_sent', 'bytes_received', 'sign_time', 'wait_time',
+                 'download_time', 'decode_time', 'duration', 'retries',
+                 'cache_hit', 'error')
+
+    def __init__(self, method, path, node=None):
+        self.method = method.upper()
+        self.path = path
+        self.node = node
+        parts = path.split('/')
+        self.collection = (parts[2] if len(parts) > 2 and
+                           parts[1] == 'storage' else None)
+        self.status = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.sign_time = 0.0
+        self.wait_time = 0.0
+        self.download_time = 0.0
+        self.decode_time = 0.0
+        self.duration = 0.0
+        self.retries = 0
+        self.cache_hit = False
+        self.error = None
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __repr__(self):
+        return '<RequestEvent %s %s status=%r duration=%.3f>' % (
+            self.method, self.path, self.status, self.duration)
+
+
+def emit(hooks, event):
+    """Call each hook with the event. A failing hook is logged and does not
+    interrupt the request.
+    """
+    for hook in hooks:
+        try:
+            hook(event)
+        except Exception:
+            logger.warning("Request hook %r failed", hook, exc_info=True)
+
+
+class Histogram(object):
+    """Cumulative histogram of observed values."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[idx] += 1
+
+
+class MetricsCollector(object):
+    """A request hook aggregating the events per storage node, collection,
+    method and status.
+
+    Counters are available as ``requests``, ``retries``, ``cache_hits``,
+    ``errors``, ``bytes_sent`` and ``bytes_received``, and there is a
+    histogram for each of the durations of :class:`RequestEvent`.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def _increment(self, name, labels, value=1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def __call__(self, event):
+        labels = (('node', event.node or ''),
+                  ('collection', event.collection or ''),
+                  ('method', event.method))
+        status = str(event.status) if event.status is not None else ''
+        with self._lock:
+            self._increment('requests', labels + (('status', status),))
+            self._increment('bytes_sent', labels, event.bytes_sent)
+            self._increment('bytes_received', labels, event.bytes_received)
+            if event.retries:
+                self._increment('retries', labels, event.retries)
+            if event.cache_hit:
+                self._increment('cache_hits', labels)
+            if event.error is not None:
+                self._increment('errors', labels + (('error', event.error),))
+            for name in TIMINGS:
+                key = (name, labels)
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(self.buckets)
+                histogram.observe(getattr(event, name))
+
+    def counter(self, name, **labels):
+        """The sum of a counter over the series matching the labels."""
+        with self._lock:
+            return sum(value for (key, series), value in self._counters.items()
+                       if key == name and
+                       set(labels.items()).issubset(series))
+
+    def histogram(self, name, **labels):
+        """Returns the (count, sum) of the observations matching the
+        labels.
+        """
+        count, total = 0, 0.0
+        with self._lock:
+            for (key, series), histogram in self._histograms.items():
+                if key == name and set(labels.items()).issubset(series):
+                    count += histogram.count
+                    total += histogram.sum
+        return count, total
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def to_prometheus(self, prefix='syncclient'):
+        """Render the metrics in the Prometheus text exposition format."""
+        def labels_text(labels):
+            return ','.join('%s="%s"' % (name, value.replace('"', '\\"'))
+                            for name, value in labels)
+
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(),
+                                key=lambda item: item[0])
+            for (name, labels), value in counters:
+                lines.append('%s_%s_total{%s} %s' % (
+                    prefix, name, labels_text(labels), value))
+            for (name, labels), histogram in histograms:
+                metric = '%s_%s_seconds' % (prefix, name.replace('_time', ''))
+                text = labels_text(labels)
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (
+                        metric, text, le, count))
+                lines.append('%s_sum{%s} %r' % (metric, text, histogram.sum))
+                lines.append('%s_count{%s} %d' % (metric, text,
+                                                  histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def _statsd_name(value):
+    return re.sub(r'[^A-Za-z0-9_-]', '_', value) or '_'
+
+
+class StatsdSink(object):
+    """A request hook sending each event to a statsd daemon over UDP.
+
+    Metrics are named ``<prefix>.<node>.<collection>.<name>``.
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='syncclient'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def lines(self, event):
+        base = '.'.join([self.prefix, _statsd_name(event.node or ''),
+                         _statsd_name(event.collection or '')])
+        lines = ['%s.requests.%s.%s:1|c' % (base, event.method.lower(),
+                                            event.status or 'error'),
+                 '%s.bytes_sent:%d|c' % (base, event.bytes_sent),
+                 '%s.bytes_received:%d|c' % (base, event.bytes_received)]
+        if event.retries:
+            lines.append('%s.retries:%d|c' % (base, event.retries))
+        if event.cache_hit:
+            lines.append('%s.cache_hits:1|c' % base)
+        for name in TIMINGS:
+            lines.append('%s.%s:%.3f|ms' % (base, name,
+                                            getattr(event, name) * 1000))
+        return lines
+
+    def __call__(self, event):
+        self._socket.sendto('\n'.join(self.lines(event)).encode('utf-8'),
+                            self.address)
+
+    def close(self):
+        self._socket.close()
@@ -0,0 +1,294 @@
+"""Run jobs for many accounts with a bounded number of connections.
+
+A :class:`SyncClientPool` keeps a :class:`syncclient.client.SyncClient` per
+account and reuses it, with its token, from one job to the next. Clients
+whose storage node is the same share their connection pool, all of them share
+the backoff state of the nodes, and jobs are dispatched to a fixed number of
+threads so that:
+
+- no more than ``max_per_node`` jobs talk to the same node at once,
+- an account only runs one job at a time,
+- accounts take turns, so that one account with many queued jobs does not
+  starve the others.
+"""
+import collections
+import threading
+from concurrent.futures import Future
+
+from six.moves.urllib.parse import urlparse
+
+from syncclient.backoff import BackoffScheduler
+from syncclient.client import SyncClient, TOKENSERVER_URL, create_session
+from syncclient.credentials import MemoryCredentialCache
+from syncclient.errors import SyncClientError
+
+DEFAULT_POOL_WORKERS = 16
+DEFAULT_MAX_PER_NODE = 4
+DEFAULT_MAX_CLIENTS = 1000
+
+
+class SyncClientPool(object):
+    """Pool of clients for many accounts.
+
+    Register accounts with :meth:`add_account`, then :meth:`submit` jobs,
+    called with the client of the account.
+
+    :param max_workers:
+        the number of jobs running at once, all nodes included.
+
+    :param max_per_node:
+        the number of jobs running at once against the same storage node.
+        Jobs of an account whose client is not created yet count against
+        the Token Server, since they start with a token exchange.
+
+    :param max_clients:
+        the number of clients kept. The least recently used ones are closed
+        beyond that, their credentials staying in the credential cache.
+
+    The other keyword arguments are given to each :class:`SyncClient`.
+    Clients do not refresh their token in the background by default, which
+    would take a thread per cached client: an expired token is renewed,
+    through the shared credential cache, when a request gets a 401.
+    """
+
+    def __init__(self, max_workers=DEFAULT_POOL_WORKERS,
+                 max_per_node=DEFAULT_MAX_PER_NODE,
+                 max_clients=DEFAULT_MAX_CLIENTS,
+                 tokenserver_url=TOKENSERVER_URL, credential_cache=None,
+                 scheduler=None, **client_kwargs):
+        self.max_per_node = max_per_node
+        self.max_clients = max_clients
+        self.tokenserver_url = tokenserver_url
+        if credential_cache is None:
+            credential_cache = MemoryCredentialCache()
+        self.credential_cache = credential_cache
+        if scheduler is None:
+            scheduler = BackoffScheduler()
+        self.scheduler = scheduler
+        self.client_kwargs = client_kwargs
+
+        self._tokenserver_node = urlparse(tokenserver_url).netloc
+        self._tokenserver_session = create_session(pool_maxsize=max_workers)
+        self._sessions = {}
+        self._accounts = {}
+        self._clients = collections.OrderedDict()
+        self._nodes = {}
+        self._queues = {}
+        # Accounts with queued jobs, in the order they get their turn.
+        self._turns = collections.deque()
+        self._running_accounts = set()
+        self._running_nodes = collections.Counter()
+        self._closed = False
+        self._condition = threading.Condition()
+        self._workers = []
+        for _ in range(max_workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def add_account(self, account, bid_assertion=None, client_state=None,
+                    **credentials):
+        """Register the credentials of an account, given like to
+        :class:`SyncClient`.
+
+        Clients are created when the first job of their account starts,
+        and exchange a new token whenever theirs expires: `bid_assertion`
+        must be a callable returning a new assertion each time, such as the
+        one of :func:`syncclient.client.fxa_assertion_provider`.
+        """
+        if bid_assertion is not None and not callable(bid_assertion):
+            raise SyncClientError(
+                "bid_assertion should be a callable returning a new "
+                "assertion for each token exchange")
+        with self._condition:
+            self._accounts[account] = dict(credentials,
+                                           bid_assertion=bid_assertion,
+                                           client_state=client_state)
+
+    def remove_account(self, account):
+        """Forget an account and close its client. Queued jobs still run."""
+        with self._condition:
+            self._accounts.pop(account, None)
+            client = self._clients.pop(account, None)
+            self._nodes.pop(account, None)
+        if client is not None:
+            client.close()
+
+    def session_for(self, api_endpoint):
+        """The session shared by the clients of a storage node."""
+        node = urlparse(api_endpoint).netloc
+        with self._condition:
+            session = self._sessions.get(node)
+            if session is None:
+                session = self._sessions[node] = create_session(
+                    pool_maxsize=self.max_per_node)
+            return session
+
+    def get_client(self, account):
+        """Return the client of an account, creating it if needed."""
+        with self._condition:
+            client = self._clients.get(account)
+            if client is not None:
+                # Most recently used last.
+                self._clients[account] = self._clients.pop(account)
+                return client
+            if account not in self._accounts:
+                raise SyncClientError("Unknown account: %r" % (account,))
+            credentials = dict(self._accounts[account])
+
+        kwargs = dict(self.client_kwargs)
+        kwargs.setdefault('background_refresh', False)
+        kwargs.update(credentials)
+        client = SyncClient(tokenserver_url=self.tokenserver_url,
+                            session=self._tokenserver_session,
+                            credential_cache=self.credential_cache,
+                            scheduler=self.scheduler, **kwargs)
+        # The token exchange is done: talk to the storage node through the
+        # connections shared with the other accounts on that node.
+        client.session = self.session_for(client.api_endpoint)
+
+        evicted = []
+        with self._condition:
+            self._clients[account] = client
+            self._nodes[account] = urlparse(client.api_endpoint).netloc
+            while len(self._clients) > self.max_clients:
+                old_account, old_client = self._clients.popitem(last=False)
+                self._nodes.pop(old_account, None)
+                evicted.append(old_client)
+        for old_client in evicted:
+            old_client.close()
+        return client
+
+    def submit(self, account, func, *args, **kwargs):
+        """Schedule ``func(client, *args, **kwargs)`` with the client of the
+        account and return a :class:`concurrent.futures.Future` of its
+        result.
+        """
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise SyncClientError("The pool is closed")
+            if account not in self._accounts:
+                raise SyncClientError("Unknown account: %r" % (account,))
+            queue = self._queues.get(account)
+            if queue is None:
+                queue = self._queues[account] = collections.deque()
+                self._turns.append(account)
+            queue.append((future, func, args, kwargs))
+            self._condition.notify()
+        return future
+
+    def map(self, func, accounts=None):
+        """Run ``func(client)`` for each account (all of them by default)
+        and return an object mapping the accounts to their future.
+        """
+        if accounts is None:
+            with self._condition:
+                accounts = list(self._accounts)
+        return dict((account, self.submit(account, func))
+                    for account in accounts)
+
+    def _node_of(self, account):
+        return self._nodes.get(account, self._tokenserver_node)
+
+    def _next_job(self):
+        """Pick the job of the first account, in turn order, that is idle
+        and whose node has a free slot.
+        """
+        for _ in range(len(self._turns)):
+            account = self._turns.popleft()
+            node = self._node_of(account)
+            if (account in self._running_accounts or
+                    self._running_nodes[node] >= self.max_per_node):
+                self._turns.append(account)
+                continue
+            queue = self._queues[account]
+            job = queue.popleft()
+            if queue:
+                self._turns.append(account)
+            else:
+                del self._queues[account]
+            self._running_accounts.add(account)
+            self._running_nodes[node] += 1
+            return account, node, job
+        return None
+
+    def _requeue(self, account, job):
+        """Put a job back at the head of the queue of its account."""
+        queue = self._queues.get(account)
+        if queue is None:
+            queue = self._queues[account] = collections.deque()
+            self._turns.appendleft(account)
+        queue.appendleft(job)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                picked = self._next_job()
+                while picked is None:
+                    if self._closed and not self._queues:
+                        return
+                    self._condition.wait()
+                    picked = self._next_job()
+            account, node, job = picked
+            future, func, args, kwargs = job
+            try:
+                try:
+                    client = self.get_client(account)
+                except BaseException as e:
+                    if future.set_running_or_notify_cancel():
+                        future.set_exception(e)
+                    continue
+
+                with self._condition:
+                    storage_node = self._nodes.get(account, node)
+                    if storage_node != node:
+                        # The client was just created: the job now talks to
+                        # the storage node rather than the Token Server.
+                        self._running_nodes[node] -= 1
+                        node = None
+                        if (self._running_nodes[storage_node] >=
+                                self.max_per_node):
+                            self._requeue(account, job)
+                            continue
+                        self._running_nodes[storage_node] += 1
+                        node = storage_node
+
+                if future.set_running_or_notify_cancel():
+                    try:
+                        result = func(client, *args, **kwargs)
+                    except BaseException as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(result)
+            finally:
+                with self._condition:
+                    self._running_accounts.discard(account)
+                    if node is not None:
+                        self._running_nodes[node] -= 1
+                    self._condition.notify_all()
+
+    def close(self):
+        """Stop accepting jobs, wait for the queued ones and close the
+        clients and their sessions.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join()
+        with self._condition:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            sessions = list(self._sessions.values())
+        for client in clients:
+            client.close()
+        for session in sessions + [self._tokenserver_session]:
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,218 @@
+"""Local mirror of Sync collections, for incremental synchronisation."""
+import sqlite3
+import threading
+from itertools import islice
+
+from syncclient.client import DEFAULT_MAX_WORKERS
+from syncclient.delta import fetch_delta, plan_delta
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS collections (
+    user_id TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    modified REAL NOT NULL,
+    PRIMARY KEY (user_id, collection)
+);
+CREATE TABLE IF NOT EXISTS records (
+    user_id TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    id TEXT NOT NULL,
+    modified REAL,
+    sortindex INTEGER,
+    ttl INTEGER,
+    payload TEXT,
+    PRIMARY KEY (user_id, collection, id)
+);
+"""
+
+WRITE_BATCH_SIZE = 1000
+
+
+class RecordStore(object):
+    """SQLite store keeping the BSOs of each user and collection along with
+    the collection high-water mark, i.e. the last-modified time of the
+    collection when it was last synchronised.
+
+    :param path:
+        the SQLite database file, in memory by default.
+    """
+
+    def __init__(self, path=':memory:'):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def collections(self, user_id):
+        """Returns an object mapping the collections stored for the user to
+        their high-water mark.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT collection, modified FROM collections '
+                'WHERE user_id = ?', (user_id,))
+            return dict(rows.fetchall())
+
+    def get_high_water_mark(self, user_id, collection):
+        """Returns the high-water mark of a collection, None if it was never
+        synchronised.
+        """
+        return self.collections(user_id).get(collection)
+
+    def set_high_water_mark(self, user_id, collection, modified):
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO collections '
+                '(user_id, collection, modified) VALUES (?, ?, ?)',
+                (user_id, collection, modified))
+
+    def get_records(self, user_id, collection):
+        """Returns the list of the BSOs stored for a collection."""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT id, modified, sortindex, ttl, payload FROM records '
+                'WHERE user_id = ? AND collection = ? ORDER BY id',
+                (user_id, collection)).fetchall()
+        records = []
+        for row in rows:
+            record = dict(zip(('id', 'modified', 'sortindex', 'ttl',
+                               'payload'), row))
+            records.append(dict((k, v) for k, v in record.items()
+                                if v is not None))
+        return records
+
+    def upsert_records(self, user_id, collection, records):
+        """Creates or replaces the given BSOs. Returns how many were
+        written.
+        """
+        records = iter(records)
+        count = 0
+        while True:
+            batch = [(user_id, collection, record['id'],
+                      record.get('modified'), record.get('sortindex'),
+                      record.get('ttl'), record.get('payload'))
+                     for record in islice(records, WRITE_BATCH_SIZE)]
+            if not batch:
+                return count
+            with self._lock, self._db:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO records (user_id, collection, id, '
+                    'modified, sortindex, ttl, payload) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+            count += len(batch)
+
+    def retain_records(self, user_id, collection, ids):
+        """Deletes the stored BSOs of a collection whose id is not in `ids`.
+        Returns how many were deleted.
+        """
+        ids = set(ids)
+        with self._lock:
+            stored = [row[0] for row in self._db.execute(
+                'SELECT id FROM records WHERE user_id = ? AND collection = ?',
+                (user_id, collection))]
+        removed = [(user_id, collection, record_id) for record_id in stored
+                   if record_id not in ids]
+        with self._lock, self._db:
+            self._db.executemany(
+                'DELETE FROM records '
+                'WHERE user_id = ? AND collection = ? AND id = ?', removed)
+        return len(removed)
+
+    def snapshot(self, user_id, collection):
+        """Returns an object mapping the ids stored for a collection to
+        their modified time.
+        """
+        with self._lock:
+            return dict(self._db.execute(
+                'SELECT id, modified FROM records '
+                'WHERE user_id = ? AND collection = ?',
+                (user_id, collection)).fetchall())
+
+    def delete_records(self, user_id, collection, ids):
+        """Deletes the given BSOs of a collection."""
+        with self._lock, self._db:
+            self._db.executemany(
+                'DELETE FROM records '
+                'WHERE user_id = ? AND collection = ? AND id = ?',
+                [(user_id, collection, record_id) for record_id in ids])
+
+    def delete_collection(self, user_id, collection):
+        """Forgets a collection and all its BSOs."""
+        with self._lock, self._db:
+            self._db.execute(
+                'DELETE FROM records WHERE user_id = ? AND collection = ?',
+                (user_id, collection))
+            self._db.execute(
+                'DELETE FROM collections '
+                'WHERE user_id = ? AND collection = ?', (user_id, collection))
+
+    def sync(self, client, collections=None, prune=True):
+        """
+        Brings the store up to date with the server using a
+        :class:`syncclient.client.SyncClient`.
+
+        Only the collections whose last-modified time moved since the last
+        call are fetched, and only their BSOs modified since then. When
+        nothing changed, a single /info/collections request is made.
+
+        :param collections:
+            the collections to synchronise, all of them by default.
+
+        :param prune:
+            if true, the id listing of each changed collection is fetched to
+            drop the BSOs that were deleted on the server.
+
+        Returns an object mapping each synchronised collection to the
+        number of BSOs that were written.
+        """
+        user_id = str(client.user_id)
+        info = client.info_collections()
+        known = self.collections(user_id)
+        if collections is not None:
+            collections = set(c.lower() for c in collections)
+            info = dict((k, v) for k, v in info.items() if k in collections)
+            known = dict((k, v) for k, v in known.items() if k in collections)
+
+        for collection in set(known) - set(info):
+            self.delete_collection(user_id, collection)
+
+        updated = {}
+        for collection, modified in sorted(info.items()):
+            high_water_mark = known.get(collection)
+            if high_water_mark is not None and modified <= high_water_mark:
+                continue
+
+            records = client.iter_records(collection, newer=high_water_mark)
+            updated[collection] = self.upsert_records(user_id, collection,
+                                                      records)
+            if prune and high_water_mark is not None:
+                ids = client.get_records(collection, full=False)
+                self.retain_records(user_id, collection, ids)
+            self.set_high_water_mark(user_id, collection, modified)
+
+        return updated
+
+    def reconcile(self, client, collection, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        Checks a stored collection against the server id listings and only
+        fetches the BSOs that were added or changed, see
+        :func:`syncclient.delta.plan_delta`. Deleted BSOs are removed.
+
+        Returns the :class:`syncclient.delta.Delta` that was applied.
+        """
+        user_id = str(client.user_id)
+        collection = collection.lower()
+        delta = plan_delta(client, collection,
+                           self.snapshot(user_id, collection),
+                           self.get_high_water_mark(user_id, collection))
+        self.upsert_records(user_id, collection,
+                            fetch_delta(client, collection, delta,
+                                        max_workers=max_workers))
+        self.delete_records(user_id, collection, delta.removed)
+        if delta.high_water_mark is not None:
+            self.set_high_water_mark(user_id, collection,
+                                     delta.high_water_mark)
+        return delta
@@ -0,0 +1,26 @@
+"""Stand-in server of the asyncio client tests, which need Python 3.5."""
+import mohawk
+from aiohttp import web
+
+
+def make_handler(test, credentials):
+    """Build an aiohttp handler answering Token Server exchanges and
+    checking the Hawk signature of the other requests, which are recorded
+    in ``test.requests`` and answered from ``test.responses``.
+    """
+    async def handler(request):
+        body = await request.text()
+        if request.path == '/1.0/sync/1.5':
+            test.requests.append((request.method, request.path_qs, body))
+            return web.json_response(dict(credentials,
+                                          api_endpoint=test.api_endpoint))
+        mohawk.Receiver(
+            lambda id: dict(credentials, algorithm='sha256'),
+            request.headers['Authorization'],
+            str(request.url), request.method,
+            content=body,
+            content_type=request.headers.get('Content-Type', ''))
+        test.requests.append((request.method, request.path_qs, body))
+        status, response = test.responses.get(request.path_qs, (200, {}))
+        return web.json_response(response, status=status)
+    return handler
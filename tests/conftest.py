@@ -0,0 +1,6 @@
+import sys
+
+collect_ignore = []
+if sys.version_info < (3, 5):
+    # The asyncio client and its tests use the async/await syntax.
+    collect_ignore += ['aio_support.py', 'test_aio.py']
@@ -0,0 +1,203 @@
+import sys
+
+import mock
+
+from .support import unittest
+
+try:
+    import asyncio
+    from aiohttp import web, ClientResponseError
+    from aiohttp.test_utils import TestServer
+    from syncclient.aio import (
+        AsyncSyncClient, AsyncTokenserverClient, _ssl_context)
+    from .aio_support import make_handler
+except (ImportError, SyntaxError):  # pragma: no cover
+    web = None
+
+from syncclient.client import SyncClientError
+
+CREDENTIALS = {
+    'uid': '123456',
+    'hashalg': 'sha256',
+    'id': 'mon-id',
+    'key': 'I am not a secure key',
+}
+
+
+@unittest.skipIf(sys.version_info < (3, 5) or web is None,
+                 "aiohttp is not available")
+class AsyncSyncClientTest(unittest.TestCase):
+    def setUp(self):
+        super(AsyncSyncClientTest, self).setUp()
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.requests = []
+        self.responses = {}
+
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}',
+                             make_handler(self, CREDENTIALS))
+        self.server = TestServer(app, loop=self.loop)
+        self._run(self.server.start_server())
+        self.addCleanup(self._run, self.server.close())
+        self.api_endpoint = str(self.server.make_url('/1.5/123456/'))
+
+    def _run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def _client(self, **kwargs):
+        return AsyncSyncClient(api_endpoint=self.api_endpoint, **dict(
+            CREDENTIALS, **kwargs))
+
+    def test_missing_credentials_raise_a_syncclienterror(self):
+        self.assertRaises(SyncClientError, AsyncSyncClient, uid='toto')
+
+    def test_requests_are_hawk_signed(self):
+        self.responses['/1.5/123456/info/collections'] = (200, {'tabs': 1})
+
+        async def scenario():
+            async with self._client() as client:
+                return await client.info_collections()
+
+        self.assertEqual(self._run(scenario()), {'tabs': 1})
+
+    def test_get_records_sends_the_filters(self):
+        async def scenario():
+            async with self._client() as client:
+                await client.get_records('History', newer=12, sort='oldest',
+                                         ids=['a', 'b'])
+                await client.get_record('history', 'a')
+                await client.delete_record('history', 'a')
+
+        self._run(scenario())
+        self.assertEqual(self.requests, [
+            ('GET', '/1.5/123456/storage/history?full=True&ids=a%2Cb&'
+                    'newer=12&sort=oldest', ''),
+            ('GET', '/1.5/123456/storage/history/a', ''),
+            ('DELETE', '/1.5/123456/storage/history/a', ''),
+        ])
+
+    def test_put_record_sends_the_record_without_id(self):
+        async def scenario():
+            async with self._client() as client:
+                await client.put_record('history', '{"id": "a", "x": 1}')
+
+        self._run(scenario())
+        self.assertEqual(self.requests, [
+            ('PUT', '/1.5/123456/storage/history/a', '{"x": 1}')])
+
+    def test_post_records_uses_the_batch_protocol(self):
+        self.responses['/1.5/123456/info/configuration'] = (
+            200, {'max_post_records': 1})
+        self.responses['/1.5/123456/storage/history?batch=true'] = (
+            202, {'batch': 'b1', 'success': ['a']})
+        self.responses['/1.5/123456/storage/history?batch=b1&commit=true'] = (
+            200, {'modified': 3, 'success': ['b']})
+
+        async def scenario():
+            async with self._client() as client:
+                return await client.post_records(
+                    'history', [{'id': 'a'}, {'id': 'b'}])
+
+        result = self._run(scenario())
+        self.assertEqual(result, {'modified': 3, 'success': ['a', 'b'],
+                                  'failed': {}})
+        self.assertEqual([body for _, _, body in self.requests[1:]],
+                         ['[{"id": "a"}]', '[{"id": "b"}]'])
+
+    def test_info_configuration_defaults_on_404(self):
+        self.responses['/1.5/123456/info/configuration'] = (404, {})
+
+        async def scenario():
+            async with self._client() as client:
+                return await client.info_configuration()
+
+        self.assertEqual(self._run(scenario())['max_post_records'], 100)
+
+    def test_errors_are_raised(self):
+        self.responses['/1.5/123456/storage/history/a'] = (503, {})
+
+        async def scenario():
+            async with self._client() as client:
+                await client.get_record('history', 'a')
+
+        self.assertRaises(ClientResponseError, self._run, scenario())
+
+    def test_not_modified_is_an_error(self):
+        self.responses['/1.5/123456/info/collections'] = (304, None)
+
+        async def scenario():
+            async with self._client() as client:
+                await client.info_collections()
+
+        self.assertRaises(ClientResponseError, self._run, scenario())
+
+    def test_info_configuration_errors_are_raised(self):
+        self.responses['/1.5/123456/info/configuration'] = (500, {})
+
+        async def scenario():
+            async with self._client() as client:
+                return await client.info_configuration()
+
+        self.assertRaises(ClientResponseError, self._run, scenario())
+
+    def test_get_records_sends_the_pagination(self):
+        async def scenario():
+            async with self._client() as client:
+                await client.get_records('history', full=False, limit=10,
+                                         offset='abc')
+
+        self._run(scenario())
+        self.assertEqual(self.requests[0][1],
+                         '/1.5/123456/storage/history?limit=10&offset=abc')
+
+    def test_post_records_without_batch_support(self):
+        self.responses['/1.5/123456/info/configuration'] = (
+            200, {'max_post_records': 1})
+        self.responses['/1.5/123456/storage/history?batch=true'] = (
+            200, {'success': ['a']})
+
+        async def scenario():
+            async with self._client() as client:
+                return await client.post_records(
+                    'history', [{'id': 'a'}, {'id': 'b'}])
+
+        self.assertEqual(self._run(scenario())['success'], ['a'])
+        self.assertEqual([path for _, path, _ in self.requests[1:]], [
+            '/1.5/123456/storage/history?batch=true',
+            '/1.5/123456/storage/history'])
+
+    def test_verify_is_translated_to_an_ssl_context(self):
+        self.assertFalse(_ssl_context(False))
+        self.assertIsNone(_ssl_context(True))
+        with mock.patch('ssl.create_default_context') as create:
+            self.assertIs(_ssl_context('/ca.pem'), create.return_value)
+        create.assert_called_with(cafile='/ca.pem')
+
+    def test_credentials_are_exchanged_on_first_request(self):
+        async def scenario():
+            client = AsyncSyncClient(
+                'bid', 'client_state',
+                tokenserver_url=str(self.server.make_url('/')))
+            self.assertIsNone(client.api_endpoint)
+            await asyncio.gather(client.info_collections(),
+                                 client.info_collections())
+            await client.close()
+            return client
+
+        client = self._run(scenario())
+        self.assertEqual(client.user_id, '123456')
+        self.assertEqual([path for _, path, _ in self.requests], [
+            '/1.0/sync/1.5',
+            '/1.5/123456/info/collections',
+            '/1.5/123456/info/collections'])
+
+    def test_tokenserver_client_sends_the_assertion(self):
+        async def scenario():
+            client = AsyncTokenserverClient(
+                'bid', 'client_state', str(self.server.make_url('/')))
+            return await client.get_hawk_credentials(duration=300)
+
+        credentials = self._run(scenario())
+        self.assertEqual(credentials['uid'], '123456')
+        self.assertEqual(self.requests[0][1], '/1.0/sync/1.5?duration=300')
@@ -0,0 +1,297 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+from requests.exceptions import HTTPError
+
+from syncclient.archive import export, read_records, restore
+from .support import unittest
+
+
+class FakeClient(object):
+    """Pages through in-memory collections like a storage node."""
+
+    def __init__(self, collections):
+        self.collections = collections
+        self.requests = []
+        self.fail_at = None
+
+    def info_collections(self):
+        return dict((name, max([r['modified'] for r in records] or [0]))
+                    for name, records in self.collections.items())
+
+    def get_records_page(self, collection, offset=None, full=True,
+                         newer=None, limit=None, sort=None):
+        self.requests.append((collection, offset, newer))
+        if self.fail_at is not None and len(self.requests) == self.fail_at:
+            raise IOError('Connection reset')
+        records = sorted(self.collections.get(collection, []),
+                         key=lambda r: r['modified'])
+        if newer is not None:
+            records = [r for r in records if r['modified'] > newer]
+        start = int(offset or 0)
+        end = start + limit
+        return (records[start:end],
+                str(end) if end < len(records) else None)
+
+
+def records(count, start=0):
+    return [{'id': 'r%03d' % idx, 'modified': 10.0 + idx, 'payload': 'x'}
+            for idx in range(start, start + count)]
+
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.client = FakeClient({'tabs': records(5), 'forms': records(2)})
+
+    def _read(self, collection):
+        path = os.path.join(self.directory, '%s.ndjson.gz' % collection)
+        with gzip.open(path, 'rb') as f:
+            return [json.loads(line.decode('utf-8')) for line in f]
+
+    def _checkpoint(self):
+        with open(os.path.join(self.directory, 'checkpoint.json')) as f:
+            return json.load(f)
+
+    def test_every_collection_is_exported_by_pages(self):
+        result = export(self.client, self.directory, page_size=2)
+        self.assertEqual(result, {'tabs': 5, 'forms': 2})
+        self.assertEqual(self._read('tabs'), records(5))
+        self.assertEqual(self._read('forms'), records(2))
+        self.assertEqual([offset for name, offset, _ in self.client.requests
+                          if name == 'tabs'], [None, '2', '4'])
+
+    def test_selected_collections_only(self):
+        self.assertEqual(export(self.client, self.directory, ['forms']),
+                         {'forms': 2})
+        self.assertFalse(os.path.exists(
+            os.path.join(self.directory, 'tabs.ndjson.gz')))
+
+    def test_checkpoint_records_the_progress(self):
+        export(self.client, self.directory, ['tabs'], page_size=2)
+        state = self._checkpoint()['tabs']
+        self.assertTrue(state['done'])
+        self.assertEqual(state['count'], 5)
+        self.assertEqual(state['high_water_mark'], 14.0)
+        self.assertEqual(state['size'], os.path.getsize(
+            os.path.join(self.directory, 'tabs.ndjson.gz')))
+
+    def test_interrupted_export_resumes_from_the_offset(self):
+        self.client.fail_at = 3
+        self.assertRaises(IOError, export, self.client, self.directory,
+                          ['tabs'], page_size=2)
+        state = self._checkpoint()['tabs']
+        self.assertEqual((state['offset'], state['count']), ('4', 4))
+        # Garbage written after the checkpoint is dropped.
+        with open(os.path.join(self.directory, 'tabs.ndjson.gz'), 'ab') as f:
+            f.write(b'partial')
+
+        self.client.fail_at = None
+        self.client.requests = []
+        self.assertEqual(export(self.client, self.directory, ['tabs'],
+                                page_size=2), {'tabs': 1})
+        self.assertEqual(self.client.requests, [('tabs', '4', None)])
+        self.assertEqual(self._read('tabs'), records(5))
+
+    def test_complete_collections_are_not_downloaded_again(self):
+        export(self.client, self.directory)
+        self.client.requests = []
+        self.assertEqual(export(self.client, self.directory),
+                         {'tabs': 0, 'forms': 0})
+        self.assertEqual(self.client.requests, [])
+
+    def test_new_records_are_appended(self):
+        export(self.client, self.directory, ['tabs'])
+        self.client.collections['tabs'].extend(records(2, start=5))
+        self.client.requests = []
+        self.assertEqual(export(self.client, self.directory, ['tabs']),
+                         {'tabs': 2})
+        self.assertEqual(self.client.requests, [('tabs', None, 14.0)])
+        self.assertEqual(self._read('tabs'), records(7))
+
+    def test_expired_offsets_restart_after_the_high_water_mark(self):
+        self.client.fail_at = 2
+        self.assertRaises(IOError, export, self.client, self.directory,
+                          ['tabs'], page_size=2)
+        self.client.fail_at = None
+        self.client.requests = []
+        error = HTTPError(response=mock.Mock(status_code=400))
+        page = self.client.get_records_page
+        with mock.patch.object(self.client, 'get_records_page',
+                               side_effect=[error, page('tabs', None,
+                                                        newer=10.99,
+                                                        limit=10)]):
+            export(self.client, self.directory, ['tabs'], page_size=10)
+            calls = self.client.get_records_page.call_args_list
+        self.assertEqual(calls[1][1]['newer'], 11.0 - 0.01)
+        self.assertIsNone(calls[1][1]['offset'])
+        # The records of the last exported timestamp are written again.
+        self.assertEqual([r['id'] for r in self._read('tabs')],
+                         ['r000', 'r001', 'r001', 'r002', 'r003', 'r004'])
+
+    def test_other_errors_are_raised(self):
+        error = HTTPError(response=mock.Mock(status_code=503))
+        page = self.client.get_records_page
+        with mock.patch.object(self.client, 'get_records_page',
+                               side_effect=[page('tabs', limit=2), error]):
+            self.assertRaises(HTTPError, export, self.client,
+                              self.directory, ['tabs'], page_size=2)
+        self.assertEqual(self._checkpoint()['tabs']['offset'], '2')
+
+    def test_the_directory_is_created(self):
+        directory = os.path.join(self.directory, 'sub', 'export')
+        self.assertEqual(export(self.client, directory, ['forms']),
+                         {'forms': 2})
+        self.assertTrue(os.path.exists(os.path.join(directory,
+                                                    'checkpoint.json')))
+
+    def test_failed_checkpoint_writes_leave_no_temporary_file(self):
+        with mock.patch('syncclient.archive.json.dump',
+                        side_effect=IOError('Disk full')):
+            self.assertRaises(IOError, export, self.client, self.directory,
+                              ['forms'])
+        self.assertEqual(os.listdir(self.directory), ['forms.ndjson.gz'])
+
+    def test_files_not_matching_the_checkpoint_are_exported_again(self):
+        export(self.client, self.directory, ['tabs'])
+        path = os.path.join(self.directory, 'tabs.ndjson.gz')
+        with open(path, 'wb'):
+            pass
+        self.client.collections['tabs'].extend(records(1, start=5))
+        self.assertEqual(export(self.client, self.directory, ['tabs']),
+                         {'tabs': 6})
+        self.assertEqual(self._read('tabs'), records(6))
+
+
+class UploadingClient(object):
+    def __init__(self, max_post_records=2):
+        self.max_post_records = max_post_records
+        self.uploaded = {}
+        self.posts = []
+        self.failing = set()
+        self.error = None
+
+    def info_configuration(self):
+        return {'max_post_records': self.max_post_records}
+
+    def post_records(self, collection, records, batch=True):
+        self.posts.append((collection, [r['id'] for r in records]))
+        if self.error is not None and any(r['id'] in self.failing
+                                          for r in records):
+            raise self.error
+        result = {'success': [], 'failed': {}}
+        for record in records:
+            if record['id'] in self.failing:
+                result['failed'][record['id']] = ['invalid payload']
+            else:
+                self.uploaded.setdefault(collection, {})[record['id']] = record
+                result['success'].append(record['id'])
+        return result
+
+
+class RestoreTest(unittest.TestCase):
+    def setUp(self):
+        super(RestoreTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.client = UploadingClient()
+
+    def _write(self, name, records, compress=True):
+        path = os.path.join(self.directory, name)
+        opener = gzip.open if compress else open
+        with opener(path, 'wb') as f:
+            for record in records:
+                f.write((json.dumps(record) + '\n').encode('utf-8'))
+        return path
+
+    def test_read_records(self):
+        path = self._write('tabs.ndjson', records(2), compress=False)
+        self.assertEqual(list(read_records(path)), records(2))
+
+    def test_an_export_is_restored_by_collection(self):
+        self._write('tabs.ndjson.gz', records(3))
+        self._write('forms.ndjson', records(1), compress=False)
+        with open(os.path.join(self.directory, 'checkpoint.json'), 'w') as f:
+            f.write('{}')
+        result = restore(self.client, self.directory)
+        self.assertEqual(result, {
+            'tabs': {'uploaded': 3, 'skipped': 0, 'failed': {}},
+            'forms': {'uploaded': 1, 'skipped': 0, 'failed': {}}})
+        self.assertEqual(sorted(self.client.posts), [
+            ('forms', ['r000']), ('tabs', ['r000', 'r001']),
+            ('tabs', ['r002'])])
+
+    def test_only_the_uploadable_fields_are_sent(self):
+        self._write('tabs.ndjson.gz', [{'id': 'a', 'modified': 12.5,
+                                        'payload': 'x', 'sortindex': 3,
+                                        'ttl': 60}])
+        restore(self.client, self.directory)
+        self.assertEqual(self.client.uploaded['tabs']['a'],
+                         {'id': 'a', 'payload': 'x', 'sortindex': 3,
+                          'ttl': 60})
+
+    def test_the_last_version_of_a_record_is_restored(self):
+        self._write('tabs.ndjson.gz', [{'id': 'a', 'payload': 'old'},
+                                       {'id': 'b', 'payload': 'b'},
+                                       {'id': 'a', 'payload': 'new'}])
+        result = restore(self.client, self.directory)
+        self.assertEqual(result['tabs']['uploaded'], 2)
+        self.assertEqual(self.client.uploaded['tabs']['a']['payload'], 'new')
+
+    def test_selected_collections_only(self):
+        self._write('tabs.ndjson.gz', records(1))
+        self._write('forms.ndjson.gz', records(1))
+        self.assertEqual(list(restore(self.client, self.directory,
+                                      collections=['forms'])), ['forms'])
+
+    def test_a_single_archive_can_be_restored(self):
+        path = self._write('history.ndjson.gz', records(3))
+        result = restore(self.client, path)
+        self.assertEqual(result['history']['uploaded'], 3)
+        self.assertTrue(os.path.exists(path + '.journal'))
+
+    def test_uploaded_records_are_not_sent_again(self):
+        self._write('tabs.ndjson.gz', records(5))
+        self.client.failing = set(['r003'])
+        result = restore(self.client, self.directory)
+        self.assertEqual(result['tabs']['failed'],
+                         {'r003': ['invalid payload']})
+
+        self.client.failing = set()
+        self.client.posts = []
+        result = restore(self.client, self.directory)
+        self.assertEqual(result['tabs'],
+                         {'uploaded': 1, 'skipped': 4, 'failed': {}})
+        self.assertEqual(self.client.posts, [('tabs', ['r003'])])
+
+    def test_failed_requests_are_reported_per_record(self):
+        self._write('tabs.ndjson.gz', records(4))
+        self.client.failing = set(['r002'])
+        self.client.error = HTTPError('503 Server Error')
+        result = restore(self.client, self.directory, max_workers=1)
+        self.assertEqual(result['tabs']['uploaded'], 2)
+        self.assertEqual(result['tabs']['failed'],
+                         {'r002': '503 Server Error',
+                          'r003': '503 Server Error'})
+
+    def test_many_chunks_are_uploaded_with_few_workers(self):
+        self._write('tabs.ndjson.gz', records(7))
+        self.client.max_post_records = 1
+        result = restore(self.client, self.directory, max_workers=1)
+        self.assertEqual(result['tabs']['uploaded'], 7)
+        self.assertEqual(sorted(self.client.uploaded['tabs']),
+                         ['r%03d' % idx for idx in range(7)])
+
+    def test_truncated_journal_lines_are_ignored(self):
+        self._write('tabs.ndjson.gz', records(2))
+        with open(os.path.join(self.directory, 'restore.journal'), 'w') as f:
+            f.write('{"collection": "tabs", "ids": ["r000"]}\n{"coll')
+        result = restore(self.client, self.directory)
+        self.assertEqual(result['tabs'],
+                         {'uploaded': 1, 'skipped': 1, 'failed': {}})
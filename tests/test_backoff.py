@@ -0,0 +1,123 @@
+import mock
+
+from syncclient.backoff import BackoffError, BackoffScheduler
+from syncclient.client import SyncClient
+from .support import unittest
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+def response(status_code=200, **headers):
+    resp = mock.MagicMock(status_code=status_code)
+    resp.headers = dict((k.replace('_', '-'), v) for k, v in headers.items())
+    return resp
+
+
+class BackoffSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        super(BackoffSchedulerTest, self).setUp()
+        self.clock = FakeClock()
+        self.scheduler = BackoffScheduler(sleep=self.clock.sleep,
+                                          clock=self.clock.time)
+
+    def test_nodes_without_backoff_do_not_wait(self):
+        self.scheduler.wait('node')
+        self.assertEqual(self.clock.sleeps, [])
+        self.assertEqual(self.scheduler.state(), {})
+
+    def test_x_weave_backoff_is_honoured_per_node(self):
+        self.scheduler.update('node', response(X_Weave_Backoff='30'))
+        self.assertEqual(self.scheduler.state(), {'node': 30})
+        self.scheduler.wait('other')
+        self.scheduler.wait('node')
+        self.assertEqual(self.clock.sleeps, [30])
+        self.assertEqual(self.scheduler.state(), {})
+
+    def test_retry_after_can_be_an_http_date(self):
+        self.scheduler.update('node', response(
+            503, Retry_After='Thu, 01 Jan 1970 00:17:00 GMT'))
+        self.assertEqual(self.scheduler.state(), {'node': 20})
+
+    def test_longest_delay_wins(self):
+        self.scheduler.update('node', response(Retry_After='10'))
+        self.scheduler.update('node', response(X_Weave_Backoff='5',
+                                               Retry_After='invalid'))
+        self.assertEqual(self.scheduler.state(), {'node': 10})
+
+    def test_long_backoffs_raise_by_default(self):
+        self.scheduler.update('node', response(X_Weave_Backoff='3600'))
+        with self.assertRaises(BackoffError) as cm:
+            self.scheduler.wait('node')
+        self.assertEqual(cm.exception.retry_after, 3600)
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_long_waits_can_be_allowed(self):
+        self.scheduler.max_wait = None
+        self.scheduler.update('node', response(X_Weave_Backoff='3600'))
+        self.scheduler.wait('node')
+        self.assertEqual(self.clock.sleeps, [3600])
+
+    def test_retry_delays_are_jittered_and_bounded(self):
+        with mock.patch('syncclient.backoff.random.uniform') as uniform:
+            self.scheduler.retry_delay(2)
+            uniform.assert_called_with(0, 2)
+            self.scheduler.retry_delay(10)
+            uniform.assert_called_with(0, 30)
+
+    def test_only_idempotent_requests_are_retried(self):
+        unavailable = response(503)
+        self.assertTrue(self.scheduler.should_retry('get', unavailable, 0))
+        self.assertFalse(self.scheduler.should_retry('post', unavailable, 0))
+        self.assertFalse(self.scheduler.should_retry('get', unavailable, 3))
+        self.assertFalse(self.scheduler.should_retry('get', response(500), 0))
+
+
+class ClientBackoffTest(unittest.TestCase):
+    def setUp(self):
+        super(ClientBackoffTest, self).setUp()
+        self.clock = FakeClock()
+        self.scheduler = BackoffScheduler(sleep=self.clock.sleep,
+                                          clock=self.clock.time)
+        self.session = mock.MagicMock()
+        self.client = SyncClient(
+            hashalg='sha256', id='id', key='key', uid='uid',
+            api_endpoint='http://node.example.org/1.5/uid/',
+            session=self.session, scheduler=self.scheduler)
+
+    def test_unavailable_idempotent_requests_are_retried(self):
+        self.session.request.side_effect = [
+            response(503, Retry_After='5'), response(200)]
+        with mock.patch('syncclient.backoff.random.uniform', return_value=0):
+            self.client.info_collections()
+        self.assertEqual(self.session.request.call_count, 2)
+        self.assertEqual(self.clock.sleeps, [0, 5])
+
+    def test_posts_are_not_retried(self):
+        self.session.request.return_value = response(503)
+        self.client._request('post', '/storage/tabs')
+        self.assertEqual(self.session.request.call_count, 1)
+        self.session.request.return_value.raise_for_status.assert_called_with()
+
+    def test_retries_are_limited(self):
+        self.session.request.return_value = response(503)
+        self.client.info_collections()
+        self.assertEqual(self.session.request.call_count, 4)
+
+    def test_throttle_state_is_exposed(self):
+        self.session.request.return_value = response(X_Weave_Backoff='60')
+        self.client.info_collections()
+        self.assertEqual(self.client.throttle_state(),
+                         {'node.example.org': 60})
+        self.client.info_collections()
+        self.assertEqual(self.clock.sleeps, [60])
@@ -0,0 +1,71 @@
+import json
+
+import mock
+
+from syncclient.bso import BSO
+from syncclient.client import SyncClient
+from syncclient.crypto import CollectionKeys, KeyBundle
+from .support import unittest
+
+
+class BSOTest(unittest.TestCase):
+    def test_bso_has_no_instance_dict(self):
+        bso = BSO('a')
+        self.assertFalse(hasattr(bso, '__dict__'))
+        self.assertRaises(AttributeError, setattr, bso, 'foo', 'bar')
+
+    def test_dict_round_trip(self):
+        record = {'id': 'a', 'modified': 12.5, 'sortindex': 3,
+                  'payload': '{"x": 1}'}
+        bso = BSO.from_dict(record)
+        self.assertEqual(bso.to_dict(), record)
+        self.assertEqual(bso, BSO.from_dict(record))
+        self.assertNotEqual(bso, BSO('b'))
+        self.assertEqual(repr(bso), "<BSO 'a' modified=12.5>")
+
+    def test_payload_is_decoded_once(self):
+        bso = BSO('a', payload='{"x": 1}')
+        with mock.patch('syncclient.bso.json.loads',
+                        return_value={'x': 1}) as loads:
+            self.assertEqual(bso.data, {'x': 1})
+            self.assertEqual(bso.data, {'x': 1})
+        self.assertEqual(loads.call_count, 1)
+
+    def test_missing_payload(self):
+        self.assertIsNone(BSO('a').data)
+
+    def test_payload_is_decrypted_with_the_keys(self):
+        keys = KeyBundle(b'e' * 32, b'h' * 32)
+        payload = json.dumps(keys.encrypt({'title': 'x'}))
+        self.assertEqual(BSO('a', payload=payload, keys=keys).data,
+                         {'title': 'x'})
+        self.assertIn('ciphertext', BSO('a', payload=payload).data)
+
+
+class ClientBSOTest(unittest.TestCase):
+    def setUp(self):
+        super(ClientBSOTest, self).setUp()
+        self.client = SyncClient(hashalg='sha256', id='id', key='key',
+                                 uid='uid', api_endpoint='http://example.org/')
+        self.client._request = mock.MagicMock()
+
+    def test_get_records_can_return_bsos(self):
+        self.client._request.return_value = [{'id': 'a', 'payload': '{}'}]
+        records = self.client.get_records('tabs', as_bso=True)
+        self.assertEqual(records, [BSO('a', payload='{}')])
+        self.client._request.assert_called_with(
+            'get', '/storage/tabs', params={'full': True})
+
+    def test_ids_are_not_turned_into_bsos(self):
+        self.client._request.return_value = ['a']
+        self.assertEqual(
+            self.client.get_records('tabs', full=False, as_bso=True), ['a'])
+
+    def test_get_record_bso_uses_the_collection_keys(self):
+        keys = KeyBundle(b'e' * 32, b'h' * 32)
+        self.client.collection_keys = CollectionKeys(
+            KeyBundle(b'x' * 32, b'y' * 32), {'tabs': keys})
+        self.client._request.return_value = {
+            'id': 'a', 'payload': json.dumps(keys.encrypt({'x': 1}))}
+        bso = self.client.get_record('tabs', 'a', as_bso=True)
+        self.assertEqual(bso.data, {'x': 1})
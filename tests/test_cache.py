@@ -0,0 +1,99 @@
+from syncclient.cache import RecordCache
+from .support import unittest
+
+
+class RecordCacheTest(unittest.TestCase):
+    def setUp(self):
+        super(RecordCacheTest, self).setUp()
+        self.now = 1000.0
+        self.cache = RecordCache(max_entries=3, max_bytes=100, max_age=5,
+                                 clock=lambda: self.now)
+        self.cache.update_timestamps({'tabs': 10.0, 'meta': 5.0})
+
+    def test_records_are_served_until_their_collection_changes(self):
+        self.cache.set('tabs', 'a', {'id': 'a'}, size=10, server_time='11.0')
+        self.assertEqual(self.cache.get('tabs', 'a'), {'id': 'a'})
+        self.cache.update_timestamps({'tabs': 12.0})
+        self.assertIsNone(self.cache.get('tabs', 'a'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_records_of_deleted_collections_are_dropped(self):
+        self.cache.set('tabs', 'a', {'id': 'a'}, size=10, server_time=11.0)
+        self.cache.update_timestamps({})
+        self.assertIsNone(self.cache.get('tabs', 'a'))
+
+    def test_record_modified_is_used_without_server_time(self):
+        self.cache.set('meta', 'global', {'id': 'global', 'modified': 5.0},
+                       size=10)
+        self.assertIsNotNone(self.cache.get('meta', 'global'))
+        self.cache.set('tabs', 'a', {'id': 'a', 'modified': 9.0}, size=10)
+        self.assertIsNone(self.cache.get('tabs', 'a'))
+
+    def test_timestamps_are_fetched_again_when_too_old(self):
+        self.cache.set('tabs', 'a', {'id': 'a'}, size=10, server_time=11.0)
+        calls = []
+
+        def timestamps():
+            calls.append(1)
+            return {'tabs': 10.0}
+
+        self.cache.get('tabs', 'a', timestamps=timestamps)
+        self.assertEqual(calls, [])
+        self.now += 6
+        self.assertIsNotNone(self.cache.get('tabs', 'a',
+                                            timestamps=timestamps))
+        self.assertEqual(calls, [1])
+        # Nothing is fetched for records that are not cached.
+        self.now += 6
+        self.cache.get('tabs', 'b', timestamps=timestamps)
+        self.assertEqual(calls, [1])
+
+    def test_records_are_copied(self):
+        record = {'id': 'a'}
+        self.cache.set('tabs', 'a', record, size=10, server_time=11.0)
+        record['payload'] = 'changed'
+        self.cache.get('tabs', 'a')['payload'] = 'changed'
+        self.assertEqual(self.cache.get('tabs', 'a'), {'id': 'a'})
+
+    def test_ids_are_compared_as_strings(self):
+        self.cache.set('tabs', 5, {'id': '5'}, size=10, server_time=11.0)
+        self.assertEqual(self.cache.get('tabs', '5'), {'id': '5'})
+        self.cache.invalidate('tabs', ['5'])
+        self.assertIsNone(self.cache.get('tabs', 5))
+
+    def test_least_recently_used_records_are_evicted(self):
+        for record_id in 'abc':
+            self.cache.set('tabs', record_id, {}, size=10, server_time=11.0)
+        self.cache.get('tabs', 'a')
+        self.cache.set('tabs', 'd', {}, size=10, server_time=11.0)
+        self.assertIsNone(self.cache.get('tabs', 'b'))
+        self.assertIsNotNone(self.cache.get('tabs', 'a'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_size_is_bounded_in_bytes(self):
+        self.cache.set('tabs', 'a', {}, size=60, server_time=11.0)
+        self.cache.set('tabs', 'b', {}, size=60, server_time=11.0)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.size, 60)
+        self.cache.set('tabs', 'c', {}, size=200, server_time=11.0)
+        self.assertIsNone(self.cache.get('tabs', 'c'))
+        self.assertEqual(self.cache.size, 60)
+
+    def test_invalidation(self):
+        self.cache.set('tabs', 'a', {}, size=10, server_time=11.0)
+        self.cache.set('tabs', 'b', {}, size=10, server_time=11.0)
+        self.cache.set('meta', 'global', {}, size=10, server_time=11.0)
+        self.cache.invalidate('tabs', ['a'])
+        self.assertEqual(len(self.cache), 2)
+        self.cache.invalidate('tabs')
+        self.assertEqual(len(self.cache), 1)
+        self.cache.clear()
+        self.assertEqual(self.cache.stats()['bytes'], 0)
+
+    def test_stats(self):
+        self.cache.set('tabs', 'a', {}, size=10, server_time=11.0)
+        self.cache.get('tabs', 'a')
+        self.cache.get('tabs', 'b')
+        self.assertEqual(self.cache.stats(), {
+            'hits': 1, 'misses': 1, 'evictions': 0, 'entries': 1,
+            'bytes': 10})
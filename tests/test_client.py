@@ -1,11 +1,25 @@
 # -*- coding: utf-8 -*-
+import datetime
+import json
 import mock
+import re
+import time
+import zlib
+from binascii import hexlify
 from hashlib import sha256
+from fxa.errors import ClientError as FxAClientError
+import requests
 from requests.exceptions import HTTPError
 
+from syncclient.bso import BSO
+from syncclient.cache import RecordCache
+from syncclient.credentials import MemoryCredentialCache
 from syncclient.client import (
     TokenserverClient, SyncClient, SyncClientError, TOKENSERVER_URL,
-    get_browserid_assertion, encode_header
+    DEFAULT_CONFIGURATION,
+    get_browserid_assertion, encode_header, create_session, compress_body,
+    fxa_assertion_provider,
+    _iter_json_array
 )
 from .support import unittest, patch
 
@@ -13,36 +27,36 @@ from .support import unittest, patch
 class TokenserverClientTest(unittest.TestCase):
     def test_token_server_request_token_server_url(self):
         client = TokenserverClient("given_bid", "given_client_state")
-        with mock.patch("syncclient.client.requests") as requests:
+        with mock.patch.object(client, "session") as session:
             client.get_hawk_credentials()
-            requests.get.assert_called_with(
+            session.get.assert_called_with(
                 "https://token.services.mozilla.com/1.0/sync/1.5",
                 headers={
                     'Authorization': "BrowserID given_bid",
                     'X-Client-State': "given_client_state"
                 }, params={}, verify=None)
-            requests.get.return_value.raise_for_status.assert_called_with()
-            requests.get.return_value.json.assert_called_with()
+            session.get.return_value.raise_for_status.assert_called_with()
+            session.get.return_value.json.assert_called_with()
 
     def test_token_server_request_handle_duration_parameter(self):
         client = TokenserverClient("given_bid", "given_client_state")
-        with mock.patch("syncclient.client.requests") as requests:
+        with mock.patch.object(client, "session") as session:
             client.get_hawk_credentials(duration=300)
-            requests.get.assert_called_with(
+            session.get.assert_called_with(
                 "https://token.services.mozilla.com/1.0/sync/1.5",
                 headers={
                     'Authorization': "BrowserID given_bid",
                     'X-Client-State': "given_client_state"
                 }, params={"duration": 300}, verify=None)
-            requests.get.return_value.raise_for_status.assert_called_with()
-            requests.get.return_value.json.assert_called_with()
+            session.get.return_value.raise_for_status.assert_called_with()
+            session.get.return_value.json.assert_called_with()
 
     def test_token_server_client_can_be_pass_a_verify_parameter(self):
         client = TokenserverClient("given_bid", "given_client_state",
                                    verify='root-ca.crt')
-        with mock.patch("syncclient.client.requests") as requests:
+        with mock.patch.object(client, "session") as session:
             client.get_hawk_credentials(duration=300)
-            requests.get.assert_called_with(
+            session.get.assert_called_with(
                 "https://token.services.mozilla.com/1.0/sync/1.5",
                 headers={
                     'Authorization': "BrowserID given_bid",
@@ -50,11 +64,276 @@ class TokenserverClientTest(unittest.TestCase):
                 }, params={"duration": 300}, verify='root-ca.crt')
 
 
+class ConnectionPoolingTest(unittest.TestCase):
+    credentials = {
+        "api_endpoint": "http://example.org/",
+        "uid": "123456",
+        "hashalg": "sha256",
+        "id": "mon-id",
+        "key": "I am not a secure key"
+    }
+
+    def test_create_session_mounts_a_sized_pool(self):
+        session = create_session(pool_maxsize=42, pool_block=True)
+        adapter = session.get_adapter('https://example.org/')
+        self.assertEqual(adapter._pool_maxsize, 42)
+        self.assertTrue(adapter._pool_block)
+        self.assertIs(session.get_adapter('http://example.org/'), adapter)
+
+    def test_syncclient_owns_a_session_by_default(self):
+        client = SyncClient(pool_maxsize=3, **self.credentials)
+        adapter = client.session.get_adapter('https://example.org/')
+        self.assertEqual(adapter._pool_maxsize, 3)
+
+    def test_session_can_be_shared_between_clients(self):
+        session = create_session()
+        first = SyncClient(session=session, **self.credentials)
+        second = SyncClient(session=session, **self.credentials)
+        self.assertIs(first.session, second.session)
+
+    def test_tokenserver_client_uses_the_syncclient_session(self):
+        session = mock.MagicMock()
+        session.get.return_value.json.return_value = self.credentials
+        client = SyncClient("bid_assertion", "client_state", session=session)
+        self.assertTrue(session.get.called)
+        self.assertIs(client.session, session)
+
+
+class CompressionTest(unittest.TestCase):
+    def setUp(self):
+        super(CompressionTest, self).setUp()
+        self.client = SyncClient(
+            hashalg='sha256',
+            id=mock.sentinel.id,
+            key='key',
+            uid=mock.sentinel.uid,
+            api_endpoint="http://example.org/",
+            upload_encoding='gzip'
+        )
+        self.client._request = mock.MagicMock()
+        self.record = {'id': 'abc', 'payload': 'x' * 2048}
+
+    def test_compress_body(self):
+        body = u'{"payload": "\u00e9t\u00e9"}'
+        self.assertEqual(
+            zlib.decompress(compress_body(body, 'gzip'), 16 + zlib.MAX_WBITS),
+            body.encode('utf-8'))
+        self.assertEqual(zlib.decompress(compress_body(body, 'deflate')),
+                         body.encode('utf-8'))
+        self.assertRaises(ValueError, compress_body, body, 'br')
+
+    def test_sessions_accept_compressed_responses(self):
+        self.assertEqual(create_session().headers['Accept-Encoding'],
+                         'gzip, deflate')
+
+    def test_large_uploads_are_compressed(self):
+        self.client.put_record('tabs', self.record)
+        kwargs = self.client._request.call_args[1]
+        self.assertEqual(kwargs['headers']['Content-Encoding'], 'gzip')
+        self.assertEqual(
+            json.loads(zlib.decompress(kwargs['data'], 16 + zlib.MAX_WBITS)
+                       .decode('utf-8')),
+            {'payload': 'x' * 2048})
+
+    def test_small_uploads_are_not_compressed(self):
+        self.client.put_record('tabs', {'id': 'abc', 'payload': 'x'})
+        kwargs = self.client._request.call_args[1]
+        self.assertNotIn('Content-Encoding', kwargs['headers'])
+        self.assertEqual(kwargs['data'], '{"payload": "x"}')
+
+    def test_uploads_are_not_compressed_by_default(self):
+        self.client.upload_encoding = None
+        self.client.put_record('tabs', self.record)
+        kwargs = self.client._request.call_args[1]
+        self.assertNotIn('Content-Encoding', kwargs['headers'])
+
+    def test_post_records_chunks_are_compressed(self):
+        self.client._configuration = {
+            'max_post_records': 100, 'max_post_bytes': 1024 * 1024,
+            'max_total_records': 1000, 'max_total_bytes': 10 * 1024 * 1024,
+            'max_request_bytes': 1024 * 1024}
+        self.client._request.return_value = {'success': ['abc']}
+        self.client.post_records('tabs', [self.record], batch=False)
+        kwargs = self.client._request.call_args[1]
+        self.assertEqual(kwargs['headers']['Content-Encoding'], 'gzip')
+
+    def test_unsupported_encoding_falls_back_to_plain_uploads(self):
+        error = HTTPError(response=mock.Mock(status_code=415))
+        self.client._request.side_effect = [error, 12.5, 13.5]
+        self.assertEqual(self.client.put_record('tabs', self.record), 12.5)
+        self.assertIsNone(self.client.upload_encoding)
+        kwargs = self.client._request.call_args[1]
+        self.assertNotIn('Content-Encoding', kwargs['headers'])
+        self.client.put_record('tabs', self.record)
+        self.assertEqual(self.client._request.call_count, 3)
+
+    def test_other_errors_are_raised(self):
+        error = HTTPError(response=mock.Mock(status_code=400))
+        self.client._request.side_effect = error
+        self.assertRaises(HTTPError, self.client.put_record, 'tabs',
+                          self.record)
+        self.assertEqual(self.client.upload_encoding, 'gzip')
+
+    def test_unknown_encodings_are_refused(self):
+        self.assertRaises(SyncClientError, SyncClient,
+                          upload_encoding='br', hashalg='sha256', id='id',
+                          key='key', uid='uid',
+                          api_endpoint='http://example.org/')
+
+
+# How long PyFxA assertions are valid, in seconds.
+ASSERTION_LIFETIME = 60
+
+
+class CredentialRefreshTest(unittest.TestCase):
+    def setUp(self):
+        super(CredentialRefreshTest, self).setUp()
+        self.session = mock.MagicMock()
+        self.tokens = []
+        self.session.get.side_effect = self._get_token
+        self.session.request.return_value.status_code = 200
+        self.cache = MemoryCredentialCache()
+        # The clock of the Token Server and of the assertions.
+        self.now = 1000
+
+    def _assertion(self):
+        return 'assertion-%d' % self.now
+
+    def _get_token(self, url, headers, **kwargs):
+        response = mock.MagicMock()
+        issued = int(headers['Authorization'].rsplit('-', 1)[1])
+        if self.now - issued > ASSERTION_LIFETIME:
+            response.status_code = 401
+            response.raise_for_status.side_effect = HTTPError(
+                response=response)
+            return response
+        self.tokens.append('id-%s' % len(self.tokens))
+        response.json.return_value = {
+            "api_endpoint": "http://example.org/",
+            "uid": "123456",
+            "hashalg": "sha256",
+            "id": self.tokens[-1],
+            "key": "I am not a secure key",
+            "duration": 300
+        }
+        return response
+
+    def _get_client(self, bid_assertion=None, **kwargs):
+        client = SyncClient(bid_assertion or self._assertion, "client_state",
+                            session=self.session,
+                            credential_cache=self.cache, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_each_exchange_gets_a_new_assertion(self):
+        client = self._get_client(background_refresh=False)
+        self.now += 3600
+        client.refresh_credentials()
+        self.assertEqual(self.tokens, ['id-0', 'id-1'])
+
+    def test_a_single_assertion_expires(self):
+        client = self._get_client(self._assertion(),
+                                  background_refresh=False)
+        self.now += 3600
+        self.assertRaises(HTTPError, client.refresh_credentials)
+
+    def test_credentials_expiry_is_computed_from_the_duration(self):
+        with mock.patch('syncclient.client.time.time', return_value=1000):
+            client = self._get_client(background_refresh=False)
+        self.assertEqual(client.credentials_expire, 1300)
+
+    def test_cached_credentials_are_reused(self):
+        self._get_client()
+        client = self._get_client()
+        self.assertEqual(self.tokens, ['id-0'])
+        self.assertEqual(client.auth.credentials['id'], 'id-0')
+
+    def test_cached_credentials_about_to_expire_are_not_used(self):
+        self._get_client(background_refresh=False)
+        self._get_client(refresh_margin=400, background_refresh=False)
+        self.assertEqual(self.tokens, ['id-0', 'id-1'])
+
+    def test_refresh_is_scheduled_before_expiry(self):
+        with mock.patch('syncclient.client.threading.Timer') as timer:
+            with mock.patch('syncclient.client.time.time', return_value=0):
+                client = self._get_client(refresh_margin=60)
+        timer.assert_called_with(240, client._background_refresh)
+        timer.return_value.start.assert_called_with()
+
+    def test_refresh_is_not_scheduled_in_a_loop_for_short_tokens(self):
+        with mock.patch('syncclient.client.threading.Timer') as timer:
+            with mock.patch('syncclient.client.time.time', return_value=0):
+                client = self._get_client(refresh_margin=400)
+        timer.assert_called_with(150, client._background_refresh)
+
+    def test_refresh_replaces_the_scheduled_timer(self):
+        with mock.patch('syncclient.client.threading.Timer') as timer:
+            client = self._get_client()
+            client.refresh_credentials()
+        timer.return_value.cancel.assert_called_with()
+        self.assertEqual(timer.call_count, 2)
+
+    def test_refresh_is_skipped_when_another_thread_did_it(self):
+        client = self._get_client(background_refresh=False)
+        auth = client.auth
+        client.refresh_credentials(stale_auth=mock.sentinel.old_auth)
+        self.assertIs(client.auth, auth)
+        self.assertEqual(self.tokens, ['id-0'])
+
+    def test_background_refresh_exchanges_a_new_token(self):
+        client = self._get_client(background_refresh=False)
+        self.now += 3600
+        client._background_refresh()
+        self.assertEqual(client.auth.credentials['id'], 'id-1')
+        self.assertEqual(self.cache.get(client._cache_key)['id'], 'id-1')
+
+    def test_background_refresh_failures_are_logged(self):
+        client = self._get_client(background_refresh=False)
+        self.session.get.side_effect = HTTPError
+        with mock.patch('syncclient.client.logger') as logger:
+            client._background_refresh()
+        self.assertTrue(logger.warning.called)
+
+    def test_refresh_uses_a_token_refreshed_by_someone_else(self):
+        client = self._get_client(background_refresh=False)
+        other = dict(self.cache.get(client._cache_key), id='other',
+                     expires=client.credentials_expire + 100)
+        self.cache.set(client._cache_key, other)
+        client.refresh_credentials()
+        self.assertEqual(client.auth.credentials['id'], 'other')
+        self.assertEqual(self.tokens, ['id-0'])
+
+    def test_request_is_retried_once_on_401(self):
+        client = self._get_client(background_refresh=False)
+        self.now += 3600
+        unauthorized = mock.MagicMock(status_code=401)
+        ok = mock.MagicMock(status_code=200)
+        self.session.request.side_effect = [unauthorized, ok]
+        client.info_collections()
+        self.assertEqual(self.tokens, ['id-0', 'id-1'])
+        self.assertEqual(self.session.request.call_count, 2)
+        self.assertEqual(client.raw_resp, ok)
+
+    def test_second_401_is_raised(self):
+        client = self._get_client(background_refresh=False)
+        unauthorized = mock.MagicMock(status_code=401)
+        unauthorized.raise_for_status.side_effect = HTTPError
+        self.session.request.return_value = unauthorized
+        self.assertRaises(HTTPError, client.info_collections)
+        self.assertEqual(self.session.request.call_count, 2)
+
+    def test_credentials_cannot_be_refreshed_without_assertion(self):
+        client = SyncClient(session=self.session, **{
+            "api_endpoint": "http://example.org/", "uid": "123456",
+            "hashalg": "sha256", "id": "mon-id", "key": "key"})
+        self.assertRaises(SyncClientError, client.refresh_credentials)
+
+
 class SyncClientSetupTest(unittest.TestCase):
     def setUp(self):
         super(SyncClientSetupTest, self).setUp()
         patched = patch(self, 'syncclient.client.requests')
-        self.requests = patched[0].request
+        self.requests = patched[0].Session.return_value.request
 
     def test_wrong_syncclient_argument_raise_a_syncclienterror(self):
         try:
@@ -101,14 +380,16 @@ class SyncClientSetupTest(unittest.TestCase):
                 "id": "mon-id",
                 "key": "I am not a secure key"
             }
-            with mock.patch("syncclient.client.HawkAuth") as hawkauth:
+            with mock.patch("syncclient.client.HawkSigner") as hawkauth:
                 SyncClient("bid_assertion", "client_state")
                 tokenserver.assert_called_with(
-                    "bid_assertion", "client_state", TOKENSERVER_URL)
+                    "bid_assertion", "client_state", TOKENSERVER_URL,
+                    session=mock.ANY)
                 tokenserver().get_hawk_credentials.assert_called_with()
                 hawkauth.assert_called_with(algorithm="sha256",
                                             id="mon-id",
-                                            key="I am not a secure key")
+                                            key="I am not a secure key",
+                                            skew=0)
 
     def test_syncclient_can_be_setup_with_sync_credentials(self):
         credentials = {
@@ -119,21 +400,23 @@ class SyncClientSetupTest(unittest.TestCase):
             "key": "I am not a secure key"
         }
         with mock.patch("syncclient.client.TokenserverClient") as tokenserver:
-            with mock.patch("syncclient.client.HawkAuth") as hawkauth:
+            with mock.patch("syncclient.client.HawkSigner") as hawkauth:
                 SyncClient(**credentials)
                 tokenserver.assert_not_called()
                 tokenserver().get_hawk_credentials.assert_not_called()
                 hawkauth.assert_called_with(algorithm="sha256",
                                             id="mon-id",
-                                            key="I am not a secure key")
+                                            key="I am not a secure key",
+                                            skew=0)
 
 
 class ClientRequestIssuanceTest(unittest.TestCase):
     def setUp(self):
         super(ClientRequestIssuanceTest, self).setUp()
         # Mock requests to avoid issuance of requests when we start the client.
-        patched = patch(self, 'syncclient.client.requests')
-        self.requests = patched[0].request
+        patched = patch(self, 'syncclient.client.requests',
+                        'syncclient.client.HawkSigner')
+        self.requests = patched[0].Session.return_value.request
         self.requests.return_value.status_code = 200
 
     def _get_client(self, api_endpoint='http://example.org/', **kwargs):
@@ -181,8 +464,8 @@ class ClientAuthenticationTest(unittest.TestCase):
     def setUp(self):
         super(ClientAuthenticationTest, self).setUp()
         patched = patch(self, 'syncclient.client.requests',
-                        'syncclient.client.HawkAuth')
-        self.requests = patched[0]
+                        'syncclient.client.HawkSigner')
+        self.requests = patched[0].Session.return_value
         self.hawk_auth = patched[1]
 
     def test_authenticate_requests_the_tokenserver_with_proper_headers(self):
@@ -215,7 +498,8 @@ class ClientAuthenticationTest(unittest.TestCase):
 
         self.hawk_auth.assert_called_with(algorithm=mock.sentinel.hashalg,
                                           id=mock.sentinel.id,
-                                          key=mock.sentinel.key)
+                                          key=mock.sentinel.key,
+                                          skew=0)
 
         assert client.user_id == mock.sentinel.uid
         assert client.api_endpoint == mock.sentinel.api_endpoint
@@ -223,7 +507,7 @@ class ClientAuthenticationTest(unittest.TestCase):
 
 class BrowserIDAssertionTest(unittest.TestCase):
 
-    @mock.patch('syncclient.client.FxAClient')
+    @mock.patch('fxa.core.Client')
     @mock.patch('syncclient.client.hexlify')
     def test_trade_works_as_expected(self, hexlify, fxa_client):
         # mock the calls to PyFxA.
@@ -237,14 +521,92 @@ class BrowserIDAssertionTest(unittest.TestCase):
         hexlify.return_value = mock.sentinel.hexlified
         hexlify.assert_called_with(digest)
 
+    def _session_cache(self, cached=None):
+        cache = mock.MagicMock()
+        cache.get.return_value = cached
+        return cache
+
+    @mock.patch('fxa.core.Client')
+    def test_login_is_stored_in_the_session_cache(self, fxa_client):
+        session = fxa_client().login.return_value
+        session.fetch_keys.return_value = None, b"fake key b"
+        session.uid = 'uid'
+        session.token = 'token'
+        cache = self._session_cache()
+        get_browserid_assertion('login', 'password', session_cache=cache)
+        cache.set.assert_called_with('login', {
+            'uid': 'uid', 'token': 'token',
+            'keyB': hexlify(b"fake key b").decode('ascii')})
+
+    @mock.patch('fxa.core.Session')
+    @mock.patch('fxa.core.Client')
+    def test_cached_session_is_reused(self, fxa_client, fxa_session):
+        fxa_session().get_identity_assertion.return_value = 'assertion'
+        cache = self._session_cache({
+            'uid': 'uid', 'token': 'token',
+            'keyB': hexlify(b"fake key b").decode('ascii')})
+        assertion, client_state = get_browserid_assertion(
+            'login', 'password', session_cache=cache)
+        self.assertEqual(assertion, 'assertion')
+        self.assertEqual(client_state,
+                         hexlify(sha256(b"fake key b").digest()[0:16]))
+        fxa_session.assert_called_with(fxa_client(), 'login', None, 'uid',
+                                       'token', verified=True)
+        fxa_client().login.assert_not_called()
+
+    @mock.patch('fxa.core.Session')
+    @mock.patch('fxa.core.Client')
+    def test_invalid_cached_session_triggers_a_login(self, fxa_client,
+                                                     fxa_session):
+        fxa_session().get_identity_assertion.side_effect = FxAClientError(
+            {'code': 401, 'errno': 110})
+        session = fxa_client().login.return_value
+        session.fetch_keys.return_value = None, b"fake key b"
+        cache = self._session_cache({'uid': 'uid', 'token': 'token',
+                                     'keyB': 'beef'})
+        get_browserid_assertion('login', 'password', session_cache=cache)
+        cache.delete.assert_called_with('login')
+        fxa_client().login.assert_called_with('login', 'password', keys=True)
+        self.assertTrue(cache.set.called)
+
+    @mock.patch('fxa.core.Client')
+    def test_provider_mints_an_assertion_per_call(self, fxa_client):
+        session = fxa_client().login.return_value
+        session.fetch_keys.return_value = None, b"fake key b"
+        session.get_identity_assertion.side_effect = ['a1', 'a2', 'a3']
+        provider, keyB = fxa_assertion_provider('login', 'password')
+        self.assertEqual(keyB, b"fake key b")
+        self.assertEqual([provider(), provider(), provider()],
+                         ['a1', 'a2', 'a3'])
+        self.assertEqual(fxa_client().login.call_count, 1)
+        session.get_identity_assertion.assert_called_with(TOKENSERVER_URL)
+
+    @mock.patch('fxa.core.Client')
+    def test_provider_logs_in_again_when_the_session_expired(self,
+                                                             fxa_client):
+        expired, session = mock.MagicMock(), mock.MagicMock()
+        fxa_client().login.side_effect = [expired, session]
+        expired.fetch_keys.return_value = None, b"fake key b"
+        expired.get_identity_assertion.side_effect = [
+            'a1', FxAClientError({'code': 401, 'errno': 110})]
+        session.fetch_keys.return_value = None, b"fake key b"
+        session.get_identity_assertion.side_effect = ['a2', 'a3']
+        cache = self._session_cache()
+        provider, _ = fxa_assertion_provider('login', 'password',
+                                             session_cache=cache)
+        self.assertEqual([provider(), provider(), provider()],
+                         ['a1', 'a2', 'a3'])
+        cache.delete.assert_called_with('login')
+        self.assertEqual(fxa_client().login.call_count, 2)
+
 
 class ClientHTTPCallsTest(unittest.TestCase):
     def setUp(self):
         super(ClientHTTPCallsTest, self).setUp()
         self.client = SyncClient(
-            hashalg=mock.sentinel.hashalg,
+            hashalg='sha256',
             id=mock.sentinel.id,
-            key=mock.sentinel.key,
+            key='key',
             uid=mock.sentinel.uid,
             api_endpoint=mock.sentinel.api_endpoint
         )
@@ -391,6 +753,71 @@ class ClientHTTPCallsTest(unittest.TestCase):
             'delete', '/storage/mycollection/1234',
             headers=mock.sentinel.headers)
 
+    def test_fetch_records_requests_chunks_of_ids(self):
+        ids = ['id%03d' % idx for idx in range(150)]
+        self.client._request.side_effect = [[{'id': 'id000'}],
+                                            [{'id': 'id149'}]]
+        records = list(self.client.fetch_records('myCollection', ids,
+                                                 max_workers=1))
+        self.assertEqual(records, [{'id': 'id000'}, {'id': 'id149'}])
+        self.client._request.assert_has_calls([
+            mock.call('get', '/storage/mycollection',
+                      params={'full': True, 'ids': ','.join(ids[:100])}),
+            mock.call('get', '/storage/mycollection',
+                      params={'full': True, 'ids': ','.join(ids[100:])})])
+
+    def test_delete_collection(self):
+        self.client.delete_collection('myCollection')
+        self.client._request.assert_called_with(
+            'delete', '/storage/mycollection')
+
+    def test_fetch_records_refuses_a_single_string(self):
+        self.assertRaises(SyncClientError, list,
+                          self.client.fetch_records('history', 'abc'))
+        self.assertFalse(self.client._request.called)
+
+    def test_delete_records_sends_chunks_of_ids(self):
+        self.client._request.side_effect = [{'modified': 12.5},
+                                            {'modified': 13.5}]
+        ids = ['id%03d' % idx for idx in range(150)]
+        result = self.client.delete_records('myCollection', ids,
+                                            max_workers=1)
+        self.client._request.assert_has_calls([
+            mock.call('delete', '/storage/mycollection',
+                      params={'ids': ','.join(ids[:100])}),
+            mock.call('delete', '/storage/mycollection',
+                      params={'ids': ','.join(ids[100:])})])
+        self.assertEqual(result, {'modified': 13.5, 'deleted': ids,
+                                  'failed': {}})
+
+    def test_delete_records_reports_failed_chunks(self):
+        def delete(method, url, params):
+            if 'id150' in params['ids']:
+                raise HTTPError('503 Server Error')
+            return {'modified': 12.5}
+
+        self.client._request.side_effect = delete
+        ids = ['id%03d' % idx for idx in range(250)]
+        result = self.client.delete_records('myCollection', ids)
+        self.assertEqual(result['deleted'], ids[:100] + ids[200:])
+        self.assertEqual(result['failed'],
+                         dict((record_id, '503 Server Error')
+                              for record_id in ids[100:200]))
+        self.assertEqual(result['modified'], 12.5)
+
+    def test_delete_records_is_sequential_with_conditional_requests(self):
+        self.client.conditional_requests = True
+        self.client._request.return_value = {'modified': 12.5}
+        with mock.patch('syncclient.client.ThreadPoolExecutor') as executor:
+            executor.return_value.map.return_value = []
+            self.client.delete_records('myCollection', ['a'], max_workers=8)
+        executor.assert_called_with(max_workers=1)
+
+    def test_delete_records_refuses_a_single_string(self):
+        self.assertRaises(SyncClientError, self.client.delete_records,
+                          'history', 'abc')
+        self.assertFalse(self.client._request.called)
+
     def test_put_record(self):
         record = {'id': 1234, 'foo': 'bar'}
         self.client.put_record('myCollection', record)
@@ -422,25 +849,135 @@ class ClientHTTPCallsTest(unittest.TestCase):
         self.client.put_record('myCollection', record)
         assert 'id' in record.keys()
 
+    def test_info_configuration(self):
+        self.client._request.return_value = {'max_post_records': 10}
+        config = self.client.info_configuration()
+        self.client._request.assert_called_with('get', '/info/configuration')
+        self.assertEqual(config['max_post_records'], 10)
+        self.assertEqual(config['max_post_bytes'], 1024 * 1024)
+
+    def test_info_configuration_is_fetched_once(self):
+        self.client._request.return_value = {}
+        self.client.info_configuration()
+        self.client.info_configuration()
+        self.assertEqual(self.client._request.call_count, 1)
+
+    def test_info_configuration_defaults_on_404(self):
+        response = mock.MagicMock(status_code=404)
+        self.client._request.side_effect = HTTPError(response=response)
+        config = self.client.info_configuration()
+        self.assertEqual(config['max_post_records'], 100)
+
+    def test_info_configuration_raises_other_errors(self):
+        response = mock.MagicMock(status_code=500)
+        self.client._request.side_effect = HTTPError(response=response)
+        self.assertRaises(HTTPError, self.client.info_configuration)
+
     def test_post_records(self):
-        # For now, this does nothing.
-        records = [{'id': idx, 'foo': 'foo'} for idx in range(1, 10)]
-        self.client.post_records("myCollection", records)
+        self.client._configuration = {
+            'max_post_records': 100, 'max_post_bytes': 1024,
+            'max_total_records': 1000, 'max_total_bytes': 10240,
+            'max_request_bytes': 2048}
+        self.client._request.return_value = {
+            'modified': 42, 'success': ['1', '2'], 'failed': {}}
+        records = [{'id': '1', 'payload': 'foo'}, '{"id": "2"}']
+        result = self.client.post_records("myCollection", records)
+        self.client._request.assert_called_with(
+            'post', '/storage/mycollection',
+            data='[{"id": "1", "payload": "foo"},{"id": "2"}]',
+            params={'batch': 'true', 'commit': 'true'},
+            headers={'Content-Type': 'application/json; charset=utf-8'})
+        self.assertEqual(result, {
+            'modified': 42, 'success': ['1', '2'], 'failed': {}})
+
+
+class PostRecordsBatchTest(unittest.TestCase):
+    def setUp(self):
+        super(PostRecordsBatchTest, self).setUp()
+        self.client = SyncClient(
+            hashalg='sha256',
+            id=mock.sentinel.id,
+            key='key',
+            uid=mock.sentinel.uid,
+            api_endpoint=mock.sentinel.api_endpoint
+        )
+        self.client._configuration = {
+            'max_post_records': 2, 'max_post_bytes': 1024,
+            'max_total_records': 4, 'max_total_bytes': 10240,
+            'max_request_bytes': 2048}
+        self.client._request = mock.MagicMock(side_effect=self._request)
+        self.calls = []
+
+    def _request(self, method, url, data, params, headers):
+        self.calls.append(params)
+        ids = [r['id'] for r in json.loads(data)]
+        response = {'success': ids[1:], 'failed': {ids[0]: ['invalid']}}
+        if 'commit' in params:
+            response['modified'] = len(self.calls)
+        elif self.supports_batch:
+            response['batch'] = 'batch-%s' % len(self.calls)
+        return response
+
+    supports_batch = True
+
+    def _records(self, count):
+        return [{'id': str(idx), 'payload': 'x'} for idx in range(count)]
+
+    def test_records_are_split_and_committed_per_batch(self):
+        result = self.client.post_records('history', self._records(7))
+        self.assertEqual(self.calls, [
+            {'batch': 'true'},
+            {'batch': 'batch-1', 'commit': 'true'},
+            {'batch': 'true'},
+            {'batch': 'batch-3', 'commit': 'true'},
+        ])
+        self.assertEqual(result['modified'], 4)
+        self.assertEqual(result['success'], ['1', '3', '5'])
+        self.assertEqual(sorted(result['failed']), ['0', '2', '4', '6'])
+
+    def test_chunks_respect_the_payload_bytes_limit(self):
+        self.client._configuration['max_post_bytes'] = 1
+        self.client.post_records('history', self._records(3), batch=False)
+        self.assertEqual(self.calls, [{}, {}, {}])
+
+    def test_chunks_respect_the_request_bytes_limit(self):
+        self.client._configuration['max_request_bytes'] = 40
+        self.client.post_records('history', self._records(2), batch=False)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_headers_are_sent_with_each_chunk(self):
+        self.client.post_records('history', self._records(3), batch=False,
+                                 headers={'X-If-Unmodified-Since': '12.50'})
+        for call in self.client._request.call_args_list:
+            self.assertEqual(call[1]['headers'], {
+                'X-If-Unmodified-Since': '12.50',
+                'Content-Type': 'application/json; charset=utf-8'})
+
+    def test_falls_back_to_plain_posts_without_batch_support(self):
+        self.supports_batch = False
+        self.client.post_records('history', self._records(4))
+        self.assertEqual(self.calls, [{'batch': 'true'}, {}])
+
+    def test_no_request_is_made_without_records(self):
+        result = self.client.post_records('history', [])
+        self.assertEqual(self.calls, [])
+        self.assertEqual(result, {'modified': None, 'success': [],
+                                  'failed': {}})
 
 
 class HandleSyncRequestsResponseTest(unittest.TestCase):
     def setUp(self):
         super(HandleSyncRequestsResponseTest, self).setUp()
         self.client = SyncClient(
-            hashalg=mock.sentinel.hashalg,
+            hashalg='sha256',
             id=mock.sentinel.id,
-            key=mock.sentinel.key,
+            key='key',
             uid=mock.sentinel.uid,
             api_endpoint="http://sync.services.mozilla.com/"
         )
 
     def test_get_record_can_handle_empty_response(self):
-        with mock.patch("syncclient.client.requests.request") as request:
+        with mock.patch.object(self.client.session, "request") as request:
             response = mock.MagicMock()
             response.status_code = 304
             response.response = "Not Modified"
@@ -450,6 +987,509 @@ class HandleSyncRequestsResponseTest(unittest.TestCase):
                               self.client.get_record, 'myCollection', 1234)
 
 
+class ClockSkewTest(unittest.TestCase):
+    def setUp(self):
+        super(ClockSkewTest, self).setUp()
+        self.server_time = time.time() + 3600
+        self.timestamps = []
+        self.valid_ids = ['hawk-id']
+        self.client = SyncClient(hashalg='sha256', id='hawk-id', key='key',
+                                 uid='123456',
+                                 api_endpoint='http://example.org/')
+        self.client.session = mock.MagicMock(request=self._request)
+
+    def _request(self, method, url, auth, **kwargs):
+        """A storage node accepting a minute of clock skew."""
+        request = auth(requests.Request(method, url).prepare())
+        header = request.headers['Authorization']
+        timestamp = int(re.search(r'ts="(\d+)"', header).group(1))
+        self.timestamps.append(timestamp)
+        response = mock.MagicMock(status_code=200, headers={
+            'X-Weave-Timestamp': '%.2f' % self.server_time})
+        response.json.return_value = {}
+        if (abs(timestamp - self.server_time) > 60 or
+                auth.id not in self.valid_ids):
+            response.status_code = 401
+            response.raise_for_status.side_effect = HTTPError(
+                response=response)
+        for hook in request.hooks['response']:
+            hook(response)
+        return response
+
+    def test_skewed_requests_are_signed_again_with_the_same_token(self):
+        self.assertEqual(self.client.info_collections(), {})
+        self.assertEqual(len(self.timestamps), 2)
+        self.assertLessEqual(abs(self.timestamps[1] - self.server_time), 1)
+        # The next requests use the learnt skew right away.
+        self.client.info_collections()
+        self.assertEqual(len(self.timestamps), 3)
+
+    def test_skewed_requests_are_signed_again_once(self):
+        self.valid_ids = []
+        self.assertRaises(HTTPError, self.client.info_collections)
+        self.assertEqual(len(self.timestamps), 2)
+
+    def test_the_token_is_refreshed_if_the_skew_was_not_the_problem(self):
+        self.client._ts_client = mock.Mock()
+
+        def refresh(stale_auth):
+            self.client._set_credentials({
+                'uid': '123456', 'api_endpoint': 'http://example.org/',
+                'hashalg': 'sha256', 'id': 'new-id', 'key': 'key'})
+            self.valid_ids.append('new-id')
+
+        self.valid_ids = []
+        with mock.patch.object(self.client, 'refresh_credentials',
+                               side_effect=refresh):
+            self.assertEqual(self.client.info_collections(), {})
+        self.assertEqual(len(self.timestamps), 3)
+
+
+class ConditionalRequestsTest(unittest.TestCase):
+    def setUp(self):
+        super(ConditionalRequestsTest, self).setUp()
+        self.client = SyncClient(
+            hashalg='sha256',
+            id=mock.sentinel.id,
+            key='key',
+            uid=mock.sentinel.uid,
+            api_endpoint="http://example.org/",
+            conditional_requests=True
+        )
+        self.request = mock.MagicMock()
+        self.client.session = mock.MagicMock(request=self.request)
+
+    def _respond(self, status_code=200, last_modified=None, body=None):
+        response = mock.MagicMock(status_code=status_code, headers={})
+        if last_modified is not None:
+            response.headers['X-Last-Modified'] = last_modified
+        response.json.return_value = body
+        self.request.return_value = response
+
+    def _sent_headers(self):
+        return self.request.call_args[1].get('headers')
+
+    def test_repeated_get_sends_x_if_modified_since(self):
+        self._respond(last_modified='12.50', body=['a'])
+        self.client.get_records('tabs', full=False)
+        self.assertIsNone(self._sent_headers())
+        self.client.get_records('tabs', full=False)
+        self.assertEqual(self._sent_headers(),
+                         {'X-If-Modified-Since': '12.50'})
+
+    def test_not_modified_is_answered_from_the_cache(self):
+        self._respond(last_modified='12.50', body={'tabs': 12.5})
+        self.client.info_collections()
+        self._respond(status_code=304)
+        self.assertEqual(self.client.info_collections(), {'tabs': 12.5})
+
+    def test_pages_answered_from_the_cache_keep_their_next_offset(self):
+        pages = {None: (['a', 'b'], 'o2'), 'o2': (['c'], None)}
+
+        def request(method, url, **kwargs):
+            offset = kwargs['params'].get('offset')
+            headers = kwargs.get('headers') or {}
+            if 'X-If-Modified-Since' in headers:
+                # Nothing changed: the server does not send the offset.
+                return mock.MagicMock(status_code=304, headers={})
+            records, next_offset = pages[offset]
+            response = mock.MagicMock(status_code=200, headers={
+                'X-Last-Modified': '12.50'})
+            if next_offset is not None:
+                response.headers['X-Weave-Next-Offset'] = next_offset
+            response.json.return_value = records
+            return response
+
+        self.request.side_effect = request
+        for _ in range(2):
+            records = self.client.iter_records('tabs', page_size=2,
+                                               full=False, prefetch=False)
+            self.assertEqual(list(records), ['a', 'b', 'c'])
+        self.assertEqual(self.request.call_count, 4)
+
+    def test_not_modified_without_cache_is_still_an_error(self):
+        self._respond(status_code=304)
+        self.assertRaises(HTTPError, self.client.info_collections,
+                          headers={'X-If-Modified-Since': '12.50'})
+
+    def test_validators_depend_on_the_query(self):
+        self._respond(last_modified='12.50', body=['a'])
+        self.client.get_records('tabs', full=False)
+        self.client.get_records('tabs', full=False, newer=10)
+        self.assertIsNone(self._sent_headers())
+
+    def test_writes_send_x_if_unmodified_since(self):
+        self._respond(last_modified='12.50', body=[])
+        self.client.get_records('tabs', full=False)
+        self._respond(last_modified='13.00', body=13.0)
+        self.client.put_record('tabs', {'id': 'a'})
+        self.assertEqual(self._sent_headers()['X-If-Unmodified-Since'],
+                         '12.50')
+        self.client.put_record('tabs', {'id': 'a'})
+        self.assertEqual(self._sent_headers()['X-If-Unmodified-Since'],
+                         '13.00')
+
+    def test_deletes_forget_the_timestamps(self):
+        self._respond(last_modified='12.50', body={})
+        self.client.get_record('tabs', 'a')
+        self.client.delete_all_records()
+        self.client.put_record('tabs', {'id': 'a'})
+        self.assertNotIn('X-If-Unmodified-Since', self._sent_headers())
+
+    def test_every_deleted_chunk_checks_the_collection_timestamp(self):
+        self._respond(last_modified='12.50', body=['a'])
+        self.client.get_records('tabs', full=False)
+        sent = []
+
+        def delete(method, url, **kwargs):
+            sent.append(kwargs['headers']['X-If-Unmodified-Since'])
+            response = mock.MagicMock(status_code=200, headers={
+                'X-Last-Modified': '%d.00' % (13 + len(sent))})
+            response.json.return_value = {'modified': 13 + len(sent)}
+            return response
+
+        self.request.side_effect = delete
+        result = self.client.delete_records('tabs', range(250))
+        self.assertEqual(len(result['deleted']), 250)
+        self.assertEqual(sent, ['12.50', '14.00', '15.00'])
+        self.request.side_effect = None
+        self._respond(last_modified='17.00', body=17.0)
+        self.client.put_record('tabs', {'id': 'a'})
+        self.assertEqual(self._sent_headers()['X-If-Unmodified-Since'],
+                         '16.00')
+
+    def test_responses_without_timestamp_are_not_remembered(self):
+        self._respond(body=['a'])
+        self.client.get_records('tabs', full=False)
+        self.client.get_records('tabs', full=False)
+        self.assertIsNone(self._sent_headers())
+
+    def test_nothing_is_sent_when_disabled(self):
+        self.client.conditional_requests = False
+        self._respond(last_modified='12.50', body=[])
+        self.client.get_records('tabs', full=False)
+        self.client.get_records('tabs', full=False)
+        self.assertIsNone(self._sent_headers())
+
+
+class RequestHooksTest(unittest.TestCase):
+    def setUp(self):
+        super(RequestHooksTest, self).setUp()
+        self.events = []
+        self.client = SyncClient(
+            hashalg='sha256',
+            id=mock.sentinel.id,
+            key='key',
+            uid=mock.sentinel.uid,
+            api_endpoint="http://example.org/",
+            hooks=[self.events.append]
+        )
+        self.client.auth = mock.Mock(side_effect=lambda request: request)
+        self.request = mock.MagicMock()
+        self.client.session = mock.MagicMock(request=self.request)
+
+    def _response(self, status_code=200, body=None, sent=None):
+        response = mock.MagicMock(status_code=status_code, headers={},
+                                  content=json.dumps(body).encode('utf-8'),
+                                  elapsed=datetime.timedelta(seconds=0.5))
+        response.request.body = sent
+        response.json.return_value = body
+        if status_code >= 400:
+            response.raise_for_status.side_effect = HTTPError(
+                response=response)
+        return response
+
+    def test_an_event_is_sent_for_each_request(self):
+        self.request.return_value = self._response(body={'id': 'abc'})
+        self.client.get_record('History', 'abc')
+        [event] = self.events
+        self.assertEqual(event.method, 'GET')
+        self.assertEqual(event.collection, 'history')
+        self.assertEqual(event.node, 'example.org')
+        self.assertEqual(event.status, 200)
+        self.assertEqual(event.bytes_received, len(b'{"id": "abc"}'))
+        self.assertEqual(event.wait_time, 0.5)
+        self.assertIsNone(event.error)
+
+    def test_compressed_bodies_are_counted_as_received(self):
+        response = self._response(body={'id': 'abc', 'payload': 'x' * 1000})
+        response.raw.tell.return_value = 42
+        self.request.return_value = response
+        self.client.get_record('history', 'abc')
+        self.assertEqual(self.events[0].bytes_received, 42)
+
+    def test_bodies_without_raw_stream_are_counted_decoded(self):
+        response = self._response(body={'id': 'abc'})
+        response.raw = None
+        self.request.return_value = response
+        self.client.get_record('history', 'abc')
+        self.assertEqual(self.events[0].bytes_received,
+                         len(b'{"id": "abc"}'))
+
+    def test_signing_is_timed(self):
+        def request(method, url, auth, **kwargs):
+            auth(mock.sentinel.request)
+            return self._response(body={})
+        self.request.side_effect = request
+        self.client.info_quota()
+        self.client.auth.assert_called_with(mock.sentinel.request)
+        self.assertGreater(self.events[0].sign_time, 0)
+
+    def test_uploads_are_measured(self):
+        self.request.return_value = self._response(body=12.5, sent='{}')
+        self.client.put_record('tabs', {'id': 'abc'})
+        self.assertEqual(self.events[0].bytes_sent, 2)
+
+    def test_retries_are_counted(self):
+        self.client.scheduler = mock.Mock(max_retries=1)
+        self.client.scheduler.should_retry.side_effect = [True, False]
+        self.client.scheduler.retry_delay.return_value = 0
+        self.request.side_effect = [self._response(503),
+                                    self._response(body={})]
+        self.client.info_quota()
+        self.assertEqual(self.events[0].retries, 1)
+        self.assertEqual(self.events[0].status, 200)
+
+    def test_errors_are_reported(self):
+        self.request.return_value = self._response(404)
+        self.assertRaises(HTTPError, self.client.get_record, 'tabs', 'abc')
+        self.assertEqual(self.events[0].status, 404)
+        self.assertEqual(self.events[0].error, 'HTTPError')
+
+    def test_decoding_errors_are_reported(self):
+        response = self._response(body=None)
+        response.json.side_effect = ValueError
+        self.request.return_value = response
+        self.assertRaises(ValueError, self.client.info_quota)
+        self.assertEqual(self.events[0].status, 200)
+        self.assertEqual(self.events[0].error, 'ValueError')
+
+    def test_streamed_requests_are_reported(self):
+        response = self._response(body=['a'])
+        response.headers['Content-Type'] = 'application/json'
+        response.iter_content.return_value = iter([b'["a"]'])
+        self.request.return_value = response
+        self.assertEqual(list(self.client.stream_records('tabs')), ['a'])
+        [event] = self.events
+        self.assertEqual((event.method, event.collection, event.status),
+                         ('GET', 'tabs', 200))
+        self.assertEqual(event.bytes_received, 0)
+        self.assertIsNone(event.error)
+
+    def test_streamed_request_errors_are_reported(self):
+        self.request.return_value = self._response(503)
+        self.client.scheduler = mock.Mock(should_retry=lambda *args: False)
+        self.assertRaises(HTTPError, list, self.client.stream_records('tabs'))
+        self.assertEqual(self.events[0].error, 'HTTPError')
+
+    def test_cache_hits_are_reported(self):
+        self.client.conditional_requests = True
+        response = self._response(body={'tabs': 1})
+        response.headers['X-Last-Modified'] = '1.00'
+        self.request.return_value = response
+        self.client.info_collections()
+        self.request.return_value = self._response(304)
+        self.request.return_value.raise_for_status.side_effect = None
+        self.client.info_collections()
+        self.assertEqual([e.cache_hit for e in self.events], [False, True])
+
+    def test_nothing_is_measured_without_hooks(self):
+        self.client.hooks = []
+        self.request.return_value = self._response(body={})
+        self.client.info_quota()
+        self.assertIs(self.request.call_args[1]['auth'], self.client.auth)
+        self.assertEqual(self.events, [])
+
+
+class IterRecordsTest(unittest.TestCase):
+    def setUp(self):
+        super(IterRecordsTest, self).setUp()
+        self.client = SyncClient(
+            hashalg='sha256',
+            id=mock.sentinel.id,
+            key='key',
+            uid=mock.sentinel.uid,
+            api_endpoint="http://example.org/"
+        )
+        self.pages = {
+            None: ([{'id': 'a'}, {'id': 'b'}], 'offset-1'),
+            'offset-1': ([{'id': 'c'}, {'id': 'd'}], 'offset-2'),
+            'offset-2': ([{'id': 'e'}], None),
+        }
+        patched = patch(self, 'syncclient.client.SyncClient._request')
+        self.request = patched[0]
+        self.request.side_effect = self._request
+
+    def _request(self, method, url, params=None, **kwargs):
+        records, next_offset = self.pages[params.get('offset')]
+        response = mock.MagicMock()
+        response.headers = {}
+        if next_offset is not None:
+            response.headers['X-Weave-Next-Offset'] = next_offset
+        self.client.raw_resp = response
+        return records
+
+    def test_get_records_page_returns_the_next_offset(self):
+        records, offset = self.client.get_records_page('history', limit=2)
+        self.assertEqual([r['id'] for r in records], ['a', 'b'])
+        self.assertEqual(offset, 'offset-1')
+        records, offset = self.client.get_records_page(
+            'history', offset='offset-2', limit=2)
+        self.assertEqual([r['id'] for r in records], ['e'])
+        self.assertIsNone(offset)
+
+    def test_iter_records_follows_next_offset_tokens(self):
+        records = list(self.client.iter_records('history', page_size=2))
+        self.assertEqual([r['id'] for r in records], ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(self.request.call_count, 3)
+
+    def test_iter_records_without_prefetch(self):
+        records = list(self.client.iter_records('history', page_size=2,
+                                                prefetch=False))
+        self.assertEqual([r['id'] for r in records], ['a', 'b', 'c', 'd', 'e'])
+
+    def test_iter_records_sends_the_page_size_and_filters(self):
+        list(self.client.iter_records('History', page_size=2, newer=12,
+                                      sort='oldest', prefetch=False))
+        self.request.assert_any_call(
+            'get', '/storage/history',
+            params={'full': True, 'limit': 2, 'newer': 12, 'sort': 'oldest'})
+        self.request.assert_called_with(
+            'get', '/storage/history',
+            params={'full': True, 'limit': 2, 'newer': 12, 'sort': 'oldest',
+                    'offset': 'offset-2'})
+
+    def test_iter_records_does_not_mutate_given_params(self):
+        params = {'foo': 'bar'}
+        list(self.client.iter_records('history', params=params))
+        self.assertEqual(params, {'foo': 'bar'})
+
+    def test_iter_records_stops_on_empty_collection(self):
+        self.pages = {None: ([], None)}
+        self.assertEqual(list(self.client.iter_records('history')), [])
+
+
+class FetchCollectionsTest(unittest.TestCase):
+    def setUp(self):
+        super(FetchCollectionsTest, self).setUp()
+        self.client = SyncClient(
+            hashalg='sha256',
+            id=mock.sentinel.id,
+            key='key',
+            uid=mock.sentinel.uid,
+            api_endpoint="http://example.org/"
+        )
+        self.client.info_collections = mock.MagicMock(
+            return_value={'bookmarks': 1.5, 'history': 2.5})
+        self.client.iter_records = mock.MagicMock(
+            side_effect=lambda name, **kwargs: iter([{'id': name}]))
+
+    def test_fetch_collections_defaults_to_info_collections(self):
+        results = dict(self.client.fetch_collections())
+        self.assertEqual(results, {'bookmarks': [{'id': 'bookmarks'}],
+                                   'history': [{'id': 'history'}]})
+
+    def test_fetch_collections_with_given_names(self):
+        results = dict(self.client.fetch_collections(['tabs'], newer=12))
+        self.assertEqual(results, {'tabs': [{'id': 'tabs'}]})
+        self.client.info_collections.assert_not_called()
+        self.client.iter_records.assert_called_with(
+            'tabs', page_size=1000, prefetch=False, newer=12)
+
+    def test_fetch_collections_raises_fetch_errors(self):
+        self.client.iter_records.side_effect = SyncClientError
+        self.assertRaises(SyncClientError, list,
+                          self.client.fetch_collections(['tabs']))
+
+
+class StreamRecordsTest(unittest.TestCase):
+    def setUp(self):
+        super(StreamRecordsTest, self).setUp()
+        self.client = SyncClient(
+            hashalg='sha256',
+            id=mock.sentinel.id,
+            key='key',
+            uid=mock.sentinel.uid,
+            api_endpoint="http://example.org/"
+        )
+        self.response = mock.MagicMock(status_code=200)
+        self.client.session = mock.MagicMock()
+        self.client.session.request.return_value = self.response
+
+    def test_newline_records_are_yielded_one_by_one(self):
+        self.response.headers = {'Content-Type': 'application/newlines'}
+        self.response.iter_lines.return_value = iter([
+            b'{"id": "a"}', b'', b'{"id": "b"}'])
+        records = self.client.stream_records('History', newer=12)
+        self.assertEqual(list(records), [{'id': 'a'}, {'id': 'b'}])
+        self.client.session.request.assert_called_with(
+            'get', 'http://example.org/storage/history',
+            params={'full': True, 'newer': 12},
+            headers={'Accept': 'application/newlines'},
+            stream=True, auth=self.client.auth, verify=None)
+        self.response.close.assert_called_with()
+
+    def test_json_arrays_are_parsed_incrementally(self):
+        self.response.headers = {'Content-Type': 'application/json'}
+        self.response.iter_content.return_value = iter([
+            b'["a", "b', b'", "c"]'])
+        self.assertEqual(list(self.client.stream_records('tabs', full=False)),
+                         ['a', 'b', 'c'])
+
+    def test_records_can_be_streamed_as_bsos(self):
+        self.response.headers = {'Content-Type': 'application/json'}
+        self.response.iter_content.return_value = iter([
+            b'[{"id": "a", "payload": "{\\"x\\": 1}"}]'])
+        [bso] = list(self.client.stream_records('tabs', as_bso=True))
+        self.assertIsInstance(bso, BSO)
+        self.assertEqual((bso.id, bso.data), ('a', {'x': 1}))
+
+    def test_not_modified_is_an_error(self):
+        self.response.status_code = 304
+        self.assertRaises(HTTPError, list,
+                          self.client.stream_records('tabs'))
+
+
+class IterJSONArrayTest(unittest.TestCase):
+    def _parse(self, *chunks):
+        return list(_iter_json_array(iter(chunks)))
+
+    def test_items_split_across_chunks(self):
+        self.assertEqual(
+            self._parse(b' [ {"id": "a", "x', b'": [1, 2]} ,', b'{"id": "b"}',
+                        b']'),
+            [{'id': 'a', 'x': [1, 2]}, {'id': 'b'}])
+
+    def test_numbers_split_across_chunks(self):
+        self.assertEqual(self._parse(b'[12', b'34, 5', b']'), [1234, 5])
+
+    def test_floats_split_across_chunks(self):
+        self.assertEqual(
+            self._parse(b'[1', b', "a]b,c",', b' null, -35', b'00',
+                        b'0000000.', b'0]'),
+            [1, 'a]b,c', None, -35000000000.0])
+        self.assertEqual(self._parse(b'[1.', b'5e', b'-', b'2 ,1', b'E2]'),
+                         [0.015, 100.0])
+
+    def test_numbers_split_at_every_byte(self):
+        data = b'[12.5e3, -0.25, 7, true, "x"]'
+        for cut in range(1, len(data)):
+            self.assertEqual(self._parse(data[:cut], data[cut:]),
+                             [12500.0, -0.25, 7, True, 'x'])
+
+    def test_multibyte_characters_split_across_chunks(self):
+        data = u'["\xe9t\xe9"]'.encode('utf-8')
+        self.assertEqual(self._parse(data[:3], data[3:]), [u'\xe9t\xe9'])
+
+    def test_empty_array(self):
+        self.assertEqual(self._parse(b'[', b' ]'), [])
+
+    def test_invalid_documents_raise(self):
+        self.assertRaises(ValueError, self._parse, b'{"id": "a"}')
+        self.assertRaises(ValueError, self._parse, b'["a", ')
+        self.assertRaises(ValueError, self._parse, b'["a", {"id": ')
+
+
 class EncodeHeaderTest(unittest.TestCase):
     def test_encode_str_return_str(self):
         value = 'Toto'
@@ -466,3 +1506,97 @@ class EncodeHeaderTest(unittest.TestCase):
         entry = u'Rémy'
         value = encode_header(entry)
         self.assertEqual(type(value), str)
+
+
+class RecordCacheTest(unittest.TestCase):
+    def setUp(self):
+        super(RecordCacheTest, self).setUp()
+        self.cache = RecordCache()
+        self.client = SyncClient(
+            hashalg='sha256',
+            id=mock.sentinel.id,
+            key='key',
+            uid=mock.sentinel.uid,
+            api_endpoint="http://example.org/",
+            record_cache=self.cache
+        )
+        self.request = mock.MagicMock()
+        self.client.session = mock.MagicMock(request=self.request)
+        self.client.scheduler = mock.Mock(should_retry=lambda *args: False)
+        self._respond({'tabs': 10.0, 'meta': 10.0})
+        self.client.info_collections()
+
+    def _respond(self, body, server_time='11.00'):
+        response = mock.MagicMock(status_code=200,
+                                  headers={'X-Weave-Timestamp': server_time},
+                                  content=json.dumps(body).encode('utf-8'))
+        response.json.return_value = body
+        self.request.return_value = response
+
+    def _requested_urls(self):
+        return [call[0][1] for call in self.request.call_args_list]
+
+    def test_repeated_reads_are_answered_from_the_cache(self):
+        self._respond({'id': 'global', 'payload': 'x'})
+        self.client.get_record('meta', 'global')
+        self.assertEqual(self.client.get_record('Meta', 'global'),
+                         {'id': 'global', 'payload': 'x'})
+        self.assertEqual(len(self.request.call_args_list), 2)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_records_are_read_again_once_their_collection_changed(self):
+        self._respond({'id': 'global'})
+        self.client.get_record('meta', 'global')
+        self._respond({'meta': 12.0})
+        self.client.info_collections()
+        self._respond({'id': 'global', 'payload': 'new'})
+        self.assertEqual(self.client.get_record('meta', 'global'),
+                         {'id': 'global', 'payload': 'new'})
+
+    def test_timestamps_are_revalidated_when_too_old(self):
+        self._respond({'id': 'global'})
+        self.client.get_record('meta', 'global')
+        self.cache.max_age = -1
+        self._respond({'meta': 10.0})
+        self.client.get_record('meta', 'global')
+        self.assertTrue(self._requested_urls()[-1].endswith(
+            '/info/collections'))
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_writes_invalidate_the_records(self):
+        for write in (lambda: self.client.put_record('meta', {'id': 'a'}),
+                      lambda: self.client.delete_record('meta', 'a'),
+                      lambda: self.client.delete_records('meta', ['a']),
+                      lambda: self.client.delete_collection('meta'),
+                      lambda: self.client.delete_all_records()):
+            self._respond({'id': 'a'})
+            self.client.get_record('meta', 'a')
+            self.assertEqual(len(self.cache), 1)
+            self._respond({'modified': 12.0})
+            write()
+            self.assertEqual(len(self.cache), 0)
+
+    def test_deleted_records_are_invalidated_whatever_the_id_type(self):
+        self._respond({'id': '5'})
+        self.client.get_record('tabs', 5)
+        self.client.get_record('tabs', 5)
+        self._respond({'modified': 12.0})
+        self.client.delete_records('tabs', [5])
+        self._respond({'id': '5', 'deleted': True})
+        self.assertEqual(self.client.get_record('tabs', 5),
+                         {'id': '5', 'deleted': True})
+
+    def test_posted_records_are_invalidated(self):
+        self._respond({'id': 'a'})
+        self.client.get_record('tabs', 'a')
+        self.client.get_record('tabs', 'b')
+        self.client._configuration = dict(DEFAULT_CONFIGURATION)
+        self._respond({'success': ['a'], 'failed': {}})
+        self.client.post_records('tabs', [{'id': 'a'}], batch=False)
+        self.assertIsNone(self.cache.get('tabs', 'a'))
+        self.assertIsNotNone(self.cache.get('tabs', 'b'))
+
+    def test_requests_with_options_skip_the_cache(self):
+        self._respond({'id': 'a'})
+        self.client.get_record('tabs', 'a', headers={'X-Foo': 'bar'})
+        self.assertEqual(len(self.cache), 0)
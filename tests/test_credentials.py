@@ -0,0 +1,110 @@
+import os
+import shutil
+import stat
+import tempfile
+
+import mock
+
+from syncclient.credentials import (
+    FileCredentialCache, FxASessionCache, MemoryCredentialCache
+)
+from .support import unittest
+
+
+class MemoryCredentialCacheTest(unittest.TestCase):
+    def test_get_returns_what_was_set(self):
+        cache = MemoryCredentialCache()
+        cache.set('key', {'id': 'a', 'expires': 12})
+        self.assertEqual(cache.get('key'), {'id': 'a', 'expires': 12})
+        self.assertIsNone(cache.get('other'))
+
+    def test_stored_credentials_are_copies(self):
+        cache = MemoryCredentialCache()
+        credentials = {'id': 'a'}
+        cache.set('key', credentials)
+        credentials['id'] = 'b'
+        cache.get('key')['id'] = 'c'
+        self.assertEqual(cache.get('key'), {'id': 'a'})
+
+    def test_delete(self):
+        cache = MemoryCredentialCache()
+        cache.set('key', {'id': 'a'})
+        cache.delete('key')
+        cache.delete('key')
+        self.assertIsNone(cache.get('key'))
+
+
+class FileCredentialCacheTest(unittest.TestCase):
+    def setUp(self):
+        super(FileCredentialCacheTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'credentials.json')
+
+    def test_credentials_are_shared_through_the_file(self):
+        FileCredentialCache(self.path).set('key', {'id': 'a'})
+        FileCredentialCache(self.path).set('other', {'id': 'b'})
+        cache = FileCredentialCache(self.path)
+        self.assertEqual(cache.get('key'), {'id': 'a'})
+        self.assertEqual(cache.get('other'), {'id': 'b'})
+
+    def test_missing_or_corrupted_file_is_empty(self):
+        cache = FileCredentialCache(self.path)
+        self.assertIsNone(cache.get('key'))
+        with open(self.path, 'w') as f:
+            f.write('{not json')
+        self.assertIsNone(cache.get('key'))
+
+    def test_failed_writes_keep_the_previous_file(self):
+        cache = FileCredentialCache(self.path)
+        cache.set('key', {'id': 'a'})
+        with mock.patch('syncclient.credentials.json.dump',
+                        side_effect=IOError('Disk full')):
+            self.assertRaises(IOError, cache.set, 'key', {'id': 'b'})
+        self.assertEqual(cache.get('key'), {'id': 'a'})
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['credentials.json', 'credentials.json.lock'])
+
+    def test_file_is_only_readable_by_its_owner(self):
+        FileCredentialCache(self.path).set('key', {'id': 'a'})
+        mode = stat.S_IMODE(os.stat(self.path).st_mode)
+        self.assertEqual(mode, 0o600)
+
+    def test_delete(self):
+        cache = FileCredentialCache(self.path)
+        cache.set('key', {'id': 'a'})
+        cache.set('other', {'id': 'b'})
+        cache.delete('key')
+        cache.delete('key')
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(cache.get('other'), {'id': 'b'})
+
+
+class FxASessionCacheTest(unittest.TestCase):
+    def setUp(self):
+        super(FxASessionCacheTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'sessions.json')
+        self.session = {'uid': 'abc', 'token': 'cafe', 'keyB': 'beef'}
+
+    def test_sessions_are_encrypted_at_rest(self):
+        FxASessionCache(self.path, u'password').set('Alice@example.com',
+                                                    self.session)
+        with open(self.path) as f:
+            content = f.read()
+        self.assertNotIn('cafe', content)
+        self.assertNotIn('alice', content.lower())
+        cache = FxASessionCache(self.path, b'password')
+        self.assertEqual(cache.get('alice@example.com'), self.session)
+
+    def test_wrong_secret_is_a_cache_miss(self):
+        FxASessionCache(self.path, 'password').set('alice', self.session)
+        self.assertIsNone(FxASessionCache(self.path, 'other').get('alice'))
+        self.assertIsNone(FxASessionCache(self.path, 'other').get('bob'))
+
+    def test_delete(self):
+        cache = FxASessionCache(self.path, 'password')
+        cache.set('alice', self.session)
+        cache.delete('alice')
+        self.assertIsNone(cache.get('alice'))
@@ -0,0 +1,143 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import mock
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from syncclient.client import SyncClient, SyncClientError
+from syncclient.crypto import (
+    CollectionKeys, DecryptionError, KeyBundle, decrypt_records
+)
+from .support import unittest
+
+
+class KeyBundleTest(unittest.TestCase):
+    def setUp(self):
+        super(KeyBundleTest, self).setUp()
+        self.bundle = KeyBundle(b'e' * 32, b'h' * 32)
+
+    def test_root_bundle_is_derived_from_kB(self):
+        material = HKDF(algorithm=hashes.SHA256(), length=64, salt=b'',
+                        info=b'identity.mozilla.com/picl/v1/oldsync',
+                        backend=default_backend()).derive(b'k' * 32)
+        self.assertEqual(KeyBundle.from_kB(b'k' * 32),
+                         KeyBundle(material[:32], material[32:]))
+
+    def test_decrypt_returns_the_encrypted_cleartext(self):
+        payload = self.bundle.encrypt({'id': 'a', 'title': u'\xe9t\xe9'})
+        self.assertEqual(self.bundle.decrypt(json.dumps(payload)),
+                         {'id': 'a', 'title': u'\xe9t\xe9'})
+
+    def test_tampered_payloads_are_rejected(self):
+        payload = self.bundle.encrypt({'id': 'a'})
+        payload['hmac'] = '0' * 64
+        self.assertRaises(DecryptionError, self.bundle.decrypt, payload)
+
+    def test_payloads_of_another_key_are_rejected(self):
+        payload = KeyBundle(b'x' * 32, b'i' * 32).encrypt({'id': 'a'})
+        self.assertRaises(DecryptionError, self.bundle.decrypt, payload)
+
+    def test_payloads_of_another_encryption_key_are_rejected(self):
+        other = KeyBundle(b'x' * 32, b'h' * 32)
+        # Some IVs give a valid padding: they must be rejected as well.
+        for _ in range(1000):
+            self.assertRaises(DecryptionError, self.bundle.decrypt,
+                              other.encrypt({'id': 'a'}))
+
+    def test_malformed_payloads_are_rejected(self):
+        self.assertRaises(DecryptionError, self.bundle.decrypt, '{}')
+
+    def test_payloads_with_a_malformed_hmac_are_rejected(self):
+        payload = self.bundle.encrypt({'id': 'a'})
+        for hmac in (12, u'\xe9' * 64):
+            payload['hmac'] = hmac
+            self.assertRaises(DecryptionError, self.bundle.decrypt, payload)
+
+    def test_base64_round_trip(self):
+        self.assertEqual(KeyBundle.from_base64(*self.bundle.to_base64()),
+                         self.bundle)
+        self.assertNotEqual(self.bundle, KeyBundle(b'e' * 32, b'x' * 32))
+
+
+class CollectionKeysTest(unittest.TestCase):
+    def setUp(self):
+        super(CollectionKeysTest, self).setUp()
+        self.root = KeyBundle.from_kB(b'k' * 32)
+        self.default = KeyBundle(b'd' * 32, b'D' * 32)
+        self.bookmarks = KeyBundle(b'b' * 32, b'B' * 32)
+        self.record = {'id': 'keys', 'payload': json.dumps(self.root.encrypt({
+            'default': self.default.to_base64(),
+            'collections': {'bookmarks': self.bookmarks.to_base64()}}))}
+
+    def test_keys_are_decrypted_from_the_record(self):
+        keys = CollectionKeys.from_record(self.record, self.root)
+        self.assertEqual(keys.bundle_for('Bookmarks'), self.bookmarks)
+        self.assertEqual(keys.bundle_for('history'), self.default)
+
+    def test_client_fetches_keys_and_decrypts_records(self):
+        client = SyncClient(hashalg='sha256', id='id', key='key', uid='uid',
+                            api_endpoint='http://example.org/')
+        client._request = mock.MagicMock(return_value=self.record)
+        client.fetch_collection_keys(b'k' * 32)
+        client._request.assert_called_with('get', '/storage/crypto/keys')
+
+        records = [{'id': 'a', 'payload': json.dumps(
+            self.bookmarks.encrypt({'id': 'a'}))}]
+        self.assertEqual(list(client.decrypt_records('bookmarks', records)),
+                         [{'id': 'a', 'payload': {'id': 'a'}}])
+
+    def test_client_needs_the_keys_to_decrypt(self):
+        client = SyncClient(hashalg='sha256', id='id', key='key', uid='uid',
+                            api_endpoint='http://example.org/')
+        self.assertRaises(SyncClientError, client.decrypt_records, 'tabs', [])
+
+
+class DecryptRecordsTest(unittest.TestCase):
+    def setUp(self):
+        super(DecryptRecordsTest, self).setUp()
+        self.bundle = KeyBundle(b'e' * 32, b'h' * 32)
+        self.records = [
+            {'id': str(idx), 'modified': idx,
+             'payload': json.dumps(self.bundle.encrypt({'index': idx}))}
+            for idx in range(7)]
+
+    def test_records_are_decrypted_in_order(self):
+        decrypted = list(decrypt_records(self.records, self.bundle))
+        self.assertEqual([r['payload']['index'] for r in decrypted],
+                         list(range(7)))
+        self.assertEqual(decrypted[3]['modified'], 3)
+
+    def test_records_are_decrypted_by_a_process_pool(self):
+        decrypted = list(decrypt_records(iter(self.records), self.bundle,
+                                         processes=2, chunk_size=3))
+        self.assertEqual([r['payload']['index'] for r in decrypted],
+                         list(range(7)))
+
+    def test_records_are_read_a_bounded_number_of_chunks_ahead(self):
+        consumed = []
+
+        def records():
+            for _ in range(50):
+                for record in self.records:
+                    consumed.append(record)
+                    yield record
+
+        with mock.patch('syncclient.crypto.ProcessPoolExecutor',
+                        ThreadPoolExecutor):
+            decrypted = decrypt_records(records(), self.bundle,
+                                        processes=2, chunk_size=5)
+            next(decrypted)
+            # Two chunks per process in flight, and the one being read.
+            self.assertLessEqual(len(consumed), 5 * 5)
+            self.assertEqual(len(list(decrypted)), 50 * 7 - 1)
+
+    def test_chunks_keep_their_order_whatever_the_pool(self):
+        # Worker processes are not traced: run the chunks in threads.
+        with mock.patch('syncclient.crypto.ProcessPoolExecutor',
+                        ThreadPoolExecutor):
+            decrypted = list(decrypt_records(self.records, self.bundle,
+                                             processes=3, chunk_size=2))
+        self.assertEqual([r['payload']['index'] for r in decrypted],
+                         list(range(7)))
@@ -0,0 +1,71 @@
+import mock
+
+from syncclient.delta import Delta, fetch_delta, plan_delta
+from .support import unittest
+
+
+class ListingClient(object):
+    """Answers the id listings from in-memory records."""
+
+    def __init__(self, records, last_modified='20.00'):
+        self.records = records
+        self.calls = []
+        self.raw_resp = mock.Mock(headers={'X-Last-Modified': last_modified})
+
+    def get_records(self, collection, full=False, newer=None):
+        self.calls.append(newer)
+        return [record_id for record_id, modified in self.records.items()
+                if newer is None or modified > newer]
+
+
+class PlanDeltaTest(unittest.TestCase):
+    def test_added_changed_and_removed_ids(self):
+        client = ListingClient({'kept': 5, 'changed': 15, 'added': 16})
+        delta = plan_delta(client, 'tabs',
+                           {'kept': 5, 'changed': 8, 'removed': 9})
+        self.assertEqual(delta, Delta(added=['added'], changed=['changed'],
+                                      removed=['removed'],
+                                      high_water_mark=20.0))
+        self.assertEqual(client.calls, [9, None])
+
+    def test_given_high_water_mark_is_used(self):
+        client = ListingClient({'a': 5, 'b': 15})
+        delta = plan_delta(client, 'tabs', {'a': 5, 'b': 8},
+                           high_water_mark=10)
+        self.assertEqual(delta.changed, ['b'])
+        self.assertEqual(client.calls, [10, None])
+
+    def test_empty_snapshot_needs_a_single_listing(self):
+        client = ListingClient({'b': 15, 'a': 5})
+        delta = plan_delta(client, 'tabs', {})
+        self.assertEqual(delta.added, ['a', 'b'])
+        self.assertEqual(client.calls, [None])
+
+    def test_high_water_mark_comes_from_the_first_listing(self):
+        client = ListingClient({'a': 5})
+        headers = iter([{'X-Last-Modified': '12.00'},
+                        {'X-Last-Modified': '13.00'}])
+
+        def get_records(collection, full=False, newer=None):
+            client.raw_resp = mock.Mock(headers=next(headers))
+            return ['a']
+
+        client.get_records = get_records
+        self.assertEqual(plan_delta(client, 'tabs', {'a': 5}).high_water_mark,
+                         12.0)
+
+    def test_no_high_water_mark_without_header(self):
+        client = ListingClient({}, last_modified=None)
+        client.raw_resp.headers = {}
+        self.assertIsNone(plan_delta(client, 'tabs', {}).high_water_mark)
+
+
+class FetchDeltaTest(unittest.TestCase):
+    def test_added_and_changed_records_are_fetched(self):
+        client = mock.Mock()
+        client.fetch_records.return_value = iter([{'id': 'a'}])
+        delta = Delta(['a'], ['b'], ['c'], 12.0)
+        self.assertEqual(list(fetch_delta(client, 'tabs', delta,
+                                          max_workers=2)), [{'id': 'a'}])
+        client.fetch_records.assert_called_with('tabs', ['a', 'b'],
+                                                max_workers=2)
@@ -0,0 +1,86 @@
+import io
+
+import mohawk
+import mock
+import requests
+
+from syncclient.hawk import HawkSigner
+from .support import unittest
+
+CREDENTIALS = {'id': 'hawk-id', 'key': 'hawk-key', 'algorithm': 'sha256'}
+
+
+def verify(header, url, method, content=None, content_type=''):
+    """Check a header with the reference implementation."""
+    mohawk.Receiver(lambda sender_id: CREDENTIALS, header, url, method,
+                    content=content if content is not None else '',
+                    content_type=content_type,
+                    accept_untrusted_content=content is None,
+                    seen_nonce=lambda *args: False)
+
+
+class HawkSignerTest(unittest.TestCase):
+    def setUp(self):
+        self.signer = HawkSigner('hawk-id', 'hawk-key')
+
+    def test_requests_without_body_are_signed(self):
+        url = 'https://example.org/1.5/12/storage/tabs?full=1&newer=12.5'
+        header = self.signer.header('GET', url)
+        self.assertNotIn('hash=', header)
+        verify(header, url, 'GET')
+
+    def test_payload_hash_is_checked(self):
+        url = 'http://example.org:8000/1.5/12/storage/tabs/abc'
+        body = '{"payload": "été"}'
+        header = self.signer.header('PUT', url, body,
+                                    'application/json; charset=utf-8')
+        verify(header, url, 'PUT', body.encode('utf-8'),
+               'application/json; charset=utf-8')
+
+    def test_file_bodies_are_hashed_and_rewound(self):
+        url = 'https://example.org/upload'
+        body = io.BytesIO(b'x' * 200000)
+        body.read(10)
+        header = self.signer.header('POST', url, body, 'text/plain')
+        self.assertEqual(body.tell(), 10)
+        verify(header, url, 'POST', b'x' * 199990, 'text/plain')
+
+    def test_bodies_that_cannot_be_read_twice_are_not_hashed(self):
+        self.assertIsNone(self.signer.payload_hash(iter([b'abc']), ''))
+
+    def test_streams_that_cannot_seek_are_not_hashed(self):
+        body = mock.Mock(spec=['read'])
+        self.assertIsNone(self.signer.payload_hash(body, 'text/plain'))
+        self.assertFalse(body.read.called)
+
+    def test_ext_is_signed(self):
+        signer = HawkSigner('hawk-id', 'hawk-key', ext='app-data')
+        url = 'https://example.org/1.5/12/info/collections'
+        header = signer.header('GET', url)
+        self.assertIn('ext="app-data"', header)
+        verify(header, url, 'GET')
+
+    def test_timestamp_follows_the_server_clock(self):
+        signer = HawkSigner('hawk-id', 'hawk-key', clock=lambda: 1000.0)
+        response = mock.Mock(headers={'X-Weave-Timestamp': '1300.25'})
+        signer.update_skew(response)
+        self.assertEqual(signer.skew, 300.25)
+        self.assertIn('ts="1300"', signer.header('GET', 'http://a.org/'))
+
+    def test_invalid_server_timestamps_are_ignored(self):
+        self.signer.update_skew(
+            mock.Mock(headers={'X-Weave-Timestamp': 'soon'}))
+        self.assertEqual(self.signer.skew, 0)
+
+    def test_signs_prepared_requests(self):
+        request = requests.Request(
+            'POST', 'https://example.org/1.5/12/storage/tabs',
+            data='[]', headers={'Content-Type': 'application/json'}
+        ).prepare()
+        self.signer(request)
+        verify(request.headers['Authorization'], request.url, 'POST', '[]',
+               'application/json')
+        self.assertIn(self.signer.update_skew, request.hooks['response'])
+
+    def test_exposes_the_credentials_like_hawkauth(self):
+        self.assertEqual(self.signer.credentials, CREDENTIALS)
@@ -0,0 +1,272 @@
+import argparse
+import inspect
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import mock
+import six
+
+from syncclient.client import SyncClient, SyncClientError
+from syncclient.main import (
+    ACTIONS, CLIENT_ACTIONS, load_credentials, main, parse_batch_line,
+    run_batch, save_credentials)
+from .support import unittest, patch
+
+CREDENTIALS = {'uid': '1234', 'api_endpoint': 'https://node/1.5/1234',
+               'hashalg': 'sha256', 'id': 'hawk-id', 'key': 'hawk-key'}
+
+
+class ImportTest(unittest.TestCase):
+    def test_the_client_does_not_load_fxa(self):
+        code = ('import sys, syncclient.client; '
+                'print(sorted(m for m in sys.modules if m.split(".")[0] in '
+                '("fxa", "cryptography") or m == "syncclient.crypto"))')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.strip(), b'[]')
+
+    def test_backoff_does_not_load_the_client(self):
+        code = ('import sys, syncclient.backoff; '
+                'print("syncclient.client" in sys.modules)')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.strip(), b'False')
+
+    def test_errors_are_the_same_from_the_client(self):
+        from syncclient import errors
+        self.assertIs(SyncClientError, errors.SyncClientError)
+
+    def test_actions_are_methods_of_the_client(self):
+        for action in CLIENT_ACTIONS:
+            # Not getattr(): properties such as raw_resp are not actions.
+            self.assertTrue(
+                inspect.isfunction(SyncClient.__dict__.get(action)), action)
+        self.assertEqual(set(ACTIONS) - set(CLIENT_ACTIONS),
+                         set(['export', 'import']))
+
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        super(MainTest, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'credentials.json')
+        self.sync_client, self.provider = patch(
+            self, 'syncclient.client.SyncClient',
+            'syncclient.client.fxa_assertion_provider')
+        self.provider.return_value = (mock.sentinel.assertions, b'keyB')
+        self.client = self.sync_client.return_value
+        self.client.info_quota.return_value = [1, 2]
+        patch(self, 'syncclient.main.pprint')
+
+    def _write(self, credentials):
+        with open(self.path, 'w') as f:
+            json.dump(credentials, f)
+
+    def test_credentials_skip_the_login(self):
+        self._write(CREDENTIALS)
+        main(['--credentials', self.path, 'info_quota'])
+        self.sync_client.assert_called_with(**CREDENTIALS)
+        self.assertFalse(self.provider.called)
+        self.client.info_quota.assert_called_with()
+
+    def test_actions_get_their_arguments(self):
+        self._write(CREDENTIALS)
+        main(['--credentials', self.path, 'get_record', 'meta', 'global'])
+        self.client.get_record.assert_called_with('meta', 'global')
+
+    def test_login_is_used_without_credentials(self):
+        main(['alice', 'secret', 'info_quota'])
+        self.provider.assert_called_with('alice', 'secret',
+                                         session_cache=None)
+        self.assertIs(self.sync_client.call_args[0][0],
+                      mock.sentinel.assertions)
+        self.client.info_quota.assert_called_with()
+
+    def test_login_and_password_are_required_without_credentials(self):
+        with mock.patch('sys.stderr'):
+            self.assertRaises(SystemExit, main, ['info_quota'])
+
+    def test_unknown_actions_are_rejected(self):
+        self._write(CREDENTIALS)
+        with mock.patch('sys.stderr'):
+            self.assertRaises(SystemExit, main,
+                              ['--credentials', self.path, 'unknown'])
+        self.assertFalse(self.sync_client.called)
+
+    def test_lists_are_given_comma_separated(self):
+        self._write(CREDENTIALS)
+        main(['--credentials', self.path, 'delete_records', 'history',
+              'abc,def'])
+        self.client.delete_records.assert_called_with(
+            'history', ['abc', 'def'])
+        main(['--credentials', self.path, 'fetch_collections',
+              'bookmarks'])
+        self.client.fetch_collections.assert_called_with(['bookmarks'])
+
+    def test_posted_records_are_given_as_json(self):
+        self._write(CREDENTIALS)
+        main(['--credentials', self.path, 'post_records', 'tabs',
+              '[{"id": "a"}]'])
+        self.client.post_records.assert_called_with('tabs', [{'id': 'a'}])
+
+    def test_actions_taking_keys_are_not_exposed(self):
+        self._write(CREDENTIALS)
+        for action in ('decrypt_records', 'fetch_collection_keys'):
+            with mock.patch('sys.stderr'):
+                self.assertRaises(SystemExit, main,
+                                  ['--credentials', self.path, action])
+
+    def test_attributes_are_not_actions(self):
+        self._write(CREDENTIALS)
+        for attribute in ('raw_resp', 'close', 'refresh_credentials'):
+            with mock.patch('sys.stderr'):
+                self.assertRaises(SystemExit, main,
+                                  ['--credentials', self.path, attribute])
+
+    def test_incomplete_credentials_are_rejected(self):
+        self._write({'uid': '1234'})
+        with mock.patch('sys.stderr'):
+            self.assertRaises(SystemExit, main,
+                              ['--credentials', self.path])
+
+    def test_decrypt_needs_keyB(self):
+        self._write(CREDENTIALS)
+        with mock.patch('sys.stderr'):
+            self.assertRaises(SystemExit, main,
+                              ['--credentials', self.path, '--decrypt',
+                               'get_record', 'meta', 'global'])
+
+    def test_saved_credentials_can_be_loaded(self):
+        client = mock.Mock(user_id='1234', credentials_expire=42,
+                           api_endpoint='https://node/1.5/1234')
+        client.auth.credentials = {'id': 'hawk-id', 'key': 'hawk-key',
+                                   'algorithm': 'sha256'}
+        save_credentials(self.path, client, b'keyB')
+        credentials, keyB = load_credentials(self.path)
+        self.assertEqual(credentials, dict(CREDENTIALS, expires=42))
+        self.assertEqual(keyB, b'keyB')
+
+    def test_saved_credentials_are_only_readable_by_their_owner(self):
+        client = mock.Mock(user_id='1234', credentials_expire=None,
+                           api_endpoint='https://node/1.5/1234')
+        client.auth.credentials = {'id': 'hawk-id', 'key': 'hawk-key',
+                                   'algorithm': 'sha256'}
+        with open(self.path, 'w') as f:
+            f.write('{}')
+        os.chmod(self.path, 0o644)
+        save_credentials(self.path, client, b'keyB')
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+        self.assertEqual(os.listdir(self.tmpdir), ['credentials.json'])
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        super(BatchTest, self).setUp()
+        self.client = mock.Mock(collection_keys=None)
+        self.options = argparse.Namespace(decrypt=False, output='export',
+                                          workers=4)
+        self.out = six.StringIO()
+
+    def _run(self, lines, **kwargs):
+        failures = run_batch(self.client, lines, self.options,
+                             out=self.out, **kwargs)
+        return failures, [json.loads(line)
+                          for line in self.out.getvalue().splitlines()]
+
+    def test_lines_are_split_like_shell_words(self):
+        self.assertEqual(parse_batch_line('get_record "my bookmarks" id'),
+                         ('get_record', ['my bookmarks', 'id']))
+
+    def test_json_lines_can_give_objects(self):
+        self.assertEqual(
+            parse_batch_line('["put_record", "tabs", {"id": "a"}]'),
+            ('put_record', ['tabs', {'id': 'a'}]))
+
+    def test_json_lines_can_give_lists(self):
+        self.client.fetch_records.return_value = iter([{'id': 'a'}])
+        _, entries = self._run(['["fetch_records", "tabs", ["a", "b"]]',
+                                'fetch_records tabs a,b'])
+        self.assertEqual(self.client.fetch_records.call_args_list,
+                         [mock.call('tabs', ['a', 'b'])] * 2)
+
+    def test_each_action_writes_a_json_line(self):
+        self.client.info_quota.return_value = [1, 2]
+        self.client.get_record.return_value = {'id': 'global'}
+        failures, entries = self._run(['# Quota', 'info_quota', '',
+                                       'get_record meta global'])
+        self.assertEqual(failures, 0)
+        self.assertEqual(entries, [
+            {'line': 2, 'action': 'info_quota', 'result': [1, 2]},
+            {'line': 4, 'action': 'get_record', 'result': {'id': 'global'}}])
+        self.client.get_record.assert_called_with('meta', 'global')
+
+    def test_errors_are_reported_and_the_batch_goes_on(self):
+        self.client.info_quota.side_effect = ValueError('boom')
+        failures, entries = self._run(['info_quota', 'unknown', '["',
+                                       'info_collections'])
+        self.assertEqual(failures, 3)
+        self.assertEqual([entry['line'] for entry in entries], [1, 2, 3, 4])
+        self.assertEqual(entries[0]['error'], 'ValueError: boom')
+        self.assertIn('Unknown action', entries[1]['error'])
+        self.assertNotIn('action', entries[2])
+        self.assertIn('result', entries[3])
+
+    def test_records_yielded_are_listed(self):
+        self.client.iter_records.return_value = (record for record in 'ab')
+        _, entries = self._run(['iter_records tabs'])
+        self.assertEqual(entries[0]['result'], ['a', 'b'])
+
+    def test_parallel_results_are_written_in_order(self):
+        started = threading.Event()
+
+        def slow(*args):
+            started.wait(5)
+            return 'slow'
+
+        def fast(*args):
+            started.set()
+            return 'fast'
+
+        self.client.get_records.side_effect = slow
+        self.client.get_record.side_effect = fast
+        _, entries = self._run(['get_records a', 'get_record b c'],
+                               parallel=2)
+        self.assertEqual([entry['result'] for entry in entries],
+                         ['slow', 'fast'])
+
+    def test_wait_lines_wait_for_the_previous_actions(self):
+        calls = []
+        self.client.put_record.side_effect = (
+            lambda *args: time.sleep(0.05) or calls.append('put'))
+        self.client.get_record.side_effect = (
+            lambda *args: calls.append('get'))
+        _, entries = self._run(['put_record tabs {}', 'wait',
+                                'get_record tabs a'], parallel=4)
+        self.assertEqual(calls, ['put', 'get'])
+        self.assertEqual([entry['line'] for entry in entries], [1, 3])
+
+    def test_main_runs_a_batch_with_one_client(self):
+        sync_client = patch(self, 'syncclient.client.SyncClient')[0]
+        client = sync_client.return_value
+        client.info_quota.return_value = [1, 2]
+        client.info_collections.side_effect = ValueError
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        credentials = os.path.join(tmpdir, 'credentials.json')
+        with open(credentials, 'w') as f:
+            json.dump(CREDENTIALS, f)
+        batch = os.path.join(tmpdir, 'batch')
+        with open(batch, 'w') as f:
+            f.write('info_quota\ninfo_quota\ninfo_collections\n')
+
+        with mock.patch('sys.stdout', self.out):
+            status = main(['--credentials', credentials, '--batch', batch])
+        self.assertEqual(status, 1)
+        self.assertEqual(sync_client.call_count, 1)
+        self.assertEqual(len(self.out.getvalue().splitlines()), 3)
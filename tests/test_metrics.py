@@ -0,0 +1,118 @@
+import mock
+
+from syncclient.metrics import (
+    MetricsCollector, RequestEvent, StatsdSink, emit)
+from .support import unittest
+
+
+def event(method='GET', path='/storage/history', status=200, **kwargs):
+    evt = RequestEvent(method, path, node='node.example.org')
+    evt.status = status
+    for name, value in kwargs.items():
+        setattr(evt, name, value)
+    return evt
+
+
+class RequestEventTest(unittest.TestCase):
+    def test_collection_is_taken_from_storage_paths(self):
+        self.assertEqual(RequestEvent('get', '/storage/tabs/abc').collection,
+                         'tabs')
+        self.assertEqual(RequestEvent('get', '/storage/tabs').collection,
+                         'tabs')
+        self.assertIsNone(RequestEvent('get', '/info/quota').collection)
+
+    def test_to_dict_and_repr(self):
+        evt = event(duration=0.25)
+        self.assertEqual(evt.to_dict()['collection'], 'history')
+        self.assertEqual(evt.to_dict()['status'], 200)
+        self.assertEqual(repr(evt), '<RequestEvent GET /storage/history '
+                                    'status=200 duration=0.250>')
+
+    def test_method_is_uppercased(self):
+        self.assertEqual(RequestEvent('put', '/').method, 'PUT')
+
+
+class EmitTest(unittest.TestCase):
+    def test_failing_hooks_do_not_stop_the_others(self):
+        evt = event()
+        failing = mock.Mock(side_effect=ValueError)
+        working = mock.Mock()
+        emit([failing, working], evt)
+        failing.assert_called_with(evt)
+        working.assert_called_with(evt)
+
+
+class MetricsCollectorTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = MetricsCollector()
+
+    def test_counts_requests_per_status(self):
+        self.metrics(event(status=200))
+        self.metrics(event(status=200))
+        self.metrics(event(status=404, error='HTTPError'))
+        self.assertEqual(self.metrics.counter('requests'), 3)
+        self.assertEqual(self.metrics.counter('requests', status='404'), 1)
+        self.assertEqual(self.metrics.counter('errors', error='HTTPError'), 1)
+
+    def test_sums_bytes_retries_and_cache_hits(self):
+        self.metrics(event(bytes_sent=10, bytes_received=100, retries=2))
+        self.metrics(event(path='/storage/tabs', bytes_received=50,
+                           cache_hit=True))
+        self.assertEqual(self.metrics.counter('bytes_received'), 150)
+        self.assertEqual(
+            self.metrics.counter('bytes_received', collection='tabs'), 50)
+        self.assertEqual(self.metrics.counter('bytes_sent'), 10)
+        self.assertEqual(self.metrics.counter('retries'), 2)
+        self.assertEqual(self.metrics.counter('cache_hits'), 1)
+
+    def test_observes_the_timings(self):
+        self.metrics(event(wait_time=0.25, duration=0.5))
+        self.metrics(event(wait_time=0.75, duration=1))
+        self.assertEqual(self.metrics.histogram('wait_time'), (2, 1.0))
+        self.assertEqual(self.metrics.histogram('duration', method='GET'),
+                         (2, 1.5))
+        self.assertEqual(self.metrics.histogram('duration', method='PUT'),
+                         (0, 0.0))
+
+    def test_reset(self):
+        self.metrics(event())
+        self.metrics.reset()
+        self.assertEqual(self.metrics.counter('requests'), 0)
+
+    def test_prometheus_export(self):
+        self.metrics(event(wait_time=0.02))
+        text = self.metrics.to_prometheus()
+        labels = ('node="node.example.org",collection="history",'
+                  'method="GET"')
+        self.assertIn('syncclient_requests_total{%s,status="200"} 1' % labels,
+                      text)
+        self.assertIn('syncclient_wait_seconds_bucket{%s,le="0.01"} 0'
+                      % labels, text)
+        self.assertIn('syncclient_wait_seconds_bucket{%s,le="0.025"} 1'
+                      % labels, text)
+        self.assertIn('syncclient_wait_seconds_bucket{%s,le="+Inf"} 1'
+                      % labels, text)
+        self.assertIn('syncclient_wait_seconds_count{%s} 1' % labels, text)
+
+
+class StatsdSinkTest(unittest.TestCase):
+    def test_sends_the_event_over_udp(self):
+        with mock.patch('syncclient.metrics.socket.socket') as socket:
+            sink = StatsdSink('statsd.example.org', 8125, prefix='sync')
+            sink(event(bytes_received=42, duration=0.5, retries=1))
+        packet, address = socket.return_value.sendto.call_args[0]
+        self.assertEqual(address, ('statsd.example.org', 8125))
+        lines = packet.decode('utf-8').split('\n')
+        base = 'sync.node_example_org.history'
+        self.assertIn(base + '.requests.get.200:1|c', lines)
+        self.assertIn(base + '.bytes_received:42|c', lines)
+        self.assertIn(base + '.retries:1|c', lines)
+        self.assertIn(base + '.duration:500.000|ms', lines)
+
+    def test_cache_hits_are_counted(self):
+        with mock.patch('syncclient.metrics.socket.socket') as socket:
+            sink = StatsdSink(prefix='sync')
+            lines = sink.lines(event(cache_hit=True))
+            sink.close()
+        self.assertIn('sync.node_example_org.history.cache_hits:1|c', lines)
+        socket.return_value.close.assert_called_with()
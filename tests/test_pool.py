@@ -0,0 +1,232 @@
+import threading
+import time
+
+import mock
+
+from syncclient.client import SyncClientError
+from syncclient.pool import SyncClientPool
+from .support import unittest, patch
+
+
+class SyncClientPoolTest(unittest.TestCase):
+    def setUp(self):
+        super(SyncClientPoolTest, self).setUp()
+        self.sync_client = patch(self, 'syncclient.pool.SyncClient')[0]
+        self.sync_client.side_effect = self._client
+        self.created = []
+
+    def _client(self, **kwargs):
+        client = mock.Mock(api_endpoint=kwargs.get(
+            'api_endpoint', 'https://node1/1.5/1234'), kwargs=kwargs)
+        self.created.append(client)
+        return client
+
+    def _pool(self, accounts, **kwargs):
+        pool = SyncClientPool(**kwargs)
+        self.addCleanup(pool.close)
+        for account, node in accounts.items():
+            pool.add_account(account, uid=account, hashalg='sha256',
+                             id='id', key='key',
+                             api_endpoint='https://%s/1.5/%s' % (node,
+                                                                 account))
+        return pool
+
+    def test_jobs_are_called_with_the_account_client(self):
+        pool = self._pool({'alice': 'node1'})
+        future = pool.submit('alice', lambda client, value: (client, value),
+                             42)
+        client, value = future.result(timeout=5)
+        self.assertEqual(value, 42)
+        self.assertEqual(client.kwargs['uid'], 'alice')
+
+    def test_clients_do_not_refresh_in_the_background(self):
+        pool = self._pool({'alice': 'node1'})
+        client = pool.get_client('alice')
+        self.assertIs(client.kwargs['background_refresh'], False)
+
+    def test_background_refresh_can_be_enabled(self):
+        pool = self._pool({'alice': 'node1'}, background_refresh=True)
+        client = pool.get_client('alice')
+        self.assertIs(client.kwargs['background_refresh'], True)
+
+    def test_accounts_give_an_assertion_provider(self):
+        pool = self._pool({})
+        provider = mock.Mock(return_value='assertion')
+        pool.add_account('alice', provider, 'client-state')
+        client = pool.get_client('alice')
+        self.assertIs(client.kwargs['bid_assertion'], provider)
+        self.assertEqual(client.kwargs['client_state'], 'client-state')
+
+    def test_single_assertions_are_refused(self):
+        pool = self._pool({})
+        self.assertRaises(SyncClientError, pool.add_account, 'alice',
+                          'assertion', 'client-state')
+
+    def test_clients_are_reused(self):
+        pool = self._pool({'alice': 'node1'})
+        first = pool.submit('alice', lambda client: client).result(timeout=5)
+        second = pool.submit('alice', lambda client: client).result(timeout=5)
+        self.assertIs(first, second)
+        self.assertEqual(self.sync_client.call_count, 1)
+
+    def test_clients_share_settings_and_the_backoff_state(self):
+        pool = self._pool({'alice': 'node1', 'bob': 'node2'},
+                          conditional_requests=True)
+        alice = pool.get_client('alice')
+        bob = pool.get_client('bob')
+        self.assertTrue(alice.kwargs['conditional_requests'])
+        self.assertIs(alice.kwargs['scheduler'], bob.kwargs['scheduler'])
+        self.assertIs(alice.kwargs['credential_cache'],
+                      bob.kwargs['credential_cache'])
+
+    def test_sessions_are_shared_per_storage_node(self):
+        pool = self._pool({'alice': 'node1', 'bob': 'node1',
+                           'carol': 'node2'})
+        alice = pool.get_client('alice')
+        bob = pool.get_client('bob')
+        carol = pool.get_client('carol')
+        self.assertIs(alice.session, bob.session)
+        self.assertIsNot(alice.session, carol.session)
+
+    def test_least_recently_used_clients_are_closed(self):
+        pool = self._pool({'alice': 'node1', 'bob': 'node1',
+                           'carol': 'node1'}, max_clients=2)
+        alice = pool.get_client('alice')
+        bob = pool.get_client('bob')
+        pool.get_client('alice')
+        pool.get_client('carol')
+        bob.close.assert_called_with()
+        self.assertFalse(alice.close.called)
+        self.assertIsNot(pool.get_client('bob'), bob)
+
+    def _max_concurrency(self, pool, accounts, jobs=3):
+        lock = threading.Lock()
+        state = {'running': 0, 'max': 0}
+
+        def job(client):
+            with lock:
+                state['running'] += 1
+                state['max'] = max(state['max'], state['running'])
+            time.sleep(0.01)
+            with lock:
+                state['running'] -= 1
+
+        futures = [pool.submit(account, job)
+                   for account in accounts for _ in range(jobs)]
+        for future in futures:
+            future.result(timeout=5)
+        return state['max']
+
+    def test_concurrency_is_limited_per_node(self):
+        accounts = {'alice': 'node1', 'bob': 'node1', 'carol': 'node1'}
+        pool = self._pool(accounts, max_workers=3, max_per_node=1)
+        self.assertEqual(self._max_concurrency(pool, accounts), 1)
+
+    def test_concurrency_is_limited_globally(self):
+        accounts = dict(('user%d' % idx, 'node%d' % idx) for idx in range(4))
+        pool = self._pool(accounts, max_workers=2)
+        self.assertEqual(self._max_concurrency(pool, accounts), 2)
+
+    def test_an_account_runs_one_job_at_a_time(self):
+        pool = self._pool({'alice': 'node1'}, max_workers=4)
+        self.assertEqual(self._max_concurrency(pool, ['alice'], jobs=4), 1)
+
+    def test_accounts_take_turns(self):
+        pool = self._pool({'alice': 'node1', 'bob': 'node2'}, max_workers=1)
+        started = threading.Event()
+        release = threading.Event()
+        order = []
+
+        def blocking(client):
+            started.set()
+            release.wait(5)
+            order.append('alice-1')
+
+        pool.submit('alice', blocking)
+        started.wait(5)
+        futures = [pool.submit(account,
+                               lambda c, name=name: order.append(name))
+                   for account, name in [('alice', 'alice-2'),
+                                         ('alice', 'alice-3'),
+                                         ('alice', 'alice-4'),
+                                         ('bob', 'bob-1')]]
+        release.set()
+        for future in futures:
+            future.result(timeout=5)
+        self.assertEqual(order, ['alice-1', 'alice-2', 'bob-1', 'alice-3',
+                                 'alice-4'])
+
+    def test_jobs_wait_for_the_storage_node_of_a_new_client(self):
+        pool = self._pool({'alice': 'node1', 'bob': 'node1'},
+                          max_workers=2, max_per_node=1)
+        started, release = threading.Event(), threading.Event()
+
+        def block(client):
+            started.set()
+            release.wait(5)
+
+        alice = pool.submit('alice', block)
+        self.assertTrue(started.wait(5))
+        bob = pool.submit('bob', lambda client: client.kwargs['uid'])
+        deadline = time.time() + 5
+        while len(self.created) < 2 and time.time() < deadline:
+            time.sleep(0.001)
+        # Bob's client is created, but node1 is busy with Alice's job.
+        time.sleep(0.05)
+        self.assertFalse(bob.done())
+        release.set()
+        self.assertEqual(bob.result(timeout=5), 'bob')
+        alice.result(timeout=5)
+
+    def test_job_errors_are_set_on_the_future(self):
+        pool = self._pool({'alice': 'node1'})
+
+        def failing(client):
+            raise ValueError('Boom')
+
+        self.assertRaises(ValueError,
+                          pool.submit('alice', failing).result, 5)
+
+    def test_client_creation_errors_are_set_on_the_future(self):
+        pool = self._pool({'alice': 'node1'})
+        self.sync_client.side_effect = SyncClientError('No token')
+        future = pool.submit('alice', mock.Mock())
+        self.assertRaises(SyncClientError, future.result, 5)
+
+    def test_map_runs_a_job_per_account(self):
+        pool = self._pool({'alice': 'node1', 'bob': 'node2'})
+        futures = pool.map(lambda client: client.kwargs['uid'])
+        self.assertEqual(
+            dict((account, future.result(timeout=5))
+                 for account, future in futures.items()),
+            {'alice': 'alice', 'bob': 'bob'})
+
+    def test_unknown_accounts_are_refused(self):
+        pool = self._pool({})
+        self.assertRaises(SyncClientError, pool.submit, 'alice', mock.Mock())
+        self.assertRaises(SyncClientError, pool.get_client, 'alice')
+
+    def test_close_waits_for_the_queued_jobs(self):
+        pool = self._pool({'alice': 'node1'}, max_workers=1)
+        futures = [pool.submit('alice', lambda client: time.sleep(0.01))
+                   for _ in range(3)]
+        pool.close()
+        self.assertTrue(all(future.done() for future in futures))
+        self.created[0].close.assert_called_with()
+        self.assertRaises(SyncClientError, pool.submit, 'alice', mock.Mock())
+
+    def test_remove_account_closes_its_client(self):
+        pool = self._pool({'alice': 'node1'})
+        client = pool.get_client('alice')
+        pool.remove_account('alice')
+        client.close.assert_called_with()
+        self.assertRaises(SyncClientError, pool.get_client, 'alice')
+
+    def test_context_manager_closes_the_pool(self):
+        with SyncClientPool() as pool:
+            pool.add_account('alice', uid='alice', hashalg='sha256',
+                             id='id', key='key',
+                             api_endpoint='https://node1/1.5/alice')
+            pool.get_client('alice')
+        self.created[0].close.assert_called_with()
+        self.assertRaises(SyncClientError, pool.submit, 'alice', mock.Mock())
@@ -0,0 +1,133 @@
+import mock
+
+from syncclient.store import RecordStore
+from .support import unittest
+
+
+class RecordStoreTest(unittest.TestCase):
+    def setUp(self):
+        super(RecordStoreTest, self).setUp()
+        self.store = RecordStore()
+        self.addCleanup(self.store.close)
+
+    def test_high_water_marks_are_kept_per_user_and_collection(self):
+        self.store.set_high_water_mark('alice', 'tabs', 12.5)
+        self.store.set_high_water_mark('bob', 'tabs', 3)
+        self.assertEqual(self.store.get_high_water_mark('alice', 'tabs'),
+                         12.5)
+        self.assertIsNone(self.store.get_high_water_mark('alice', 'forms'))
+        self.assertEqual(self.store.collections('bob'), {'tabs': 3})
+
+    def test_upsert_replaces_existing_records(self):
+        self.store.upsert_records('alice', 'tabs', [
+            {'id': 'a', 'payload': 'old', 'modified': 1},
+            {'id': 'b', 'payload': 'b', 'sortindex': 5}])
+        count = self.store.upsert_records('alice', 'tabs', [
+            {'id': 'a', 'payload': 'new', 'modified': 2}])
+        self.assertEqual(count, 1)
+        self.assertEqual(self.store.get_records('alice', 'tabs'), [
+            {'id': 'a', 'payload': 'new', 'modified': 2},
+            {'id': 'b', 'payload': 'b', 'sortindex': 5}])
+
+    def test_retain_records_deletes_the_others(self):
+        self.store.upsert_records('alice', 'tabs', [{'id': 'a'}, {'id': 'b'}])
+        self.assertEqual(self.store.retain_records('alice', 'tabs', ['b']), 1)
+        self.assertEqual(self.store.get_records('alice', 'tabs'),
+                         [{'id': 'b'}])
+
+    def test_delete_collection(self):
+        self.store.upsert_records('alice', 'tabs', [{'id': 'a'}])
+        self.store.set_high_water_mark('alice', 'tabs', 1)
+        self.store.delete_collection('alice', 'tabs')
+        self.assertEqual(self.store.get_records('alice', 'tabs'), [])
+        self.assertEqual(self.store.collections('alice'), {})
+
+
+class RecordStoreSyncTest(unittest.TestCase):
+    def setUp(self):
+        super(RecordStoreSyncTest, self).setUp()
+        self.store = RecordStore()
+        self.addCleanup(self.store.close)
+        self.client = mock.MagicMock(user_id='alice')
+        self.client.info_collections.return_value = {
+            'tabs': 10.5, 'forms': 20.5}
+        self.client.iter_records.side_effect = lambda name, newer: iter(
+            [{'id': '%s-%s' % (name, newer), 'modified': 5}])
+        self.client.get_records.return_value = ['tabs-10.5']
+
+    def test_first_sync_fetches_everything(self):
+        updated = self.store.sync(self.client)
+        self.assertEqual(updated, {'tabs': 1, 'forms': 1})
+        self.client.iter_records.assert_any_call('tabs', newer=None)
+        self.client.get_records.assert_not_called()
+        self.assertEqual(self.store.collections('alice'),
+                         {'tabs': 10.5, 'forms': 20.5})
+
+    def test_unchanged_collections_are_not_fetched(self):
+        self.store.sync(self.client)
+        self.client.iter_records.reset_mock()
+        self.assertEqual(self.store.sync(self.client), {})
+        self.client.iter_records.assert_not_called()
+
+    def test_changed_collections_fetch_newer_records_and_prune(self):
+        self.store.sync(self.client)
+        self.client.info_collections.return_value = {
+            'tabs': 15.5, 'forms': 20.5}
+        self.assertEqual(self.store.sync(self.client), {'tabs': 1})
+        self.client.iter_records.assert_called_with('tabs', newer=10.5)
+        self.client.get_records.assert_called_with('tabs', full=False)
+        self.assertEqual(self.store.get_records('alice', 'tabs'),
+                         [{'id': 'tabs-10.5', 'modified': 5}])
+        self.assertEqual(self.store.get_high_water_mark('alice', 'tabs'),
+                         15.5)
+
+    def test_removed_collections_are_dropped(self):
+        self.store.sync(self.client)
+        self.client.info_collections.return_value = {'forms': 20.5}
+        self.store.sync(self.client)
+        self.assertEqual(self.store.collections('alice'), {'forms': 20.5})
+        self.assertEqual(self.store.get_records('alice', 'tabs'), [])
+
+    def test_sync_can_be_limited_to_some_collections(self):
+        self.assertEqual(self.store.sync(self.client, collections=['Tabs']),
+                         {'tabs': 1})
+        self.assertEqual(self.store.collections('alice'), {'tabs': 10.5})
+
+
+class RecordStoreReconcileTest(unittest.TestCase):
+    def setUp(self):
+        super(RecordStoreReconcileTest, self).setUp()
+        self.store = RecordStore()
+        self.addCleanup(self.store.close)
+        self.store.upsert_records('alice', 'tabs', [
+            {'id': 'kept', 'modified': 5.5, 'payload': 'kept'},
+            {'id': 'changed', 'modified': 6.5, 'payload': 'old'},
+            {'id': 'removed', 'modified': 7.5, 'payload': 'removed'}])
+        self.store.set_high_water_mark('alice', 'tabs', 10.5)
+        self.client = mock.MagicMock(user_id='alice')
+        self.client.raw_resp.headers = {'X-Last-Modified': '20.50'}
+        self.client.get_records.side_effect = lambda name, full, newer=None: (
+            ['changed', 'added'] if newer is not None
+            else ['kept', 'changed', 'added'])
+        self.client.fetch_records.return_value = iter([
+            {'id': 'added', 'modified': 15.5, 'payload': 'added'},
+            {'id': 'changed', 'modified': 16.5, 'payload': 'new'}])
+
+    def test_snapshot(self):
+        self.assertEqual(self.store.snapshot('alice', 'tabs'),
+                         {'kept': 5.5, 'changed': 6.5, 'removed': 7.5})
+
+    def test_only_the_delta_is_fetched(self):
+        delta = self.store.reconcile(self.client, 'Tabs', max_workers=2)
+        self.assertEqual((delta.added, delta.changed, delta.removed),
+                         (['added'], ['changed'], ['removed']))
+        self.client.get_records.assert_any_call('tabs', full=False,
+                                                newer=10.5)
+        self.client.fetch_records.assert_called_with(
+            'tabs', ['added', 'changed'], max_workers=2)
+        self.assertEqual(self.store.get_records('alice', 'tabs'), [
+            {'id': 'added', 'modified': 15.5, 'payload': 'added'},
+            {'id': 'changed', 'modified': 16.5, 'payload': 'new'},
+            {'id': 'kept', 'modified': 5.5, 'payload': 'kept'}])
+        self.assertEqual(self.store.get_high_water_mark('alice', 'tabs'),
+                         20.5)